@@ -1,14 +1,16 @@
 from aiogram import Router, types, F
 from aiogram.types import MessageReactionUpdated
 from aiogram.filters import Command
-from ..services.db import log_message, db, get_user_stats, mark_message_reported, log_reaction, get_current_season_id, get_active_agreements, get_recent_messages, get_subsequent_messages, get_message, record_gamble_result, increment_false_report_count, add_points, update_edited_message, get_chat_users, dispute_agreement
-from ..services.ai import validate_report, transcribe_media, generate_cynical_comment
+from ..services.db import log_message, db, get_user_stats, mark_message_reported, log_reaction, get_current_season_id, get_recent_messages, get_subsequent_messages, get_message, record_gamble_result, increment_false_report_count, add_points, update_edited_message, get_chat_users, dispute_agreement, get_leaderboard, note_awarded_report
+from ..services.ai import validate_report_once, generate_cynical_comment
+from ..services.agreements import AgreementIndex
+from ..services.media import TRANSCRIPTION_PENDING, get_cached_transcript, schedule_transcription
+from .outbox import outbox
 from ..utils.text import escape
 from ..utils.game_config import config
 from ..utils import messages
 from datetime import datetime, timezone, timedelta
 import logging
-from io import BytesIO
 import random
 
 router = Router()
@@ -23,20 +25,8 @@ async def cmd_start(message: types.Message):
 
 @router.message(Command("stats"))
 async def cmd_stats(message: types.Message):
-    chat_id = str(message.chat.id)
-    stats_ref = db.collection("chats").document(chat_id).collection("user_stats")
     current_season = get_current_season_id()
-    
-    docs = stats_ref.stream()
-    stats_list = []
-    
-    async for doc in docs:
-        data = doc.to_dict()
-        if data.get('season_id') == current_season:
-            stats_list.append(data)
-            
-    stats_list.sort(key=lambda x: int(x.get('total_points', 0)), reverse=True)
-    top_stats = stats_list[:10]
+    top_stats = await get_leaderboard(message.chat.id, limit=10)
     
     text = f"🏆 <b>Топ Снитчей (Сезон {current_season}):</b>\n\n"
     if not top_stats:
@@ -77,7 +67,7 @@ async def cmd_rules(message: types.Message):
 async def cmd_agreements(message: types.Message):
     if not config.ENABLE_AGREEMENTS:
         return
-    agreements = await get_active_agreements(message.chat.id)
+    agreements = (await AgreementIndex.load(message.chat.id)).active
     if not agreements:
         await message.answer("🤝 <b>Договоренности:</b>\n\nНет действующих договоренностей. Живите спокойно... пока что.", parse_mode="HTML")
         return
@@ -114,17 +104,13 @@ async def cmd_dispute(message: types.Message):
         await message.answer("Укажи ID договоренности или порядковый номер из последнего отчета.\nПример: /dispute 1")
         return
 
-    # In a real scenario we might map number to ID from session state,
-    # but here we'll assume they pass the ID or we'd need to fetch the last analysis result.
-    # For now, let's look for the agreement by ID if it's long, or by "recent index" if it's small.
-    # To keep it simple, we'll fetch active agreements and use the index.
-    
+    # Numbers are positions in /agreements and in the reports' "/disput N" hints
     try:
-        idx = int(args[1]) - 1
-        active = await get_active_agreements(message.chat.id)
-        if 0 <= idx < len(active):
-            target_id = active[idx]['id']
-            success, error_code = await dispute_agreement(message.chat.id, target_id)
+        number = int(args[1])
+        agreements = await AgreementIndex.load(message.chat.id)
+        target = agreements.by_number(number)
+        if target:
+            success, error_code = await agreements.dispute(target['id'])
             if success:
                 await message.answer(messages.AGREEMENT_DISPUTE_SUCCESS, parse_mode="HTML")
             else:
@@ -168,7 +154,7 @@ async def cmd_all(message: types.Message):
     for i in range(0, len(mentions), chunk_size):
         chunk = mentions[i:i + chunk_size]
         text = messages.ALL_COMMAND_TITLE + " ".join(chunk)
-        await message.answer(text, parse_mode="HTML")
+        await outbox.send(message.bot, message.chat.id, text, kind="mention", parse_mode="HTML")
 
 @router.message(Command("status", "me"))
 async def cmd_status(message: types.Message):
@@ -231,7 +217,7 @@ async def cmd_report(message: types.Message):
     
     if not target_text and (reported_msg.voice or reported_msg.video_note):
         stored_msg = await get_message(message.chat.id, reported_msg.message_id)
-        if stored_msg:
+        if stored_msg and TRANSCRIPTION_PENDING not in (stored_msg.get('text') or ''):
              target_text = stored_msg.get('text')
     
     if not target_text and reported_msg.sticker:
@@ -247,25 +233,39 @@ async def cmd_report(message: types.Message):
 
     status_msg = await message.answer(messages.REPORT_ANALYSIS_START, parse_mode="HTML")
     
-    prev_msgs = await get_recent_messages(message.chat.id, reported_msg.date, limit=config.REPORT_CONTEXT_LIMIT)
-    next_msgs = await get_subsequent_messages(message.chat.id, reported_msg.date, limit=config.REPORT_NEXT_CONTEXT_LIMIT)
-    
-    context_msgs = prev_msgs + next_msgs
-    result = await validate_report(target_text, context_msgs)
+    async def load_context():
+        prev_msgs = await get_recent_messages(message.chat.id, reported_msg.date, limit=config.REPORT_CONTEXT_LIMIT)
+        next_msgs = await get_subsequent_messages(message.chat.id, reported_msg.date, limit=config.REPORT_NEXT_CONTEXT_LIMIT)
+        return prev_msgs + next_msgs
     
-    if result and result.get("valid"):
-        category = escape(result.get("category", "Unspecified"))
-        reason = escape(result.get("reason", "Violation detected"))
-        points = result.get("points", 0)
-        
+    async def apply_verdict(verdict):
+        points = verdict.get("points", 0)
         await mark_message_reported(
             message.chat.id,
             reported_msg.message_id,
             message.from_user.id,
-            f"{category}: {reason}",
+            f"{escape(verdict.get('category', 'Unspecified'))}: {escape(verdict.get('reason', 'Violation detected'))}",
             points_awarded=points
         )
         await add_points(message.chat.id, reported_msg.from_user.id, points)
+        if config.INCREMENTAL_ANALYSIS and points:
+            # The 30-minute pass may already have scored this message
+            await note_awarded_report(message.chat.id, reported_msg.date)
+    
+    result, is_duplicate = await validate_report_once(message.chat.id, reported_msg.message_id, target_text, load_context, apply_verdict)
+    
+    if result and result.get("valid"):
+        category = escape(result.get("category", "Unspecified"))
+        reason = escape(result.get("reason", "Violation detected"))
+        points = result.get("points", 0)
+        
+        if is_duplicate:
+            # Points were awarded by the first report of this message
+            await status_msg.edit_text(
+                messages.REPORT_ALREADY_ACCEPTED.format(category=category, points=points, reason=reason),
+                parse_mode="HTML"
+            )
+            return
         
         await status_msg.edit_text(
             messages.REPORT_ACCEPTED.format(category=category, points=points, reason=reason),
@@ -297,18 +297,17 @@ async def cmd_casino(message: types.Message):
         return
 
     is_win = random.random() < config.GAMBLE_WIN_CHANCE
-    current_points = stats.get('total_points', 0) if stats else 0
     
+    # Applied as a delta: the cached total may be stale, only the day check relies on it
     if is_win:
         deduction = config.GAMBLE_WIN_POINTS
-        new_points = max(0, current_points - deduction)
+        new_points = await record_gamble_result(chat_id, user_id, -deduction, today_str)
         text = messages.CASINO_WIN.format(deduction=deduction, new_points=new_points)
     else:
         penalty = config.GAMBLE_LOSS_POINTS
-        new_points = current_points + penalty
+        new_points = await record_gamble_result(chat_id, user_id, penalty, today_str)
         text = messages.CASINO_LOSS.format(penalty=penalty, new_points=new_points)
         
-    await record_gamble_result(chat_id, user_id, new_points, today_str)
     await message.reply(text, parse_mode="HTML")
 
 @router.message_reaction()
@@ -361,20 +360,17 @@ def should_comment(message: types.Message, stats: dict) -> bool:
 @router.message(F.text | F.sticker | F.voice | F.video_note)
 async def handle_messages(message: types.Message):
     override_text = None
+    pending_media = None
     if message.voice or message.video_note:
-        try:
-            file_id = message.voice.file_id if message.voice else message.video_note.file_id
-            file_info = await message.bot.get_file(file_id)
-            file_io = BytesIO()
-            await message.bot.download_file(file_info.file_path, file_io)
-            file_bytes = file_io.getvalue()
-            mime_type = "audio/ogg" if message.voice else "video/mp4"
-            transcription = await transcribe_media(file_bytes, mime_type)
-            prefix = "[VOICE]" if message.voice else "[VIDEO NOTE]"
+        media = message.voice or message.video_note
+        prefix = "[VOICE]" if message.voice else "[VIDEO NOTE]"
+        transcription = get_cached_transcript(media.file_unique_id)
+        if transcription is not None:
             override_text = f"{prefix} {transcription}"
-        except Exception as e:
-            logging.error(f"Failed to transcribe media: {e}")
-            override_text = f"[{'VOICE' if message.voice else 'VIDEO NOTE'}] (Transcription Failed)"
+        else:
+            # Logged right away, the transcript is patched in when it is ready
+            override_text = f"{prefix} {TRANSCRIPTION_PENDING}"
+            pending_media = (media, prefix, "audio/ogg" if message.voice else "video/mp4")
     
     if message.sticker:
          override_text = f"[STICKER] {message.sticker.emoji or 'Unknown'} (File ID: {message.sticker.file_unique_id})"
@@ -383,6 +379,14 @@ async def handle_messages(message: types.Message):
         await log_message(message, override_text=override_text)
     except Exception as e:
         logging.error(f"Failed to log message: {e}")
+        pending_media = None  # Nothing stored to patch
+
+    if pending_media:
+        media, prefix, mime_type = pending_media
+        schedule_transcription(
+            message.bot, message.chat.id, message.message_id,
+            media.file_id, media.file_unique_id, media.file_size, mime_type, prefix
+        )
 
     # Cynical Comment Logic
     if message.text and not message.text.startswith('/'):
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramRetryAfter
+
+from ..services import metrics
+from ..utils.game_config import config
+from ..utils.text import split_message
+
+
+class TokenBucket:
+    """
+    Reservation-style token bucket: `reserve()` always takes a token and returns
+    how long the caller has to wait before using it, so concurrent callers are
+    served in the order they reserved without a lock.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate, self.blocked_until - now)
+
+    def block(self, seconds: float):
+        """
+        Flood control: nothing goes out before `seconds` from now. The saved-up burst is
+        dropped, so after the block the bucket holds only what refilled meanwhile.
+        """
+        now = time.monotonic()
+        self._refill(now)
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = min(self.tokens, 0.0)
+
+    @property
+    def idle(self) -> bool:
+        now = time.monotonic()
+        return now >= self.blocked_until and self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class Outbox:
+    """
+    Rate-limited sender for bot-initiated messages (nightly summaries, broadcasts, /all).
+
+    Messages of one chat go out in order, one at a time, paced by a per-chat bucket
+    (Telegram allows about 20 messages a minute in a group and one a second in a
+    private chat); every chat also draws from a global bucket (about 30 a second
+    per bot). A RetryAfter blocks the chat for the requested time and the message
+    is retried; texts over 4096 characters are sent as several messages.
+    """
+
+    def __init__(self, global_rate: float, group_rate: float, private_rate: float, burst: int, max_retries: int):
+        self.group_rate = group_rate
+        self.private_rate = private_rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}  # str(chat_id) -> (TokenBucket, asyncio.Lock)
+        self._waiting = 0
+        self._stats = {"sent": 0, "parts": 0, "failed": 0, "retry_after": 0, "total_wait_seconds": 0.0, "max_wait_seconds": 0.0}
+
+    def _chat(self, chat_id):
+        chat_id = str(chat_id)
+        entry = self._chats.get(chat_id)
+        if entry is None:
+            if len(self._chats) >= 10000:
+                self._prune()
+            # Negative IDs are groups and channels
+            rate = self.group_rate if int(chat_id) < 0 else self.private_rate
+            entry = self._chats[chat_id] = (TokenBucket(rate, self.burst), asyncio.Lock())
+        return entry
+
+    def _prune(self):
+        for chat_id, (bucket, lock) in list(self._chats.items()):
+            if bucket.idle and not lock.locked():
+                del self._chats[chat_id]
+
+    async def _send_part(self, bot, chat_id, bucket: TokenBucket, text: str, kind: str, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            await asyncio.sleep(bucket.reserve())
+            await asyncio.sleep(self._global.reserve())
+            waited = time.monotonic() - started
+            self._stats["total_wait_seconds"] += waited
+            self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], waited)
+            metrics.telegram_send_wait_seconds.observe(waited, kind=kind)
+            try:
+                return await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            except TelegramRetryAfter as e:
+                self._stats["retry_after"] += 1
+                metrics.telegram_retry_after.inc(kind=kind)
+                if attempt == self.max_retries:
+                    raise
+                logging.warning(f"[outbox] Flood control in chat {chat_id}, retrying in {e.retry_after}s")
+                bucket.block(e.retry_after)
+
+    async def send(self, bot, chat_id, text: str, kind: str = "message", **kwargs):
+        """
+        Sends `text` to the chat, split into several messages if needed.
+        Returns the sent messages; raises like bot.send_message once retries are spent.
+        """
+        bucket, lock = self._chat(chat_id)
+        parts = split_message(text, parse_html=kwargs.get("parse_mode") == "HTML")
+        sent = []
+        self._waiting += 1
+        try:
+            async with lock:
+                for part in parts:
+                    sent.append(await self._send_part(bot, chat_id, bucket, part, kind, **kwargs))
+                    self._stats["parts"] += 1
+        except Exception:
+            self._stats["failed"] += 1
+            metrics.telegram_sends.inc(kind=kind, status="failed")
+            raise
+        finally:
+            self._waiting -= 1
+        self._stats["sent"] += 1
+        metrics.telegram_sends.inc(kind=kind, status="sent")
+        return sent
+
+    def stats(self) -> dict:
+        return {**self._stats, "waiting": self._waiting, "chats": len(self._chats)}
+
+
+outbox = Outbox(
+    global_rate=config.OUTBOX_GLOBAL_RATE,
+    group_rate=config.OUTBOX_GROUP_MESSAGES_PER_MINUTE / 60,
+    private_rate=config.OUTBOX_PRIVATE_RATE,
+    burst=config.OUTBOX_CHAT_BURST,
+    max_retries=config.OUTBOX_MAX_RETRIES
+)
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiogram import types
+from aiogram.types.update import UpdateTypeLookupError
+
+
+def get_update_kind(update: types.Update) -> str:
+    """Name of the event the update carries (message, edited_message, ...)."""
+    try:
+        return update.event_type
+    except UpdateTypeLookupError:
+        return "unknown"
+
+
+def get_chat_key(update: types.Update):
+    """
+    Returns the ordering key for an update: the chat it belongs to.
+    Updates without a chat have no ordering constraints.
+    """
+    for field in ("message", "edited_message", "message_reaction", "channel_post", "edited_channel_post"):
+        event = getattr(update, field, None)
+        if event is not None and getattr(event, "chat", None) is not None:
+            return event.chat.id
+    return f"update:{update.update_id}"
+
+
+class UpdateQueue:
+    """
+    Bounded worker pool for Telegram updates.
+
+    Updates of the same chat are processed strictly in arrival order, at most
+    one at a time; different chats run in parallel on up to `workers` workers.
+    `submit` never blocks: when `max_pending` updates are already waiting it
+    refuses the update so the webhook can push back on Telegram.
+    """
+
+    def __init__(self, handler, workers: int, max_pending: int):
+        self._handler = handler
+        self.workers = workers
+        self.max_pending = max_pending
+        self._chats = {}  # chat key -> deque of (update, enqueued_at)
+        self._ready = asyncio.Queue()  # chat keys with work and no worker on them
+        self._busy = set()
+        self._pending = 0
+        self._tasks = []
+        self._stats = {
+            "submitted": 0,
+            "processed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "max_pending_seen": 0,
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+        }
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def submit(self, update: types.Update) -> bool:
+        """Queues an update. Returns False if the queue is full."""
+        if self._pending >= self.max_pending:
+            self._stats["rejected"] += 1
+            return False
+
+        key = get_chat_key(update)
+        chat_queue = self._chats.setdefault(key, deque())
+        chat_queue.append((update, time.monotonic()))
+        self._pending += 1
+        self._stats["submitted"] += 1
+        self._stats["max_pending_seen"] = max(self._stats["max_pending_seen"], self._pending)
+
+        # A busy chat is re-scheduled by its worker once the current update is done
+        if key not in self._busy and len(chat_queue) == 1:
+            self._ready.put_nowait(key)
+        return True
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            chat_queue = self._chats[key]
+            update, enqueued_at = chat_queue.popleft()
+            self._busy.add(key)
+
+            wait = time.monotonic() - enqueued_at
+            self._stats["total_wait_seconds"] += wait
+            self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], wait)
+
+            try:
+                await self._handler(update)
+                self._stats["processed"] += 1
+            except Exception as e:
+                self._stats["failed"] += 1
+                logging.error(f"Failed to process update {update.update_id} (chat {key}): {e}")
+            finally:
+                self._pending -= 1
+                self._busy.discard(key)
+                if chat_queue:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._chats[key]
+
+    def start(self):
+        if self.running:
+            return
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0):
+        """Waits up to `timeout` seconds for queued updates to drain, then stops the workers."""
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._pending:
+            logging.warning(f"Update queue stopped with {self._pending} unprocessed updates.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        done = self._stats["processed"] + self._stats["failed"]
+        return {
+            **self._stats,
+            "pending": self._pending,
+            "in_flight": len(self._busy),
+            "active_chats": len(self._chats),
+            "avg_wait_seconds": self._stats["total_wait_seconds"] / done if done else 0.0,
+        }
@@ -1,16 +1,25 @@
 from fastapi import FastAPI, Request, Header, HTTPException
+from fastapi.responses import PlainTextResponse
 from aiogram import Bot, Dispatcher, types
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from src.utils.config import settings
 from src.bot.handlers import router
-from src.services.db import get_logs_for_time_range, save_daily_results, apply_weekly_amnesty, db, get_active_agreements, save_agreement, check_afk_users, update_agreement_status, get_agreement_by_id, update_agreement_text, get_last_agreement_check, set_last_agreement_check
-from google.cloud import firestore
-from src.services.ai import analyze_daily_logs
+from src.bot.update_queue import UpdateQueue, get_chat_key, get_update_kind
+from src.bot.outbox import outbox
+from src.services.db import warm_up_client, get_logs_for_time_range, save_daily_results, apply_weekly_amnesty, write_buffer, user_stats_cache, recent_messages, check_afk_users, get_last_agreement_check, set_last_agreement_check, get_active_chat_ids, save_analysis_slice, get_analysis_slices, rebuild_roster, expire_agreements, get_recent_messages, get_awarded_reports, prune_awarded_reports
+from src.services.ai import analyze_daily_logs, get_ai_stats, warm_up_models
+from src.services.fanout import run_for_chats
+from src.services.lease import with_chat_lease
+from src.services.agreements import AgreementIndex, agreement_prefilter
+from src.services import archive, media, metrics
+from src.services.incremental import find_uncovered_ranges, merge_partial_verdicts, drop_reported_slices
 from src.utils.text import escape
 from src.utils.game_config import config
 from src.utils import messages
 from datetime import datetime, timezone, timedelta, time
+import asyncio
 import logging
+from time import perf_counter
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -18,39 +27,88 @@ logging.basicConfig(level=logging.INFO)
 app = FastAPI()
 scheduler = AsyncIOScheduler()
 
-# Initialize Bot and Dispatcher
-bot = Bot(token=settings.TELEGRAM_TOKEN)
+_bot = None
 
+def get_bot() -> Bot:
+    """The bot, built on first use so importing this module reads no settings."""
+    global _bot
+    if _bot is None:
+        _bot = Bot(token=settings.TELEGRAM_TOKEN)
+    return _bot
+
+def format_new_agreements(new_agreements, index: AgreementIndex) -> str:
+    """Summary lines for agreements created in this run, with their /disput numbers."""
+    text = messages.NEW_AGREEMENTS_TITLE
+    for ag in new_agreements:
+        ag_type = ag.get('type', 'vow')
+        icon = "🕯"
+        if ag_type == "pact": icon = "🤝"
+        elif ag_type == "public": icon = "📢"
+        
+        users = ag.get('users', [])
+        users_str = ", ".join([f"<b>{escape(u if u.startswith('@') else '@'+u)}</b>" for u in users])
+        
+        text += f"{icon} {users_str}: {escape(ag.get('text'))}"
+        number = index.number(ag['id'])
+        if number:
+            text += f" (Оспорить: /disput {number})"
+        text += "\n"
+    text += messages.AGREEMENT_CREATED_FOOTER.format(minutes=config.AGREEMENT_DISPUTE_WINDOW_MINUTES)
+    return text
+
+async def analyze_incrementally(chat_id: str, start_dt_utc: datetime, end_dt_utc: datetime, active_agreements, today_str: str):
+    """
+    Builds the daily verdict from partial verdicts of the 30-minute passes.
+    Only messages not covered by a stored slice (failed or skipped passes, slices
+    with a message rewarded by /report afterwards, the tail after the last pass)
+    are sent to the AI, together with the slices' candidate offenders, and that
+    call picks the day's offenders. If it fails, the candidates are merged and
+    capped instead. Returns (ai_result, message_count).
+    """
+    slices = await get_analysis_slices(chat_id, start_dt_utc, end_dt_utc)
+    awarded_reports = await get_awarded_reports(chat_id)
+    slices = drop_reported_slices(slices, awarded_reports)
+    gaps = find_uncovered_ranges(start_dt_utc, end_dt_utc, slices)
+    
+    gap_logs = []
+    for gap_start, gap_end in gaps:
+        gap_logs.extend(await get_logs_for_time_range(chat_id, gap_start, gap_end))
+    
+    logging.info(f"Incremental analysis for chat {chat_id}: {len(slices)} slices reused, {len(gap_logs)} uncovered messages.")
+    
+    candidates = [off for slice_data in slices for off in slice_data.get('offenders', [])]
+    tail_result = None
+    if gap_logs or candidates:
+        context_logs = None
+        if gap_logs:
+            context_logs = await get_recent_messages(chat_id, gap_logs[0]['timestamp'], limit=config.ANALYSIS_CONTEXT_MESSAGES)
+        tail_result = await analyze_daily_logs(gap_logs, active_agreements=active_agreements, date_str=today_str,
+                                               context_logs=context_logs, candidates=candidates)
+    
+    # Reports before this window will not be re-judged by any later run
+    await prune_awarded_reports(chat_id, [ts for ts in awarded_reports if ts < start_dt_utc])
+    
+    message_count = sum(s.get('message_count', 0) for s in slices) + len(gap_logs)
+    if not slices and not tail_result:
+        return None, message_count
+    
+    # Agreements found by slice passes were already saved and announced by
+    # perform_agreement_check, so only the tail contributes new/updated ones.
+    merged = merge_partial_verdicts(slices + [tail_result])
+    if tail_result:
+        # The nightly call already judged the candidates as one day
+        merged["offenders"] = tail_result.get("offenders", [])
+    merged["new_agreements"] = tail_result.get("new_agreements", []) if tail_result else []
+    merged["updated_agreements"] = tail_result.get("updated_agreements", []) if tail_result else []
+    return merged, message_count
+
+@with_chat_lease("daily_analysis")
 async def perform_chat_analysis(chat_id: str):
     """
     Core logic for daily analysis.
+    Holds the chat's lease, so concurrent instances never analyze the same chat twice.
     """
     moscow_tz = timezone(timedelta(hours=config.TIMEZONE_OFFSET))
-    now_utc = datetime.now(timezone.utc)
-    
-    # 0. Distributed Lock to prevent concurrent analysis for the same chat
-    # We use a lock document with a TTL (5 minutes)
-    lock_ref = db.collection("chats").document(chat_id).collection("locks").document("daily_analysis")
-    
-    try:
-        lock_doc = await lock_ref.get()
-        if lock_doc.exists:
-            lock_data = lock_doc.to_dict()
-            lock_time = lock_data.get("timestamp")
-            if lock_time:
-                # Ensure TZ awareness for comparison
-                if lock_time.tzinfo is None:
-                    lock_time = lock_time.replace(tzinfo=timezone.utc)
-                
-                if now_utc - lock_time < timedelta(minutes=5):
-                    logging.warning(f"Analysis for chat {chat_id} is already in progress (Locked {now_utc - lock_time} ago). Skipping.")
-                    return {"status": "locked"}
-        
-        # Acquire lock
-        await lock_ref.set({"timestamp": firestore.SERVER_TIMESTAMP})
-    except Exception as e:
-        logging.error(f"Locking error for chat {chat_id}: {e}")
-        # Proceed anyway if lock check fails, to avoid deadlocks
     now_msk = datetime.now(moscow_tz)
     
     # Determine the date we are analyzing.
@@ -67,20 +125,24 @@ async def perform_chat_analysis(chat_id: str):
     start_dt_utc = start_dt_msk.astimezone(timezone.utc)
     
     today_str = end_dt_msk.strftime("%Y-%m-%d")
-    active_agreements = await get_active_agreements(chat_id)
+    agreements = await AgreementIndex.load(chat_id)
+    active_agreements = agreements.active
     
     logging.info(f"Starting analysis for chat {chat_id}. Window (MSK): {start_dt_msk} to {end_dt_msk}")
-    logs = await get_logs_for_time_range(chat_id, start_dt_utc, end_dt_utc)
-    
     ai_result = None
-    if logs:
-        ai_result = await analyze_daily_logs(logs, active_agreements=active_agreements, date_str=today_str)
+    if config.INCREMENTAL_ANALYSIS:
+        ai_result, message_count = await analyze_incrementally(chat_id, start_dt_utc, end_dt_utc, active_agreements, today_str)
+    else:
+        logs = await get_logs_for_time_range(chat_id, start_dt_utc, end_dt_utc)
+        message_count = len(logs)
+        if logs:
+            ai_result = await analyze_daily_logs(logs, active_agreements=active_agreements, date_str=today_str)
     
     afk_offenders = await check_afk_users(chat_id)
     
-    if not logs and not afk_offenders:
+    if not message_count and not afk_offenders:
         logging.info("No logs and no AFK violations.")
-        await bot.send_message(chat_id=chat_id, text="Сегодня слишком тихо... Снитч не найден. (Нет логов и нарушений)")
+        await outbox.send(get_bot(), chat_id, "Сегодня слишком тихо... Снитч не найден. (Нет логов и нарушений)", kind="daily_summary")
         return {"status": "no logs"}
 
     final_result = {
@@ -103,27 +165,32 @@ async def perform_chat_analysis(chat_id: str):
         await save_daily_results(chat_id, final_result)
         
         # 4. Process new agreements
-        new_agreements = final_result.get('new_agreements', [])
-        for ag in new_agreements:
-            await save_agreement(chat_id, ag)
+        new_agreements = [agreements.add(ag) for ag in final_result.get('new_agreements', [])]
             
         # 5. Process resolved agreements
-        resolved_agreements = final_result.get('resolved_agreements', [])
-        for res in resolved_agreements:
+        resolved_agreements = []
+        for res in final_result.get('resolved_agreements', []):
             res_id = res.get('id')
             status = res.get('status')
             reason = res.get('reason')
             if res_id and status in ['fulfilled', 'broken']:
-                await update_agreement_status(chat_id, res_id, status, reason)
+                resolved = agreements.resolve(res_id, status, reason)
+                if resolved:
+                    resolved_agreements.append(resolved)
         
         # 5b. Process updated agreements
-        updated_agreements = final_result.get('updated_agreements', [])
-        for upd in updated_agreements:
+        updated_agreements = []
+        for upd in final_result.get('updated_agreements', []):
             upd_id = upd.get('id')
             new_text = upd.get('text')
             reason = upd.get('reason')
             if upd_id and new_text:
-                await update_agreement_text(chat_id, upd_id, new_text, reason)
+                updated = agreements.update_text(upd_id, new_text, reason)
+                if updated:
+                    updated_agreements.append(updated)
+        
+        # All agreement writes of the run in one batch
+        await agreements.commit()
 
         offenders = final_result.get('offenders', [])
         
@@ -150,41 +217,15 @@ async def perform_chat_analysis(chat_id: str):
                 text += "\n"
         
         if new_agreements:
-            text += messages.NEW_AGREEMENTS_TITLE
-            all_active = await get_active_agreements(chat_id)
-            for ag in new_agreements:
-                 ag_type = ag.get('type', 'vow')
-                 icon = "🕯"
-                 if ag_type == "pact": icon = "🤝"
-                 elif ag_type == "public": icon = "📢"
-                 
-                 users = ag.get('users', [])
-                 users_str = ", ".join([f"<b>{escape(u if u.startswith('@') else '@'+u)}</b>" for u in users])
-                 
-                 # Find index in all_active
-                 ag_text = ag.get('text')
-                 idx = -1
-                 for i, active_ag in enumerate(all_active, 1):
-                     if active_ag.get('text') == ag_text:
-                         idx = i
-                         break
-                 
-                 text += f"{icon} {users_str}: {escape(ag_text)}"
-                 if idx != -1:
-                     text += f" (Оспорить: /disput {idx})"
-                 text += "\n"
-            text += messages.AGREEMENT_CREATED_FOOTER.format(minutes=config.AGREEMENT_DISPUTE_WINDOW_MINUTES)
+            text += format_new_agreements(new_agreements, agreements)
 
         # 6. Add resolved agreements to summary
         if resolved_agreements:
             text += "\n\n⚖️ <b>Итоги по старым базарам:</b>\n"
             for res in resolved_agreements:
-                res_id = res.get('id')
                 status = res.get('status')
-                # Try to find original agreement text
-                orig_ag = await get_agreement_by_id(chat_id, res_id)
-                orig_text = orig_ag.get('text', '???') if orig_ag else '???'
-                orig_users = ", ".join([f"<b>{escape(u)}</b>" for u in orig_ag.get('users', [])]) if orig_ag else '???'
+                orig_text = res.get('text', '???')
+                orig_users = ", ".join([f"<b>{escape(u)}</b>" for u in res.get('users', [])])
                 
                 if status == 'fulfilled':
                     text += f"✅ <b>Сдержал слово:</b> {orig_users} — «{escape(orig_text)}»\n"
@@ -195,28 +236,28 @@ async def perform_chat_analysis(chat_id: str):
         if updated_agreements:
             text += "\n\n🔄 <b>Обновления по базарам:</b>\n"
             for upd in updated_agreements:
-                upd_id = upd.get('id')
-                new_text = upd.get('text')
-                # Fetch original to show "before -> after"
-                orig_ag = await get_agreement_by_id(chat_id, upd_id)
-                orig_users = ", ".join(orig_ag.get('users', [])) if orig_ag else '???'
-                text += f"📝 {orig_users}: {escape(new_text)}\n"
+                orig_users = ", ".join(upd.get('users', []))
+                text += f"📝 {orig_users}: {escape(upd.get('text'))}\n"
                  
-        await bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML")
+        await outbox.send(get_bot(), chat_id, text, kind="daily_summary", parse_mode="HTML")
 
-    # Release lock
+    # Resync the roster once a day to pick up manual edits (e.g. achievements)
     try:
-        await lock_ref.delete()
+        await rebuild_roster(chat_id)
     except Exception as e:
-        logging.error(f"Failed to release lock for chat {chat_id}: {e}")
+        logging.error(f"Failed to rebuild roster for chat {chat_id}: {e}")
 
     return {"status": "analyzed", "result": final_result}
 
+@with_chat_lease("agreement_check")
 async def perform_agreement_check(chat_id: str):
     """
     Checks for new agreements every 30 minutes.
+    With INCREMENTAL_ANALYSIS, also stores the pass as a partial verdict
+    for the nightly analysis. Slices the keyword pre-filter finds nothing in
+    are not sent to AI.
     """
-    if not config.ENABLE_AGREEMENTS:
+    if not config.ENABLE_AGREEMENTS and not config.INCREMENTAL_ANALYSIS:
         return
         
     now_utc = datetime.now(timezone.utc)
@@ -232,120 +273,156 @@ async def perform_agreement_check(chat_id: str):
         
     logs = await get_logs_for_time_range(chat_id, last_check, now_utc)
     if not logs:
+        if config.INCREMENTAL_ANALYSIS:
+            # Record the empty slice so the nightly run knows it is covered
+            await save_analysis_slice(chat_id, last_check, now_utc, None, 0)
         await set_last_agreement_check(chat_id, now_utc)
         return
     
-    active_agreements = await get_active_agreements(chat_id)
-    ai_result = await analyze_daily_logs(logs, active_agreements=active_agreements)
+    agreements = await AgreementIndex.load(chat_id)
+    if config.ENABLE_AGREEMENTS and config.AGREEMENT_PREFILTER_ENABLED:
+        reason = agreement_prefilter(logs, agreements.active)
+        metrics.agreement_prefilter.inc(decision="escalate" if reason else "skip", reason=reason or "none")
+        if not reason:
+            # Nothing resembling an agreement; without a stored slice the nightly run analyzes these messages
+            logging.info(f"Agreement check for chat {chat_id}: no markers in {len(logs)} messages, AI call skipped.")
+            await set_last_agreement_check(chat_id, now_utc)
+            return
+    
+    # The slice starts mid-conversation: series and replies need the messages before it
+    context_logs = await get_recent_messages(chat_id, logs[0]['timestamp'], limit=config.ANALYSIS_CONTEXT_MESSAGES)
+    ai_result = await analyze_daily_logs(logs, active_agreements=agreements.active, context_logs=context_logs, slice_pass=True)
     
     if not ai_result:
+        # No slice is stored, so the nightly run re-analyzes these messages
+        await set_last_agreement_check(chat_id, now_utc)
+        return
+    
+    if config.INCREMENTAL_ANALYSIS:
+        await save_analysis_slice(chat_id, last_check, now_utc, ai_result, len(logs))
+    
+    if not config.ENABLE_AGREEMENTS:
         await set_last_agreement_check(chat_id, now_utc)
         return
 
-    new_agreements = ai_result.get("new_agreements", [])
-    updated_agreements = ai_result.get("updated_agreements", [])
+    new_agreements = [agreements.add(ag) for ag in ai_result.get("new_agreements", [])]
+    updated_agreements = []
+    for upd in ai_result.get("updated_agreements", []):
+        upd_id = upd.get('id')
+        new_text = upd.get('text')
+        reason = upd.get('reason')
+        if upd_id and new_text:
+            updated = agreements.update_text(upd_id, new_text, reason)
+            if updated:
+                updated_agreements.append(updated)
+    await agreements.commit()
     
     text = ""
     if new_agreements:
-        text += messages.NEW_AGREEMENTS_TITLE
-        for ag in new_agreements:
-            await save_agreement(chat_id, ag)
-        
-        all_active = await get_active_agreements(chat_id)
-        for ag in new_agreements:
-            ag_type = ag.get('type', 'vow')
-            icon = "🕯"
-            if ag_type == "pact": icon = "🤝"
-            elif ag_type == "public": icon = "📢"
-            users = ag.get('users', [])
-            users_str = ", ".join([f"<b>{escape(u if u.startswith('@') else '@'+u)}</b>" for u in users])
-            
-            # Find index in all_active
-            ag_text = ag.get('text')
-            idx = -1
-            for i, active_ag in enumerate(all_active, 1):
-                if active_ag.get('text') == ag_text:
-                    idx = i
-                    break
-            
-            text += f"{icon} {users_str}: {escape(ag_text)}"
-            if idx != -1:
-                text += f" (Оспорить: /disput {idx})"
-            text += "\n"
-        text += messages.AGREEMENT_CREATED_FOOTER.format(minutes=config.AGREEMENT_DISPUTE_WINDOW_MINUTES)
+        text += format_new_agreements(new_agreements, agreements)
 
     if updated_agreements:
         text += "\n\n🔄 <b>Обновления по базарам:</b>\n"
         for upd in updated_agreements:
-            upd_id = upd.get('id')
-            new_text = upd.get('text')
-            reason = upd.get('reason')
-            if upd_id and new_text:
-                await update_agreement_text(chat_id, upd_id, new_text, reason)
-                orig_ag = await get_agreement_by_id(chat_id, upd_id)
-                orig_users = ", ".join(orig_ag.get('users', [])) if orig_ag else '???'
-                text += f"📝 {orig_users}: {escape(new_text)}\n"
+            orig_users = ", ".join(upd.get('users', []))
+            text += f"📝 {orig_users}: {escape(upd.get('text'))}\n"
 
     if text:
-        await bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML")
+        await outbox.send(get_bot(), chat_id, text, kind="agreement_check", parse_mode="HTML")
     
     await set_last_agreement_check(chat_id, now_utc)
 
-async def scheduled_agreement_check():
-    logging.info("Starting scheduled agreement check...")
+@with_chat_lease("weekly_amnesty")
+async def perform_weekly_amnesty(chat_id: str):
+    """
+    Applies the weekly amnesty to one chat and announces it.
+    """
+    logging.info(f"Applying amnesty for chat {chat_id}")
+    await apply_weekly_amnesty(chat_id)
+    
     try:
-        chats_ref = db.collection("chats")
-        async for chat_doc in chats_ref.stream():
-            chat_data = chat_doc.to_dict()
-            if not chat_data.get("active"):
-                continue
-            await perform_agreement_check(chat_doc.id)
+        await outbox.send(get_bot(), chat_id, messages.AMNESTY_MESSAGE, kind="amnesty", parse_mode="HTML")
     except Exception as e:
-        logging.error(f"Error in scheduled agreement check: {e}")
+        logging.error(f"Failed to send amnesty announcement to {chat_id}: {e}")
+    return {"status": "amnesty_applied"}
 
-async def scheduled_daily_analysis():
-    logging.info("Starting scheduled daily analysis...")
+@with_chat_lease("message_archival")
+async def perform_message_archival(chat_id: str):
+    """
+    Moves the chat's messages past the retention period to the archive.
+    """
+    return await archive.archive_chat(chat_id)
+
+@with_chat_lease("agreement_expiry")
+async def perform_agreement_expiry(chat_id: str):
+    """
+    Marks the chat's agreements past their expires_at as expired.
+    """
+    expired = await expire_agreements(chat_id)
+    if expired:
+        logging.info(f"Expired {expired} agreements in chat {chat_id}")
+    return {"status": "expired", "agreements": expired}
+
+async def run_scheduled_job(job_name: str, job):
+    """
+    Fans a per-chat job out over all active chats.
+    """
+    logging.info(f"Starting scheduled {job_name}...")
     try:
-        chats_ref = db.collection("chats")
-        async for chat_doc in chats_ref.stream():
-            chat_data = chat_doc.to_dict()
-            if not chat_data.get("active"):
-                continue
-            
-            chat_id = chat_doc.id
-            logging.info(f"Running daily analysis for chat {chat_id}")
-            try:
-                await perform_chat_analysis(chat_id)
-            except Exception as e:
-                logging.error(f"Failed to analyze chat {chat_id}: {e}")
-                
+        chat_ids = await get_active_chat_ids()
+        return await run_for_chats(
+            job_name,
+            chat_ids,
+            job,
+            concurrency=config.SCHEDULER_CONCURRENCY,
+            timeout=config.SCHEDULER_CHAT_TIMEOUT_SECONDS
+        )
     except Exception as e:
-        logging.error(f"Error in scheduled analysis: {e}")
+        logging.error(f"Error in scheduled {job_name}: {e}")
+        return []
+
+async def scheduled_agreement_check():
+    await run_scheduled_job("agreement check", perform_agreement_check)
+
+async def scheduled_daily_analysis():
+    await run_scheduled_job("daily analysis", perform_chat_analysis)
 
 async def scheduled_weekly_decay():
-    logging.info("Starting scheduled weekly amnesty...")
-    try:
-        chats_ref = db.collection("chats")
-        async for chat_doc in chats_ref.stream():
-            chat_data = chat_doc.to_dict()
-            if not chat_data.get("active"):
-                continue
-                
-            chat_id = chat_doc.id
-            logging.info(f"Applying amnesty for chat {chat_id}")
-            await apply_weekly_amnesty(chat_id)
-            
-            try:
-                await bot.send_message(
-                    chat_id=chat_id,
-                    text=messages.AMNESTY_MESSAGE,
-                    parse_mode="HTML"
-                )
-            except Exception as e:
-                logging.error(f"Failed to send amnesty announcement to {chat_id}: {e}")
-                
-    except Exception as e:
-        logging.error(f"Error in scheduled amnesty: {e}")
+    await run_scheduled_job("weekly amnesty", perform_weekly_amnesty)
+
+async def scheduled_agreement_expiry():
+    await run_scheduled_job("agreement expiry", perform_agreement_expiry)
+
+async def scheduled_message_archival():
+    await run_scheduled_job("message archival", perform_message_archival)
+
+_warmup_task = None
+
+async def _warm_up() -> dict:
+    """Opens the Firestore, Vertex AI and Telegram connections; returns seconds per step."""
+    async def step(name, coro):
+        started = perf_counter()
+        try:
+            await coro
+            return name, round(perf_counter() - started, 3)
+        except Exception as e:
+            logging.error(f"Warmup of {name} failed: {e}")
+            return name, f"error: {e}"
+
+    results = dict(await asyncio.gather(
+        step("firestore", warm_up_client()),
+        step("vertex_ai", warm_up_models()),
+        step("telegram", get_bot().get_me()),
+    ))
+    logging.info(f"Warmup finished: {results}")
+    return results
+
+def start_warmup():
+    """Starts the warmup once; a failed step lets the next call try again."""
+    global _warmup_task
+    if _warmup_task is None or (_warmup_task.done() and any(isinstance(v, str) for v in _warmup_task.result().values())):
+        _warmup_task = asyncio.create_task(_warm_up())
+    return _warmup_task
 
 @app.on_event("startup")
 async def on_startup():
@@ -361,28 +438,115 @@ async def on_startup():
         commands.append(types.BotCommand(command="agreements", description="Список договоренностей"))
         commands.append(types.BotCommand(command="dispute", description="Оспорить слово пацана"))
         
-    await bot.set_my_commands(commands)
+    await get_bot().set_my_commands(commands)
     scheduler.add_job(scheduled_weekly_decay, 'cron', day_of_week='sun', hour=23, minute=59)
     
-    if config.ENABLE_AGREEMENTS:
+    if config.ENABLE_AGREEMENTS or config.INCREMENTAL_ANALYSIS:
         scheduler.add_job(scheduled_agreement_check, 'interval', minutes=30)
+    
+    if config.ENABLE_AGREEMENTS:
+        scheduler.add_job(scheduled_agreement_expiry, 'interval', minutes=config.AGREEMENT_EXPIRY_SWEEP_MINUTES)
+    
+    if config.MESSAGE_ARCHIVE_ENABLED:
+        # Quiet hours, after the nightly analysis has read yesterday
+        scheduler.add_job(scheduled_message_archival, 'cron', hour=5, minute=30)
         
     scheduler.start()
+    
+    if config.WRITE_BUFFER_ENABLED:
+        write_buffer.start()
+    
+    if config.UPDATE_QUEUE_ENABLED:
+        update_queue.start()
+    
+    if config.WARMUP_ON_STARTUP:
+        start_warmup()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    # Let queued updates finish first, they still produce buffered writes
+    await update_queue.stop(timeout=config.UPDATE_QUEUE_DRAIN_SECONDS)
+    # Pending transcripts are message text patches, they go through the buffer too
+    await media.drain(timeout=config.UPDATE_QUEUE_DRAIN_SECONDS)
+    # Guaranteed flush of buffered message writes before the instance goes away
+    await write_buffer.stop()
 
 dp = Dispatcher()
 dp.include_router(router)
 
+async def process_update(update: types.Update):
+    with metrics.trace_update(update.update_id, get_chat_key(update), get_update_kind(update)):
+        await dp.feed_update(get_bot(), update)
+
+update_queue = UpdateQueue(
+    process_update,
+    workers=config.UPDATE_WORKERS,
+    max_pending=config.UPDATE_QUEUE_MAX_PENDING
+)
+
+metrics.gauge("snitch_update_queue_pending", "Updates waiting in the queue", lambda: update_queue.stats()["pending"])
+metrics.gauge("snitch_update_queue_in_flight", "Updates being processed", lambda: update_queue.stats()["in_flight"])
+metrics.gauge("snitch_write_buffer_pending", "Buffered Firestore writes not yet committed", lambda: write_buffer.stats()["pending"])
+metrics.gauge("snitch_transcriptions_scheduled", "Background transcriptions not finished yet", lambda: media.stats()["scheduled"])
+metrics.gauge("snitch_outbox_waiting", "Outbound messages waiting for rate limits", lambda: outbox.stats()["waiting"])
+
 @app.post("/webhook")
 async def telegram_webhook(request: Request):
+    started = perf_counter()
+    outcome = "error"
+    try:
+        result = await handle_webhook(request)
+        outcome = result.get("status", "ok")
+        return result
+    except HTTPException:
+        outcome = "rejected"
+        raise
+    finally:
+        metrics.webhook_seconds.observe(perf_counter() - started, outcome=outcome)
+
+async def handle_webhook(request: Request):
     try:
         update_data = await request.json()
         update = types.Update(**update_data)
-        await dp.feed_update(bot, update)
-        return {"status": "ok"}
     except Exception as e:
         logging.error(f"Webhook error: {e}")
         return {"status": "error", "message": str(e)}
 
+    if not update_queue.running:
+        try:
+            await process_update(update)
+            return {"status": "ok"}
+        except Exception as e:
+            logging.error(f"Webhook error: {e}")
+            return {"status": "error", "message": str(e)}
+
+    # Acknowledge immediately, the worker pool does the slow part (AI, downloads)
+    if not update_queue.submit(update):
+        # Non-2xx makes Telegram redeliver the update later
+        logging.warning(f"Update queue is full, rejecting update {update.update_id}")
+        raise HTTPException(status_code=503, detail="Update queue is full")
+    return {"status": "queued"}
+
+@app.get("/queue_stats")
+async def queue_stats(x_secret_token: str = Header(None, alias="X-Secret-Token")):
+    if x_secret_token != settings.SECRET_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid token")
+    return {
+        "updates": update_queue.stats(),
+        "write_buffer": write_buffer.stats(),
+        "user_stats_cache": user_stats_cache.stats(),
+        "recent_messages": recent_messages.stats(),
+        "transcriptions": media.stats(),
+        "outbox": outbox.stats(),
+        "ai": get_ai_stats()
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics(x_secret_token: str = Header(None, alias="X-Secret-Token")):
+    if x_secret_token != settings.SECRET_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid token")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/analyze_daily")
 async def analyze_daily(request: Request, x_secret_token: str = Header(None, alias="X-Secret-Token")):
     if x_secret_token != settings.SECRET_TOKEN:
@@ -401,14 +565,40 @@ async def weekly_decay(request: Request, x_secret_token: str = Header(None, alia
     chat_id = data.get("chat_id")
     if not chat_id:
         raise HTTPException(status_code=400, detail="Missing chat_id")
-    await apply_weekly_amnesty(chat_id)
-    await bot.send_message(
-        chat_id=chat_id,
-        text=messages.AMNESTY_MESSAGE,
-        parse_mode="HTML"
-    )
-    return {"status": "amnesty_applied"}
+    return await perform_weekly_amnesty(chat_id)
+
+@app.post("/archive_messages")
+async def archive_messages(request: Request, x_secret_token: str = Header(None, alias="X-Secret-Token")):
+    if x_secret_token != settings.SECRET_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid token")
+    data = await request.json()
+    chat_id = data.get("chat_id")
+    if not chat_id:
+        raise HTTPException(status_code=400, detail="Missing chat_id")
+    return await perform_message_archival(chat_id)
+
+@app.post("/expire_agreements")
+async def expire_agreements_endpoint(request: Request, x_secret_token: str = Header(None, alias="X-Secret-Token")):
+    if x_secret_token != settings.SECRET_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid token")
+    data = await request.json()
+    chat_id = data.get("chat_id")
+    if not chat_id:
+        raise HTTPException(status_code=400, detail="Missing chat_id")
+    return await perform_agreement_expiry(chat_id)
     
+@app.get("/warmup")
+async def warmup(x_secret_token: str = Header(None, alias="X-Secret-Token")):
+    """
+    Startup probe target: answers once the clients are connected.
+    It opens outbound connections, so it takes the token like the other endpoints.
+    """
+    if x_secret_token != settings.SECRET_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid token")
+    results = await asyncio.shield(start_warmup())
+    failed = any(isinstance(v, str) for v in results.values())
+    return {"status": "degraded" if failed else "warm", "seconds": results}
+
 @app.get("/")
 async def health_check():
     return {"status": "ok", "service": "BorSnitchBot"}
@@ -0,0 +1,41 @@
+import asyncio
+import logging
+import sys
+import os
+
+# Add project root to path
+sys.path.append(os.getcwd())
+
+from src.services.db import get_active_chat_ids, agreements_ref, db
+from src.services.write_buffer import FIRESTORE_BATCH_LIMIT
+from google.cloud import firestore
+
+logging.basicConfig(level=logging.INFO)
+
+async def backfill_chat(chat_id) -> int:
+    """Sets expires_at to null on active agreements saved without the field."""
+    query = agreements_ref(chat_id).where(filter=firestore.FieldFilter("status", "==", "active"))
+    refs = [doc.reference async for doc in query.stream() if 'expires_at' not in doc.to_dict()]
+
+    for start in range(0, len(refs), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for ref in refs[start:start + FIRESTORE_BATCH_LIMIT]:
+            batch.update(ref, {"expires_at": None})
+        await batch.commit()
+    return len(refs)
+
+async def main():
+    logging.info("Backfilling expires_at on active agreements...")
+    
+    for chat_id in await get_active_chat_ids():
+        try:
+            count = await backfill_chat(chat_id)
+            if count:
+                logging.info(f"Chat {chat_id}: {count} agreements backfilled.")
+        except Exception as e:
+            logging.error(f"Error backfilling agreements for chat {chat_id}: {e}")
+            
+    logging.info("Agreement backfill completed.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,336 @@
+import argparse
+import asyncio
+import logging
+import os
+import random
+import re
+import resource
+import sys
+import time
+import tracemalloc
+
+# Add project root to path
+sys.path.append(os.getcwd())
+
+# Always runs against the in-process store, never against a real project
+os.environ["STORAGE_BACKEND"] = "memory"
+for key in ("WEBHOOK_URL", "GCP_PROJECT_ID", "SECRET_TOKEN"):
+    os.environ.setdefault(key, "benchmark")
+os.environ.setdefault("TELEGRAM_TOKEN", "123456:benchmark-token")
+
+from datetime import datetime, timezone, timedelta, time as dt_time
+
+import httpx
+from aiogram import types
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import GetFile, SendMessage, EditMessageText
+from vertexai import generative_models
+
+from src.utils.game_config import config
+from src.utils.prompts import SYSTEM_PROMPT, REPORT_VALIDATION_PROMPT
+
+USERS_PER_CHAT = 12
+
+
+# --- Stand-ins for Telegram and Vertex AI ---
+
+class FakeTelegramSession(BaseSession):
+    """Answers Bot API calls locally; file downloads stream a fake voice note."""
+
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+        self.calls = 0
+        self._message_ids = iter(range(10_000_000, 20_000_000))
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, (SendMessage, EditMessageText)):
+            return types.Message(
+                message_id=next(self._message_ids),
+                date=datetime.now(timezone.utc),
+                chat=types.Chat(id=int(method.chat_id or 0), type="supergroup"),
+                text=method.text,
+            )
+        if isinstance(method, GetFile):
+            return types.File(file_id=method.file_id, file_unique_id=method.file_id, file_size=48_000, file_path=f"voice/{method.file_id}.ogg")
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        for _ in range(3):
+            yield b"\0" * 16_000
+
+    async def close(self):
+        pass
+
+
+class FakeUsage:
+    def __init__(self, prompt_tokens: int, output_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.cached_content_token_count = 0
+        self.candidates_token_count = output_tokens
+
+
+class FakeResponse:
+    def __init__(self, text: str, prompt_chars: int):
+        self.text = text
+        self.usage_metadata = FakeUsage(prompt_chars // config.AI_CHARS_PER_TOKEN, len(text) // config.AI_CHARS_PER_TOKEN)
+
+
+class FakeModel:
+    """Stands in for GenerativeModel: canned answers per prompt type after a fixed delay."""
+    latency = 0.0
+
+    def __init__(self, model_name, system_instruction=None, **kwargs):
+        self.system_instruction = system_instruction
+
+    async def generate_content_async(self, contents, generation_config=None):
+        await asyncio.sleep(self.latency)
+        prompt = "".join(part for part in contents if isinstance(part, str))
+        if self.system_instruction == SYSTEM_PROMPT:
+            match = re.search(r"\(ID: (\d+)\)", prompt)
+            offenders = []
+            if match:
+                offenders.append(
+                    f'{{"user_id": {match.group(1)}, "username": "user", "category": "Whining", '
+                    f'"points": {config.POINTS_WHINING}, "reason": "Ныл", "quote": "эх"}}'
+                )
+            text = f'{{"reasoning": "benchmark", "offenders": [{", ".join(offenders)}]}}'
+        elif self.system_instruction == REPORT_VALIDATION_PROMPT:
+            text = '{"reasoning": "benchmark", "valid": false, "category": null, "points": 0, "reason": "Шутка"}'
+        elif self.system_instruction:
+            text = "Ну-ну."
+        else:
+            text = "Текст голосового сообщения"
+        return FakeResponse(text, len(prompt))
+
+
+# ai_session builds its models from this module once load_vertex() has imported it
+generative_models.GenerativeModel = FakeModel
+config.WARMUP_ON_STARTUP = False
+
+from src import main
+from src.services.db import db, write_buffer, get_current_season_id, message_write
+from src.services.write_buffer import merge_fields
+
+logging.getLogger().setLevel(logging.WARNING)
+logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+
+# --- Synthetic updates ---
+
+def _user(chat_index: int, user_index: int) -> dict:
+    user_id = 1_000_000 + chat_index * 1000 + user_index
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_index}", "username": f"user_{chat_index}_{user_index}"}
+
+
+def generate_updates(count: int, chats: int, seed: int = 1, first_chat: int = 0):
+    """Mix of texts, stickers, voice notes, reactions and edits across `chats` group chats."""
+    rng = random.Random(seed)
+    now = int(time.time())
+    sent = {}  # chat index -> [(message_id, date)]
+    updates = []
+    for update_id in range(1, count + 1):
+        chat_index = first_chat + rng.randrange(chats)
+        chat = {"id": -1_000_000_000 - chat_index, "type": "supergroup", "title": f"Chat {chat_index}"}
+        user = _user(chat_index, rng.randrange(USERS_PER_CHAT))
+        history = sent.setdefault(chat_index, [])
+        date = now + update_id // 10
+        kind = rng.random()
+
+        if history and kind < 0.08:
+            message_id, sent_date = rng.choice(history)
+            updates.append({"update_id": update_id, "message_reaction": {
+                "chat": chat, "message_id": message_id, "user": user, "date": date,
+                "old_reaction": [], "new_reaction": [{"type": "emoji", "emoji": rng.choice(["👍", "🤡", "🔥"])}],
+            }})
+            continue
+        if history and kind < 0.12:
+            message_id, sent_date = history[-1]
+            updates.append({"update_id": update_id, "edited_message": {
+                "message_id": message_id, "date": sent_date, "edit_date": date, "chat": chat, "from": user,
+                "text": f"исправлено {update_id}",
+            }})
+            continue
+
+        message_id = len(history) + 1
+        message = {"message_id": message_id, "date": date, "chat": chat, "from": user}
+        if kind < 0.2:
+            message["sticker"] = {
+                "file_id": f"sticker{update_id % 50}", "file_unique_id": f"sticker{update_id % 50}",
+                "type": "regular", "width": 512, "height": 512, "is_animated": False, "is_video": False, "emoji": "😂",
+            }
+        elif kind < 0.25:
+            message["voice"] = {"file_id": f"voice{update_id}", "file_unique_id": f"voice{update_id}", "duration": 4, "file_size": 48_000}
+        else:
+            message["text"] = f"сообщение {update_id} про работу, погоду и жизнь"
+            if history and rng.random() < 0.3:
+                reply_id, reply_date = rng.choice(history)
+                message["reply_to_message"] = {"message_id": reply_id, "date": reply_date, "chat": chat, "from": user, "text": "..."}
+        history.append((message_id, date))
+        updates.append({"update_id": update_id, "message": message})
+    return updates
+
+
+# --- Measurements ---
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def report(name: str, latencies, elapsed: float):
+    print(
+        f"{name:<16} {len(latencies):>7} updates  {len(latencies) / elapsed:>9.1f} upd/s  "
+        f"p50 {percentile(latencies, 50) * 1000:>7.2f} ms  p99 {percentile(latencies, 99) * 1000:>7.2f} ms  "
+        f"maxrss {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB"
+    )
+
+
+async def bench_dispatcher(updates, concurrency: int):
+    """Feeds updates straight into dp.feed_update (the worker path), `concurrency` updates at a time."""
+    parsed = [types.Update(**data) for data in updates]
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def feed(update):
+        async with semaphore:
+            started = time.perf_counter()
+            await main.process_update(update)
+            latencies.append(time.perf_counter() - started)
+
+    write_buffer.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(feed(update) for update in parsed))
+    elapsed = time.perf_counter() - started
+    await write_buffer.stop()
+    report("dispatcher", latencies, elapsed)
+
+
+async def bench_webhook(updates, concurrency: int, queued: bool):
+    """Posts updates to /webhook. With the queue, latency is the ack; throughput waits for the drain."""
+    if queued:
+        await main.on_startup()
+    transport = httpx.ASGITransport(app=main.app)
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        async def post(data):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/webhook", json=data)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    logging.warning(f"Webhook answered {response.status_code}")
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(data) for data in updates))
+        if queued:
+            while main.update_queue.stats()["pending"]:
+                await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+
+    if queued:
+        await main.on_shutdown()
+        main.scheduler.shutdown(wait=False)
+    report("webhook+queue" if queued else "webhook inline", latencies, elapsed)
+
+
+def analysis_window():
+    """Same window perform_chat_analysis picks right now."""
+    moscow_tz = timezone(timedelta(hours=config.TIMEZONE_OFFSET))
+    now_msk = datetime.now(moscow_tz)
+    analysis_date = now_msk.date()
+    if now_msk.hour < config.ANALYSIS_CUTOFF_HOUR:
+        analysis_date -= timedelta(days=1)
+    end = datetime.combine(analysis_date, dt_time(23, 50), tzinfo=moscow_tz).astimezone(timezone.utc)
+    return end - timedelta(days=1), end
+
+
+async def seed_chat(chat_id: str, messages: int):
+    start, end = analysis_window()
+    step = (end - start) / (messages + 1)
+    season = get_current_season_id()
+    chat_ref = db.collection("chats").document(chat_id)
+    batch = db.batch()
+    for i in range(USERS_PER_CHAT):
+        user = _user(0, i)
+        batch.set(chat_ref.collection("user_stats").document(str(user["id"])), {
+            "username": user["username"], "season_id": season, "total_points": 0,
+            "last_active": end - timedelta(hours=1),
+        })
+    # Folded per document first, so the shard layout gets one write per shard
+    docs = {}
+    for i in range(messages):
+        user = _user(0, i % USERS_PER_CHAT)
+        ref, payload, merge = message_write(chat_id, str(i + 1), {
+            "user_id": user["id"], "username": user["username"],
+            "text": f"сообщение {i} про работу, погоду и жизнь, ничего особенного",
+            "timestamp": start + step * (i + 1), "reply_to": str(i) if i % 7 == 0 and i else None,
+        })
+        existing = docs.get(ref.path)
+        docs[ref.path] = (ref, merge_fields(existing[1], payload) if existing else payload, merge)
+    for ref, payload, merge in docs.values():
+        batch.set(ref, payload, merge=merge)
+        if len(batch) >= 500:
+            await batch.commit()
+            batch = db.batch()
+    await batch.commit()
+
+
+async def bench_analysis(sizes):
+    """Times perform_chat_analysis on chats with `size` messages in the analysis window."""
+    for size in sizes:
+        chat_id = str(-2_000_000_000 - size)
+        await seed_chat(chat_id, size)
+        tracemalloc_was_on = tracemalloc.is_tracing()
+        started = time.perf_counter()
+        result = await main.perform_chat_analysis(chat_id)
+        elapsed = time.perf_counter() - started
+        peak = f"  peak {tracemalloc.get_traced_memory()[1] / 2**20:.0f} MB" if tracemalloc_was_on else ""
+        offenders = len(result.get("result", {}).get("offenders", [])) if isinstance(result, dict) else 0
+        print(f"analysis {size:>7} msgs  {elapsed:>7.2f} s  status {result.get('status')}  offenders {offenders}{peak}")
+
+
+async def main_async():
+    parser = argparse.ArgumentParser(description="Offline throughput and latency benchmark with local Firestore/Telegram/Vertex stand-ins.")
+    parser.add_argument("--mode", choices=["dispatcher", "webhook", "analysis", "all"], default="all")
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=32, help="Updates in flight at once")
+    parser.add_argument("--ai-latency-ms", type=float, default=50.0, help="Simulated Vertex AI latency")
+    parser.add_argument("--telegram-latency-ms", type=float, default=20.0, help="Simulated Bot API latency")
+    parser.add_argument("--analysis-sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--trace-memory", action="store_true", help="Track Python allocations (slows the run down)")
+    parser.add_argument("--message-layout", choices=["documents", "shards"], default=config.MESSAGE_STORAGE_LAYOUT)
+    args = parser.parse_args()
+
+    config.MESSAGE_STORAGE_LAYOUT = args.message_layout
+
+    random.seed(1)
+    FakeModel.latency = args.ai_latency_ms / 1000
+    main.get_bot().session = FakeTelegramSession(args.telegram_latency_ms / 1000)
+    if args.trace_memory:
+        tracemalloc.start()
+
+    if args.mode in ("dispatcher", "all"):
+        await bench_dispatcher(generate_updates(args.updates, args.chats, seed=1), args.concurrency)
+    if args.mode in ("webhook", "all"):
+        # Fresh update IDs and chats so earlier runs do not warm the caches
+        await bench_webhook(generate_updates(args.updates, args.chats, seed=2, first_chat=args.chats), args.concurrency, queued=False)
+        await bench_webhook(generate_updates(args.updates, args.chats, seed=3, first_chat=2 * args.chats), args.concurrency, queued=True)
+    if args.mode in ("analysis", "all"):
+        await bench_analysis(args.analysis_sizes)
+
+    await main.media.drain(timeout=30)
+    if args.trace_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        print(f"python allocations: current {current / 2**20:.0f} MB, peak {peak / 2**20:.0f} MB")
+
+if __name__ == "__main__":
+    asyncio.run(main_async())
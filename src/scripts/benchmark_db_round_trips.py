@@ -0,0 +1,122 @@
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+# Add project root to path
+sys.path.append(os.getcwd())
+
+# Always runs against the in-process store, never against a real project
+os.environ["STORAGE_BACKEND"] = "memory"
+for key in ("TELEGRAM_TOKEN", "WEBHOOK_URL", "GCP_PROJECT_ID", "SECRET_TOKEN"):
+    os.environ.setdefault(key, "benchmark")
+
+from datetime import datetime, timedelta
+
+from src.services import local_store
+from src.services.db import db, save_daily_results, apply_weekly_amnesty, get_current_season_id, user_stats_cache
+
+logging.basicConfig(level=logging.WARNING)
+
+round_trips = 0
+latency = 0.0
+
+
+async def _round_trip():
+    global round_trips
+    round_trips += 1
+    if latency:
+        await asyncio.sleep(latency)
+
+
+def instrument():
+    """Counts every call that is a network round-trip on Firestore and adds simulated latency to it."""
+    doc_get = local_store.LocalDocumentReference.get
+    client_get_all = local_store.LocalAsyncClient.get_all
+    batch_commit = local_store.LocalWriteBatch.commit
+    tx_begin = local_store.LocalTransaction._begin
+    tx_commit = local_store.LocalTransaction._commit
+
+    async def get(self, *args, **kwargs):
+        await _round_trip()
+        return await doc_get(self, *args, **kwargs)
+
+    async def get_all(self, references, *args, **kwargs):
+        await _round_trip()
+        async for snapshot in client_get_all(self, references, *args, **kwargs):
+            yield snapshot
+
+    async def commit(self, *args, **kwargs):
+        await _round_trip()
+        return await batch_commit(self, *args, **kwargs)
+
+    async def begin(self, *args, **kwargs):
+        await tx_begin(self, *args, **kwargs)
+        await _round_trip()
+
+    async def commit_tx(self, *args, **kwargs):
+        await _round_trip()
+        return await tx_commit(self, *args, **kwargs)
+
+    local_store.LocalDocumentReference.get = get
+    local_store.LocalAsyncClient.get_all = get_all
+    local_store.LocalWriteBatch.commit = commit
+    local_store.LocalTransaction._begin = begin
+    local_store.LocalTransaction._commit = commit_tx
+
+
+async def seed(chat_id: str, offenders: int):
+    season = get_current_season_id()
+    chat_ref = db.collection("chats").document(chat_id)
+    batch = db.batch()
+    offender_list = []
+    for i in range(offenders):
+        uid = str(1000 + i)
+        batch.set(chat_ref.collection("user_stats").document(uid), {
+            "username": f"user{i}", "season_id": season, "total_points": 100, "snitch_count": 1
+        })
+        offender_list.append({"user_id": uid, "username": f"user{i}", "points": 10, "category": "Токсичность"})
+    today = datetime.now()
+    for day in range(1, 7):
+        date_key = (today - timedelta(days=day)).strftime("%Y-%m-%d")
+        batch.set(chat_ref.collection("daily_results").document(date_key), {"offenders": offender_list})
+    await batch.commit()
+    return offender_list
+
+
+async def measure(coro_factory):
+    global round_trips
+    user_stats_cache.clear()
+    round_trips = 0
+    started = time.perf_counter()
+    await coro_factory()
+    return round_trips, (time.perf_counter() - started) * 1000
+
+
+async def main():
+    global latency
+    parser = argparse.ArgumentParser(description="Round-trips and wall time of daily result saving and amnesty.")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Simulated latency per round-trip")
+    parser.add_argument("--offenders", type=int, nargs="+", default=[1, 5, 20, 50, 100])
+    args = parser.parse_args()
+
+    instrument()
+    print(f"{'offenders':>9} | {'save rt':>7} | {'save ms':>8} | {'amnesty rt':>10} | {'amnesty ms':>10}")
+
+    for count in args.offenders:
+        chat_id = f"bench-{count}"
+        latency = 0.0
+        offender_list = await seed(chat_id, count)
+        latency = args.latency_ms / 1000
+        date_key = datetime.now().strftime("%Y-%m-%d")
+
+        save_rt, save_ms = await measure(
+            lambda: save_daily_results(chat_id, {"date_key": date_key, "offenders": offender_list})
+        )
+        amnesty_rt, amnesty_ms = await measure(lambda: apply_weekly_amnesty(chat_id))
+        print(f"{count:>9} | {save_rt:>7} | {save_ms:>8.1f} | {amnesty_rt:>10} | {amnesty_ms:>10.1f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
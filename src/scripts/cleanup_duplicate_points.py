@@ -6,7 +6,7 @@ import argparse
 # Add src to path
 sys.path.append(os.getcwd())
 
-from src.services.db import db, calculate_rank
+from src.services.db import db, calculate_rank, roster_ref, roster_update
 
 async def cleanup_points(chat_id, date_key, user_id, points_to_subtract, username=None):
     chat_id = str(chat_id)
@@ -43,11 +43,15 @@ async def cleanup_points(chat_id, date_key, user_id, points_to_subtract, usernam
     current_wins = data.get("snitch_count", 0)
     new_wins = max(0, current_wins - 1)
 
-    await user_stats_ref.update({
+    update_data = {
         "total_points": new_points,
         "snitch_count": new_wins,
         "current_rank": new_rank
-    })
+    }
+    batch = db.batch()
+    batch.update(user_stats_ref, update_data)
+    batch.set(roster_ref(chat_id), roster_update(user_id, update_data), merge=True)
+    await batch.commit()
     
     print(f"Successfully updated user {user_id}. Points: {current_points} -> {new_points}. Wins: {current_wins} -> {new_wins}.")
 
@@ -7,13 +7,35 @@ import os
 # Ensure src is in python path if run directly
 sys.path.append(os.getcwd())
 
-from src.services.db import db, get_logs_for_time_range
+from src.services.db import db
+from src.services.archive import get_message_history
 from src.utils.config import settings
+from src.utils.game_config import config
+from src.utils.chunking import estimate_tokens, chunk_lines
 import vertexai
 from vertexai.generative_models import GenerativeModel
 
 logging.basicConfig(level=logging.INFO)
 
+def build_feedback_prompt(chat_text: str) -> str:
+    return f"""
+            You are a Product Manager analyzing user feedback for a Telegram Bot ("BorSnitchBot").
+            
+            Analyze the following chat history and extract:
+            1. 🐛 **Bug Reports**: Anything users said is broken or not working.
+            2. 💡 **Feature Requests**: What users explicitly asked for or implied they want.
+            3. 🗣️ **Improvement Suggestions**: Feedback on mechanics (points, snitching, rules).
+            4. 📈 **General Sentiment**: How users feel about the bot (Fun? Annoying? Fair?).
+            
+            Ignore normal conversation unrelated to the bot, unless it shows frustration/joy with the bot.
+            Focus on constructive feedback.
+            
+            Format the output as Markdown. Use bullet points.
+            
+            CHAT LOGS:
+            {chat_text}
+            """
+
 async def main():
     print("🚀 Starting Feedback Collection...")
     
@@ -49,7 +71,7 @@ async def main():
             chat_id = chat_doc.id
             print(f"Analyzing chat {chat_id}...")
             
-            logs = await get_logs_for_time_range(chat_id, start_dt, end_dt)
+            logs = await get_message_history(chat_id, start_dt, end_dt)
             
             if not logs:
                 print(f"  - No logs found.")
@@ -57,39 +79,42 @@ async def main():
             
             print(f"  - Processing {len(logs)} messages...")
             
-            # Chunking strategies might be needed for huge logs, but for test period it's likely fine.
-            # Gemini 3 Flash context window is huge (1M+ tokens).
-            
-            chat_text = ""
+            log_lines = []
             for log in logs:
                 username = log.get('username', 'Anon')
                 text = log.get('text', '')
                 # Include date for context
                 ts = log.get('timestamp')
                 date_str = ts.strftime("%Y-%m-%d") if ts else ""
-                chat_text += f"[{date_str}] {username}: {text}\n"
-                
-            prompt = f"""
-            You are a Product Manager analyzing user feedback for a Telegram Bot ("BorSnitchBot").
-            
-            Analyze the following chat history and extract:
-            1. 🐛 **Bug Reports**: Anything users said is broken or not working.
-            2. 💡 **Feature Requests**: What users explicitly asked for or implied they want.
-            3. 🗣️ **Improvement Suggestions**: Feedback on mechanics (points, snitching, rules).
-            4. 📈 **General Sentiment**: How users feel about the bot (Fun? Annoying? Fair?).
-            
-            Ignore normal conversation unrelated to the bot, unless it shows frustration/joy with the bot.
-            Focus on constructive feedback.
+                log_lines.append(f"[{date_str}] {username}: {text}\n")
             
-            Format the output as Markdown. Use bullet points.
-            
-            CHAT LOGS:
-            {chat_text}
-            """
+            # Two weeks of a busy chat can exceed the prompt budget: analyze in parts, then merge
+            # The budget covers the whole request, so the instructions' share comes off the top
+            log_budget = config.AI_PROMPT_TOKEN_BUDGET - estimate_tokens(build_feedback_prompt(""))
+            chunks = chunk_lines(log_lines, max(log_budget, 1), overlap=config.AI_CHUNK_OVERLAP_LINES)
+            if len(chunks) > 1:
+                print(f"  - Splitting into {len(chunks)} parts...")
             
             try:
-                response = await model.generate_content_async(prompt)
-                feedback = response.text
+                semaphore = asyncio.Semaphore(config.AI_CHUNK_CONCURRENCY)
+                
+                async def analyze_chunk(lines):
+                    async with semaphore:
+                        response = await model.generate_content_async(build_feedback_prompt("".join(lines)))
+                        return response.text
+                
+                partial_reports = await asyncio.gather(*(analyze_chunk(lines) for lines in chunks))
+                
+                if len(partial_reports) == 1:
+                    feedback = partial_reports[0]
+                else:
+                    merge_prompt = (
+                        "Merge these partial feedback reports about the same Telegram bot into one report "
+                        "with the same sections. Deduplicate repeated points. Format the output as Markdown.\n\n"
+                        + "\n\n---\n\n".join(partial_reports)
+                    )
+                    response = await model.generate_content_async(merge_prompt)
+                    feedback = response.text
                 
                 report_content += f"## Chat ID: `{chat_id}`\n\n"
                 report_content += feedback + "\n\n---\n\n"
@@ -5,7 +5,10 @@ import vertexai
 from vertexai.generative_models import GenerativeModel
 from google.cloud import storage
 from src.services.db import db
+from src.services.archive import get_message_history
 from src.utils.config import settings
+from src.utils.game_config import config
+from src.utils.chunking import estimate_tokens, chunk_lines
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -19,29 +22,36 @@ if settings.GCP_LOCATION != "global":
     init_params["api_transport"] = "grpc"
 vertexai.init(**init_params)
 
-async def fetch_all_messages(chat_id):
-    """
-    Fetches all messages for a given chat ordered by timestamp.
-    """
-    chat_ref = db.collection("chats").document(str(chat_id))
-    messages_ref = chat_ref.collection("messages")
-    
-    # Stream all messages ordered by timestamp
-    query = messages_ref.order_by("timestamp")
+LORE_PROMPT = """
+    Проанализируй эту переписку и составь подробное описание "Лора" (Lore) этого чата на русском языке.
     
-    messages = []
-    async for doc in query.stream():
-        data = doc.to_dict()
-        messages.append(data)
+    Включи следующие разделы:
+    1. **Ключевые персонажи**: Опиши характер, повадки, стиль общения и роль каждого активного участника. Кто снитч? Кто душнила? Кто клоун?
+    2. **Локальные мемы и приколы**: Опиши повторяющиеся шутки, фразы или ситуации.
+    3. **Легендарные события**: Если были какие-то яркие споры, обсуждения или события, упомяни их.
+    4. **Общая атмосфера**: Какая атмосфера царит в чате?
+    5. **Сленг**: Особые слова или выражения, которые используют участники.
     
-    return messages
+    Твой ответ должен быть отформатирован как красивый Markdown файл.
+    """
+
+CONDENSE_PROMPT = """
+    Это часть длинной переписки чата. Выпиши кратко на русском всё, что пригодится для описания "Лора" чата:
+    персонажей и их повадки, повторяющиеся шутки и мемы, яркие события с датами, сленг.
+    Не пересказывай обычную болтовню.
+    """
+
+CONDENSE_NOTES_PROMPT = """
+    Это часть конспекта длинной переписки чата. Объедини и сократи заметки на русском, сохранив
+    персонажей и их повадки, повторяющиеся шутки и мемы, яркие события с датами, сленг.
+    """
 
 async def generate_lore_for_chat(chat_id):
     """
     Generates lore description using Gemini 3 Flash.
     """
     logging.info(f"Fetching messages for chat {chat_id}...")
-    messages = await fetch_all_messages(chat_id)
+    messages = await get_message_history(chat_id)
     
     if not messages:
         logging.warning(f"No messages found for chat {chat_id}")
@@ -49,15 +59,17 @@ async def generate_lore_for_chat(chat_id):
 
     logging.info(f"Fetched {len(messages)} messages. Preparing context...")
     
-    # Prepare context string
-    context_str = ""
+    # Prepare context lines
+    context_lines = []
     
     # Add archive content
     try:
         archive_path = "archive/processed_Сайонара_тур_МИНСК-КАЗАНЬ-МИНСК-ЛУДИНСК-ЕСЬКИНО-ВЛАДИМИР_minified.txt"
         with open(archive_path, "r", encoding="utf-8") as f:
             archive_text = f.read()
-            context_str += f"=== АРХИВ СООБЩЕНИЙ (2025 год) ===\n{archive_text}\n\n=== СВЕЖИЕ СООБЩЕНИЯ ===\n"
+            context_lines.append("=== АРХИВ СООБЩЕНИЙ (2025 год) ===\n")
+            context_lines.extend(archive_text.splitlines(keepends=True))
+            context_lines.append("\n\n=== СВЕЖИЕ СООБЩЕНИЯ ===\n")
             logging.info(f"Loaded archive text: {len(archive_text)} chars")
     except Exception as e:
         logging.error(f"Failed to read archive: {e}")
@@ -73,33 +85,63 @@ async def generate_lore_for_chat(chat_id):
             except:
                 pass
                 
-        context_str += f"{date_str}{username}: {text}\n"
+        context_lines.append(f"{date_str}{username}: {text}\n")
 
-    logging.info(f"Sending to AI (Length: {len(context_str)} chars)...")
-    
     # Use Gemini 3 Flash for large context window (1M+ tokens)
     model = GenerativeModel("gemini-3-flash-preview")
     
-    prompt = """
-    Проанализируй эту переписку и составь подробное описание "Лора" (Lore) этого чата на русском языке.
-    
-    Включи следующие разделы:
-    1. **Ключевые персонажи**: Опиши характер, повадки, стиль общения и роль каждого активного участника. Кто снитч? Кто душнила? Кто клоун?
-    2. **Локальные мемы и приколы**: Опиши повторяющиеся шутки, фразы или ситуации.
-    3. **Легендарные события**: Если были какие-то яркие споры, обсуждения или события, упомяни их.
-    4. **Общая атмосфера**: Какая атмосфера царит в чате?
-    5. **Сленг**: Особые слова или выражения, которые используют участники.
-    
-    Твой ответ должен быть отформатирован как красивый Markdown файл.
-    """
+    # History beyond the prompt budget is condensed part by part first (map), the
+    # notes again while they still do not fit, then the lore is written from them (reduce).
+    # Every call carries its instructions, so they come off the budget.
+    lore_budget = max(config.AI_PROMPT_TOKEN_BUDGET - estimate_tokens(LORE_PROMPT), 1)
+    lines, prompt, overlap = context_lines, CONDENSE_PROMPT, config.AI_CHUNK_OVERLAP_LINES
+    size = estimate_tokens("".join(lines))
+    round_number = 0
+    while size > lore_budget:
+        round_number += 1
+        condense_budget = max(config.AI_PROMPT_TOKEN_BUDGET - estimate_tokens(prompt), 1)
+        chunks = chunk_lines(lines, condense_budget, overlap=overlap)
+        logging.info(f"Round {round_number}: {size} tokens exceed the budget, condensing {len(chunks)} parts...")
+        notes = await condense_history(model, chunks, prompt)
+        if notes is None:
+            return None
+        lines = [note + "\n\n---\n\n" for note in notes]
+        prompt, overlap = CONDENSE_NOTES_PROMPT, 0
+        previous_size, size = size, estimate_tokens("".join(lines))
+        if size >= previous_size:
+            logging.error(f"Condensing no longer shrinks the notes ({size} tokens), giving up.")
+            return None
+
+    context_str = "".join(lines)
+    if lines is not context_lines:
+        context_str = "=== КОНСПЕКТ ПЕРЕПИСКИ ПО ЧАСТЯМ ===\n" + context_str
+
+    logging.info(f"Sending to AI (Length: {len(context_str)} chars)...")
     
     try:
-        response = await model.generate_content_async([prompt, context_str])
+        response = await model.generate_content_async([LORE_PROMPT, context_str])
         return response.text
     except Exception as e:
         logging.error(f"Error generating lore: {e}")
         return None
 
+async def condense_history(model, chunks, prompt=CONDENSE_PROMPT):
+    """
+    Map step for huge histories: extracts lore-relevant notes from each part concurrently.
+    """
+    semaphore = asyncio.Semaphore(config.AI_CHUNK_CONCURRENCY)
+    
+    async def condense(lines):
+        async with semaphore:
+            response = await model.generate_content_async([prompt, "".join(lines)])
+            return response.text
+    
+    try:
+        return await asyncio.gather(*(condense(lines) for lines in chunks))
+    except Exception as e:
+        logging.error(f"Error condensing history: {e}")
+        return None
+
 def upload_to_gcs(content, filename):
     """
     Uploads content to Google Cloud Storage.
@@ -0,0 +1,90 @@
+"""
+Converts per-message documents (chats/{id}/messages) into hourly/daily shards
+(chats/{id}/message_shards), see MESSAGE_STORAGE_LAYOUT in game_config.
+
+Deploy with MESSAGE_STORAGE_LAYOUT = "shards" first, so nothing logged during the
+migration lands in the old layout, then run this script. Shards are written with
+merges, so re-running it (or running it next to the live bot) is safe.
+
+Usage:
+    python src/scripts/migrate_message_shards.py [--chat_id ID] [--delete]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+
+# Add project root to path
+sys.path.append(os.getcwd())
+
+from src.services.db import db, message_write
+from src.services.write_buffer import FIRESTORE_BATCH_LIMIT, merge_fields
+from src.utils.game_config import config
+
+logging.basicConfig(level=logging.INFO)
+
+
+async def commit_in_batches(writes):
+    """writes: list of (ref, data, merge); data None means delete."""
+    for start in range(0, len(writes), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for ref, data, merge in writes[start:start + FIRESTORE_BATCH_LIMIT]:
+            if data is None:
+                batch.delete(ref)
+            else:
+                batch.set(ref, data, merge=merge)
+        await batch.commit()
+
+
+async def migrate_chat(chat_id: str, delete: bool):
+    messages_ref = db.collection("chats").document(chat_id).collection("messages")
+    shards = {}  # shard path -> (ref, payload)
+    migrated = []
+
+    async def flush_shards():
+        await commit_in_batches([(ref, payload, True) for ref, payload in shards.values()])
+        if delete:
+            await commit_in_batches([(ref, None, False) for ref in migrated])
+        shards.clear()
+        migrated.clear()
+
+    total = 0
+    # Ordered by timestamp, so a shard is complete once the stream moves past it
+    async for doc in messages_ref.order_by("timestamp").stream():
+        ref, payload, _ = message_write(chat_id, doc.id, doc.to_dict())
+        existing = shards.get(ref.path)
+        shards[ref.path] = (ref, merge_fields(existing[1], payload) if existing else payload)
+        migrated.append(doc.reference)
+        total += 1
+        if len(shards) >= FIRESTORE_BATCH_LIMIT or len(migrated) >= FIRESTORE_BATCH_LIMIT * 10:
+            await flush_shards()
+    await flush_shards()
+    logging.info(f"Chat {chat_id}: {total} messages migrated{' and deleted' if delete else ''}.")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Migrate per-message documents into message shards.")
+    parser.add_argument("--chat_id", help="Only migrate this chat (default: every chat)")
+    parser.add_argument("--delete", action="store_true", help="Delete the per-message documents once their shard is written")
+    args = parser.parse_args()
+
+    # message_write builds shard payloads regardless of the deployed layout
+    config.MESSAGE_STORAGE_LAYOUT = "shards"
+
+    if args.chat_id:
+        chat_ids = [str(args.chat_id)]
+    else:
+        chat_ids = [doc.id async for doc in db.collection("chats").stream()]
+
+    for chat_id in chat_ids:
+        try:
+            await migrate_chat(chat_id, args.delete)
+        except Exception as e:
+            logging.error(f"Error migrating chat {chat_id}: {e}")
+
+    logging.info("Message shard migration completed.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,52 @@
+"""
+Import-time profile of the bot, i.e. the part of a cold start spent before the
+first request can be served.
+
+Runs `python -X importtime -c "import src.main"` in a fresh interpreter and
+prints the slowest modules by cumulative time. Needs the usual environment
+(TELEGRAM_TOKEN etc.); no network calls are made.
+
+Usage:
+    python src/scripts/profile_imports.py [--module src.main] [--top 20]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+def profile(module: str):
+    """Returns [(cumulative_us, self_us, depth, name)] from -X importtime."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.getcwd()
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(cumulative_us), int(self_us), depth, name.strip()))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time profile of the bot.")
+    parser.add_argument("--module", default="src.main")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    rows = profile(args.module)
+    total = next((cumulative for cumulative, _, _, name in rows if name == args.module), 0)
+    print(f"import {args.module}: {total / 1e6:.2f} s")
+    print(f"{'cumulative':>11} {'self':>9}  module")
+    for cumulative, self_us, depth, name in sorted(rows, reverse=True)[:args.top]:
+        print(f"{cumulative / 1e3:>9.0f}ms {self_us / 1e3:>7.0f}ms  {'  ' * depth}{name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+import asyncio
+import logging
+import sys
+import os
+
+# Add project root to path
+sys.path.append(os.getcwd())
+
+from src.services.db import get_active_chat_ids, rebuild_roster
+
+logging.basicConfig(level=logging.INFO)
+
+async def main():
+    logging.info("Rebuilding chat rosters from user_stats...")
+    
+    for chat_id in await get_active_chat_ids():
+        try:
+            users = await rebuild_roster(chat_id)
+            logging.info(f"Chat {chat_id}: {len(users)} users.")
+        except Exception as e:
+            logging.error(f"Error rebuilding roster for chat {chat_id}: {e}")
+            
+    logging.info("Roster rebuild completed.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
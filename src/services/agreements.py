@@ -0,0 +1,163 @@
+import logging
+import re
+from datetime import datetime, timezone
+
+from google.cloud import firestore
+
+from .db import db, agreements_ref, new_agreement_data, get_active_agreements, dispute_agreement
+from .metrics import track_db
+from .write_buffer import FIRESTORE_BATCH_LIMIT
+from ..utils.prompts import AGREEMENT_MARKER_FORMS
+
+
+class AgreementIndex:
+    """
+    Active agreements of one chat for the duration of a run (analysis pass or command).
+
+    Loaded with a single query, then kept current in memory as agreements are
+    created, resolved and updated, so rendering never reads them again. Writes are
+    staged in one batch and go out with `commit()`.
+
+    Display numbers are 1-based positions among the active agreements in creation
+    order, the same numbers /agreements lists and "/disput N" accepts.
+    """
+
+    def __init__(self, chat_id, agreements: list):
+        self.chat_id = str(chat_id)
+        # Ordered by created_at; agreements created in this run are appended
+        self._by_id = {ag['id']: ag for ag in agreements}
+        self._batches = []  # staged writes, FIRESTORE_BATCH_LIMIT per batch
+        self._staged = 0
+
+    @classmethod
+    async def load(cls, chat_id):
+        return cls(chat_id, await get_active_agreements(chat_id))
+
+    @property
+    def active(self) -> list:
+        return [ag for ag in self._by_id.values() if ag.get('status') == 'active']
+
+    def get(self, agreement_id):
+        """Any agreement seen in this run, including ones resolved by it."""
+        return self._by_id.get(agreement_id)
+
+    def number(self, agreement_id):
+        for i, ag in enumerate(self.active, 1):
+            if ag['id'] == agreement_id:
+                return i
+        return None
+
+    def by_number(self, number: int):
+        active = self.active
+        return active[number - 1] if 1 <= number <= len(active) else None
+
+    def _stage(self, ref, data: dict, create: bool = False):
+        if self._staged % FIRESTORE_BATCH_LIMIT == 0:
+            self._batches.append(db.batch())
+        if create:
+            self._batches[-1].set(ref, data)
+        else:
+            self._batches[-1].update(ref, data)
+        self._staged += 1
+
+    def add(self, agreement: dict) -> dict:
+        """Stages a new agreement found by AI and returns it with its ID."""
+        data = new_agreement_data(agreement)
+        ref = agreements_ref(self.chat_id).document()
+        self._stage(ref, data, create=True)
+        # created_at is a server timestamp in Firestore; now is close enough for ordering
+        saved = {**data, 'id': ref.id, 'created_at': datetime.now(timezone.utc)}
+        self._by_id[ref.id] = saved
+        return saved
+
+    def resolve(self, agreement_id: str, status: str, reason: str = None):
+        """Stages fulfilled/broken for an active agreement; returns it, or None for unknown IDs."""
+        ag = self._by_id.get(agreement_id)
+        if not ag or ag.get('status') != 'active':
+            logging.warning(f"Ignoring resolution of unknown agreement {agreement_id} in chat {self.chat_id}")
+            return None
+        update_data = {"status": status}
+        if reason:
+            update_data["resolution_reason"] = reason
+        self._stage(agreements_ref(self.chat_id).document(agreement_id), update_data)
+        ag.update(update_data)
+        return ag
+
+    def update_text(self, agreement_id: str, new_text: str, reason: str = None):
+        """Stages a text change of an active agreement; returns it, or None for unknown IDs."""
+        ag = self._by_id.get(agreement_id)
+        if not ag or ag.get('status') != 'active':
+            logging.warning(f"Ignoring update of unknown agreement {agreement_id} in chat {self.chat_id}")
+            return None
+        update_data = {"text": new_text}
+        if reason:
+            update_data["update_reason"] = reason
+        self._stage(agreements_ref(self.chat_id).document(agreement_id), {**update_data, "updated_at": firestore.SERVER_TIMESTAMP})
+        ag.update(update_data)
+        return ag
+
+    @track_db
+    async def commit(self):
+        """Writes every staged change, in one batch for any realistic run."""
+        batches, self._batches, self._staged = self._batches, [], 0
+        for batch in batches:
+            await batch.commit()
+
+    async def dispute(self, agreement_id: str):
+        """dispute_agreement without the read; returns (success, error_code)."""
+        ag = self._by_id.get(agreement_id)
+        if not ag:
+            return False, "not_found"
+        return await dispute_agreement(self.chat_id, agreement_id, agreement=ag)
+
+
+# Keyword pre-filter for the 30-minute agreement check. Markers are matched as
+# exact whole-word forms (AGREEMENT_MARKER_FORMS). Words of active agreements are
+# reduced to crude stems (one common Russian ending dropped) and compared as sets.
+_ENDINGS = ("ились", "емся", "имся", "ешься", "усь", "юсь", "ись", "ся", "ешь", "ет", "ем", "ам", "ям", "ах", "ях", "ю", "у", "а", "я", "ь")
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    return (text or "").lower().replace("ё", "е")
+
+
+def stem(word: str) -> str:
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def compile_markers(markers) -> re.Pattern:
+    """One regex for all markers; words of a phrase may be split by anything but letters."""
+    phrases = [r"\W+".join(re.escape(word) for word in normalize(marker).split()) for marker in markers]
+    return re.compile(r"\b(?:" + "|".join(phrases) + r")\b")
+
+
+MARKERS_RE = compile_markers(AGREEMENT_MARKER_FORMS)
+
+
+def _agreement_stems(agreement: dict) -> set:
+    # Shorter words are mostly prepositions and particles
+    return {stem(word) for word in _WORD_RE.findall(normalize(agreement.get('text'))) if len(word) >= 4}
+
+
+def agreement_prefilter(logs: list, active_agreements: list) -> str | None:
+    """
+    Why a slice of messages is worth an AI call: "marker" if someone used an agreement
+    marker, "agreement" if a message talks about an active agreement (shares two of its
+    words, or its only word). None means the slice can skip the agreement check.
+    """
+    texts = [normalize(log.get('text')) for log in logs]
+    if any(MARKERS_RE.search(text) for text in texts):
+        return "marker"
+
+    agreement_stems = [stems for stems in map(_agreement_stems, active_agreements) if stems]
+    if not agreement_stems:
+        return None
+    for text in texts:
+        words = {stem(word) for word in _WORD_RE.findall(text)}
+        if any(len(stems & words) >= min(2, len(stems)) for stems in agreement_stems):
+            return "agreement"
+    return None
@@ -1,39 +1,130 @@
-import vertexai
-from vertexai.generative_models import GenerativeModel, SafetySetting, Part
-from src.utils.config import settings
 from src.utils.game_config import config
-from src.utils.prompts import SYSTEM_PROMPT, REPORT_VALIDATION_PROMPT, CYNICAL_COMMENT_PROMPT
+from src.utils.prompts import SYSTEM_PROMPT, REPORT_VALIDATION_PROMPT, CYNICAL_COMMENT_PROMPT, RESPONSE_FORMAT_NOTE
+from src.utils.schemas import DAILY_VERDICT_SCHEMA, REPORT_VERDICT_SCHEMA, validate_daily_verdict, validate_report_verdict
+from src.utils.chunking import estimate_tokens, chunk_lines
+from src.services.incremental import merge_partial_verdicts
+from src.services.ai_session import ModelSession, get_gate_stats, load_vertex
+from src.services.cache import TTLCache, MISSING
+import asyncio
+import hashlib
 import json
 import logging
-import re
 from datetime import timedelta, timezone, datetime
 
-# Initialize Vertex AI
-init_params = {
-    "project": settings.GCP_PROJECT_ID,
-    "location": settings.GCP_LOCATION
-}
+# The Vertex AI SDK is imported and initialized on the first call (see ai_session.load_vertex)
 
-if settings.GCP_LOCATION != "global":
-    init_params["api_transport"] = "grpc"
+# Models are built once; the static prompts travel as system instructions
+analysis_session = ModelSession("analysis", config.AI_MODEL_ANALYSIS, SYSTEM_PROMPT, context_cache=config.AI_CONTEXT_CACHE_ENABLED)
+report_session = ModelSession(
+    "report", config.AI_MODEL_ANALYSIS, REPORT_VALIDATION_PROMPT,
+    context_cache=config.AI_CONTEXT_CACHE_ENABLED, timeout=config.AI_INTERACTIVE_TIMEOUT_SECONDS
+)
+comment_session = ModelSession(
+    "comment", config.AI_MODEL_ANALYSIS, CYNICAL_COMMENT_PROMPT,
+    context_cache=config.AI_CONTEXT_CACHE_ENABLED, timeout=config.AI_INTERACTIVE_TIMEOUT_SECONDS
+)
+transcription_session = ModelSession("transcription", config.AI_MODEL_MULTIMODAL)
 
-vertexai.init(**init_params)
+SESSIONS = (analysis_session, report_session, comment_session, transcription_session)
+
+async def response_config(schema: dict):
+    """JSON mode constrained to `schema`, or plain text with the JSON embedded."""
+    vertex = await load_vertex()
+    if config.AI_STRUCTURED_OUTPUT:
+        return vertex.GenerationConfig(response_mime_type="application/json", response_schema=schema)
+    return vertex.GenerationConfig(response_mime_type="text/plain")
+
+def get_ai_stats() -> dict:
+    sessions = {session.name: session.stats() for session in SESSIONS}
+    return {"sessions": sessions, "models": get_gate_stats()}
+
+async def warm_up_models():
+    """Imports the SDK and opens every model's channel ahead of the first real call."""
+    await asyncio.gather(*(session.warm_up() for session in SESSIONS))
+
+def _top_level_objects(text: str):
+    """
+    Yields (start, end) spans of top-level {...} blocks in one linear pass.
+    Strings are only tracked inside a block, so quotes and braces in the free-text
+    reasoning around the JSON do not confuse the scanner.
+    """
+    depth = 0
+    start = 0
+    in_string = False
+    escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"' and depth:
+            in_string = True
+        elif ch == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif ch == "}" and depth:
+            depth -= 1
+            if depth == 0:
+                yield start, i + 1
+
+def _last_object_span(text: str):
+    """
+    Finds the {...} block ending at the last '}' by scanning backwards.
+    Only the JSON itself is visited, so stray braces in the reasoning before it
+    cannot unbalance the scan.
+    """
+    end = text.rfind("}")
+    depth = 0
+    in_string = False
+    i = end
+    while i >= 0:
+        ch = text[i]
+        if ch == '"':
+            backslashes = 0
+            while i - backslashes - 1 >= 0 and text[i - backslashes - 1] == "\\":
+                backslashes += 1
+            if backslashes % 2 == 0:
+                in_string = not in_string
+        elif not in_string:
+            if ch == "}":
+                depth += 1
+            elif ch == "{":
+                depth -= 1
+                if depth == 0:
+                    return i, end + 1
+        i -= 1
+    return None
 
 def extract_json(text: str) -> dict:
     """
     Extracts JSON from text that might contain 'THOUGHT PROCESS' or other markers.
-    Looks for the first '{' and the last '}'.
+    Pure JSON (structured output) is parsed directly. Otherwise the FINAL JSON is
+    the block closing at the last '}', falling back to the last top-level block
+    that parses. All scans are linear in the response length.
     """
+    if not text:
+        return None
     try:
-        # Try finding the last '{' to '}' block
-        match = re.search(r'\{.*\}', text, re.DOTALL)
-        if match:
-            json_str = match.group(0)
-            return json.loads(json_str)
         return json.loads(text)
-    except Exception as e:
-        logging.error(f"Failed to extract JSON from AI response: {e}. Text: {text[:200]}...")
-        return None
+    except ValueError:
+        pass
+    span = _last_object_span(text)
+    if span:
+        try:
+            return json.loads(text[span[0]:span[1]])
+        except ValueError:
+            pass
+    for start, end in reversed(list(_top_level_objects(text))):
+        try:
+            return json.loads(text[start:end])
+        except ValueError:
+            continue
+    logging.error(f"Failed to extract JSON from AI response. Text: {text[:200]}...")
+    return None
 
 async def validate_report(target_text, context_msgs=None):
     """
@@ -42,8 +133,6 @@ async def validate_report(target_text, context_msgs=None):
     if not target_text:
         return {"valid": False, "reason": "Empty message", "points": 0}
 
-    model = GenerativeModel(config.AI_MODEL_ANALYSIS)
-    
     context_str = ""
     if context_msgs:
         context_str = "КОНТЕКСТ (Предыдущие сообщения):\n"
@@ -72,36 +161,71 @@ async def validate_report(target_text, context_msgs=None):
     СООБЩЕНИЕ НА ПРОВЕРКУ (REPORTED MESSAGE):
     "{target_text}"
     
-    Верни THOUGHT PROCESS и FINAL JSON.
+    {RESPONSE_FORMAT_NOTE}
     """
     
     try:
-        response = await model.generate_content_async(
-            contents=[REPORT_VALIDATION_PROMPT, prompt],
-            generation_config={"response_mime_type": "text/plain"} # Using plain text to handle mixed output
+        response = await report_session.generate(
+            contents=[prompt],
+            generation_config=await response_config(REPORT_VERDICT_SCHEMA)
         )
-        result = extract_json(response.text)
+        result = validate_report_verdict(extract_json(response.text))
         if result:
             return result
-        return {"valid": False, "reason": "AI Error (JSON Extraction)"}
+        return {"valid": False, "reason": "AI Error (JSON Extraction)", "error": True}
     except Exception as e:
         logging.error(f"Error during report validation: {e}")
-        return {"valid": False, "reason": f"AI Error: {str(e)}"}
+        return {"valid": False, "reason": f"AI Error: {str(e)}", "error": True}
 
-async def analyze_daily_logs(logs, active_agreements=None, date_str=None):
+# Verdicts by (chat_id, message_id, text hash); an edited message gets a fresh verdict
+report_verdicts = TTLCache(max_size=config.REPORT_VERDICT_CACHE_SIZE, ttl=config.REPORT_VERDICT_CACHE_TTL_SECONDS)
+_report_in_flight = {}
+
+async def validate_report_once(chat_id, message_id, target_text, load_context, apply_verdict):
     """
-    Sends chat logs to Gemini and returns the winner analysis.
+    validate_report with a verdict cache and single-flight coalescing: concurrent or
+    repeated reports of the same message share one AI call.
+    `load_context` is an async callable returning the context messages; it only runs
+    for the first report. `apply_verdict(verdict)` records a valid verdict (report flag,
+    points); it runs once, in the shared task, and the verdict is cached only after it
+    succeeded, so a report that failed halfway never makes later ones duplicates.
+    Returns (verdict, is_duplicate).
     """
-    if not logs:
-        return None
+    text_hash = hashlib.sha256((target_text or "").encode()).hexdigest()[:16]
+    key = (str(chat_id), str(message_id), text_hash)
 
-    model = GenerativeModel(config.AI_MODEL_ANALYSIS)
-    
-    id_map = {log.get('message_id'): log.get('username') for log in logs if log.get('message_id')}
+    verdict = report_verdicts.get(key)
+    if verdict is not MISSING:
+        return verdict, True
+
+    task = _report_in_flight.get(key)
+    if task is not None:
+        return await asyncio.shield(task), True
+
+    async def _validate():
+        context_msgs = await load_context()
+        verdict = await validate_report(target_text, context_msgs)
+        if verdict and not verdict.get("error"):
+            if verdict.get("valid"):
+                await apply_verdict(verdict)
+            report_verdicts.set(key, verdict)
+        return verdict
 
-    chat_history = "LOG START\n"
+    task = asyncio.create_task(_validate())
+    _report_in_flight[key] = task
+    # Cleared when the task ends, not when the first caller does: a cancelled
+    # update must not let the next report start a second task
+    task.add_done_callback(lambda _: _report_in_flight.pop(key, None))
+    return await asyncio.shield(task), False
+
+def format_log_lines(logs):
+    """
+    Renders chat logs as prompt lines: [HH:MM] user (ID): text [reply/report tags].
+    """
+    id_map = {log.get('message_id'): log.get('username') for log in logs if log.get('message_id')}
     moscow_tz = timezone(timedelta(hours=config.TIMEZONE_OFFSET))
     
+    lines = []
     for log in logs:
         ts = log['timestamp']
         if hasattr(ts, 'astimezone'):
@@ -128,8 +252,59 @@ async def analyze_daily_logs(logs, active_agreements=None, date_str=None):
             if points_awarded > 0:
                 report_tag += f" [POINTS ALREADY AWARDED ({points_awarded}) - DO NOT SCORE]"
 
-        chat_history += f"[{time_str}] {log['username']} (ID: {log['user_id']}){reply_context}: {log['text']}{report_tag}\n"
-    chat_history += "LOG END"
+        lines.append(f"[{time_str}] {log['username']} (ID: {log['user_id']}){reply_context}: {log['text']}{report_tag}\n")
+    return lines
+
+async def analyze_daily_logs(logs, active_agreements=None, date_str=None, context_logs=None, candidates=None, slice_pass=False):
+    """
+    Sends chat logs to Gemini and returns the winner analysis.
+    `context_logs` are earlier, already judged messages shown for context only
+    (30-minute slices and the nightly tail of incremental analysis).
+    With `slice_pass` (30-minute passes) the model lists candidate incidents
+    instead of picking the Snitch of the Day; the nightly pass gets them back as
+    `candidates` and turns them, with the remaining logs, into the day's verdict.
+    Logs over AI_PROMPT_TOKEN_BUDGET are split into overlapping windows that are
+    analyzed concurrently and reduced into one verdict.
+    """
+    if not logs and not candidates:
+        return None
+
+    log_lines = format_log_lines(logs)
+    context_section = ""
+    if context_logs:
+        context_section = f"""
+    Предыдущие сообщения (только контекст: они уже оценены, очки за них НЕ начисляй, но серии и ответы учитывай):
+    CONTEXT START
+    {"".join(format_log_lines(context_logs))}CONTEXT END
+    """
+
+    candidates_section = ""
+    if candidates:
+        candidate_lines = "".join(
+            f"- {c.get('username')} (ID: {c.get('user_id')}): {c.get('category')}, {c.get('points', 0)} очков. "
+            f"{c.get('reason', '')} Цитата: {c.get('quote') or '-'}\n"
+            for c in candidates
+        )
+        candidates_section = f"""
+    Кандидаты в нарушители из проверок в течение дня (эти сообщения уже прочитаны, в логе их нет):
+    CANDIDATES START
+    {candidate_lines}CANDIDATES END
+    """
+
+    if slice_pass:
+        task_note = (
+            "Это лишь фрагмент дня: НЕ выбирай Снитча Дня и не суммируй очки. "
+            "Перечисли в offenders каждого кандидата на нарушение с категорией, очками по шкале категорий, "
+            "обоснованием и цитатой. Итоговый вердикт вынесет вечерний разбор."
+        )
+    elif candidates:
+        task_note = (
+            "Определи Снитча Дня согласно твоей системной инструкции по логу и кандидатам вместе. "
+            "Вердикт и очки выноси за весь день, как если бы видел его целиком: серия одного типа "
+            "у одного юзера — один проступок, даже если кандидатов по ней несколько."
+        )
+    else:
+        task_note = "Определи Снитча Дня согласно твоей системной инструкции."
 
     agreements_text = "Нет действующих договоренностей."
     if config.ENABLE_AGREEMENTS and active_agreements:
@@ -157,41 +332,64 @@ async def analyze_daily_logs(logs, active_agreements=None, date_str=None):
     {agreements_text}
     """
 
-    prompt = f"""
+    def build_prompt(lines, part_note=""):
+        chat_history = "LOG START\n" + "".join(lines) + "LOG END"
+        return f"""
     СЕГОДНЯШНЯЯ ДАТА: {full_date_str}
-    {agreements_section}
-    Вот лог чата за сегодня:
+    {agreements_section}{context_section}{candidates_section}
+    Вот лог чата за сегодня{part_note}:
     {chat_history}
     
-    Определи Снитча Дня согласно твоей системной инструкции. Верни THOUGHT PROCESS и FINAL JSON.
+    {task_note} {RESPONSE_FORMAT_NOTE}
     {"ВАЖНО: Все описания договоренностей в поле 'text' должны быть на РУССКОМ ЯЗЫКЕ." if config.ENABLE_AGREEMENTS else ""}
     """
-    
-    try:
-        response = await model.generate_content_async(
-            contents=[SYSTEM_PROMPT, prompt],
-            generation_config={"response_mime_type": "text/plain"}
-        )
-        
-        logging.info(f"AI Response with thoughts: {response.text[:500]}...")
-        result = extract_json(response.text)
-        return result
-    except Exception as e:
-        logging.error(f"Error during AI analysis: {e}")
+
+    # Budget left for the log itself once the static prompt parts are counted
+    log_budget = config.AI_PROMPT_TOKEN_BUDGET - estimate_tokens(SYSTEM_PROMPT + build_prompt([]))
+    # An empty log still goes out once when there are candidates to judge
+    chunks = chunk_lines(log_lines, max(log_budget, 1), overlap=config.AI_CHUNK_OVERLAP_LINES) or [[]]
+
+    async def analyze_prompt(prompt):
+        try:
+            response = await analysis_session.generate(
+                contents=[prompt],
+                generation_config=await response_config(DAILY_VERDICT_SCHEMA)
+            )
+            
+            logging.info(f"AI Response with thoughts: {response.text[:500]}...")
+            return validate_daily_verdict(extract_json(response.text))
+        except Exception as e:
+            logging.error(f"Error during AI analysis: {e}")
+            return None
+
+    if len(chunks) == 1:
+        return await analyze_prompt(build_prompt(chunks[0]))
+
+    logging.info(f"Log of {len(logs)} messages exceeds the token budget, analyzing in {len(chunks)} parts.")
+    semaphore = asyncio.Semaphore(config.AI_CHUNK_CONCURRENCY)
+
+    async def analyze_chunk(i, lines):
+        part_note = f" (часть {i} из {len(chunks)}, соседние части пересекаются)"
+        async with semaphore:
+            return await analyze_prompt(build_prompt(lines, part_note))
+
+    partials = await asyncio.gather(*(analyze_chunk(i, lines) for i, lines in enumerate(chunks, 1)))
+    partials = [p for p in partials if p]
+    if not partials:
         return None
+    return merge_partial_verdicts(partials)
 
 async def transcribe_media(file_data: bytes, mime_type: str) -> str:
     """
     Transcribes voice or video using Gemini Multimodal.
     """
-    model = GenerativeModel(config.AI_MODEL_MULTIMODAL)
-    
     prompt = "Transcribe this audio/video verbatim. Return only the text in Russian (or original language if not Russian)."
     
     try:
-        response = await model.generate_content_async(
+        vertex = await load_vertex()
+        response = await transcription_session.generate(
             contents=[
-                Part.from_data(data=file_data, mime_type=mime_type),
+                vertex.Part.from_data(data=file_data, mime_type=mime_type),
                 prompt
             ]
         )
@@ -204,8 +402,6 @@ async def generate_cynical_comment(context_msgs, current_text, current_username=
     """
     Generates a short, cynical comment based on context.
     """
-    model = GenerativeModel(config.AI_MODEL_ANALYSIS)
-    
     context_str = ""
     for msg in context_msgs:
         name = msg.get('username', 'Unknown')
@@ -223,8 +419,8 @@ async def generate_cynical_comment(context_msgs, current_text, current_username=
     """
     
     try:
-        response = await model.generate_content_async(
-            contents=[CYNICAL_COMMENT_PROMPT, prompt]
+        response = await comment_session.generate(
+            contents=[prompt]
         )
         return response.text.strip()
     except Exception as e:
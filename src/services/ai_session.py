@@ -0,0 +1,308 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import timedelta
+
+from google.api_core import exceptions as api_exceptions
+
+from src.utils.config import settings
+from src.utils.game_config import config
+from src.services import metrics
+
+# Errors worth another attempt: throttling, overload and server-side timeouts
+RETRYABLE_ERRORS = (
+    asyncio.TimeoutError,
+    api_exceptions.TooManyRequests,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.InternalServerError,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.GatewayTimeout,
+)
+
+
+_vertex = None  # vertexai.generative_models once load_vertex() has run
+_vertex_lock = asyncio.Lock()
+
+
+def _import_vertex():
+    import vertexai
+    from vertexai import generative_models
+
+    init_params = {
+        "project": settings.GCP_PROJECT_ID,
+        "location": settings.GCP_LOCATION
+    }
+    if settings.GCP_LOCATION != "global":
+        init_params["api_transport"] = "grpc"
+    vertexai.init(**init_params)
+    return generative_models
+
+
+async def load_vertex():
+    """
+    Imports and initializes the Vertex AI SDK on first use and returns
+    vertexai.generative_models. The import takes seconds, so it runs in a
+    thread instead of at startup or on the event loop.
+    """
+    global _vertex
+    if _vertex is None:
+        async with _vertex_lock:
+            if _vertex is None:
+                _vertex = await asyncio.to_thread(_import_vertex)
+    return _vertex
+
+
+def _create_cached_content(**kwargs):
+    from vertexai.preview import caching
+    return caching.CachedContent.create(**kwargs)
+
+
+class AIUnavailable(Exception):
+    """Raised without calling Vertex while the model's circuit breaker is open."""
+
+
+class ModelGate:
+    """
+    Shared by every session of one model: caps concurrent calls across the
+    process and trips a circuit breaker after consecutive failures.
+    While open, calls fail fast; after the cooldown a single trial call is let
+    through and closes the breaker again if it succeeds.
+    """
+
+    def __init__(self, model_name: str, concurrency: int):
+        self.model_name = model_name
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self.rejected = 0
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < config.AI_BREAKER_COOLDOWN_SECONDS:
+            return "open"
+        return "half_open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self._trial_running):
+            self.rejected += 1
+            raise AIUnavailable(f"{self.model_name} circuit breaker is open")
+        if state == "half_open":
+            self._trial_running = True
+
+    def release_trial(self):
+        self._trial_running = False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self._trial_running or self.consecutive_failures >= config.AI_BREAKER_FAILURE_THRESHOLD:
+            if self.opened_at is None or self._trial_running:
+                self.trips += 1
+                logging.error(f"Circuit breaker for {self.model_name} opened after {self.consecutive_failures} failures.")
+            self.opened_at = time.monotonic()
+        self._trial_running = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
+
+
+_gates = {}
+
+
+def get_gate(model_name: str) -> ModelGate:
+    gate = _gates.get(model_name)
+    if gate is None:
+        if model_name == config.AI_MODEL_MULTIMODAL:
+            concurrency = config.AI_MULTIMODAL_CONCURRENCY
+        else:
+            concurrency = config.AI_ANALYSIS_CONCURRENCY
+        gate = _gates[model_name] = ModelGate(model_name, concurrency)
+    return gate
+
+
+def get_gate_stats() -> dict:
+    return {name: gate.stats() for name, gate in _gates.items()}
+
+
+class ModelSession:
+    """
+    A Gemini model with a fixed system instruction, built once and reused for every call.
+
+    The static prompt (rules, lore, output format) is sent as the system instruction,
+    so it forms a stable prefix that Gemini's implicit caching can reuse. With
+    `context_cache` it is also stored as a Vertex context cache, which is created
+    lazily, recreated before it expires and skipped if Vertex refuses it
+    (e.g. prompt below the minimum cacheable size).
+
+    Calls go through the model's gate (concurrency limit and circuit breaker), get a
+    per-attempt deadline of `timeout` seconds and are retried with jittered
+    exponential backoff on retryable errors, as long as a full attempt still fits
+    into the overall `deadline` (AI_CALL_DEADLINE_SECONDS, below the scheduler's
+    per-chat timeout so a job is not cancelled in the middle of a retry). Every call logs its token usage and
+    latency and adds them to `stats()`.
+    """
+
+    def __init__(self, name: str, model_name: str, system_instruction: str = None, context_cache: bool = False, timeout: float = None, deadline: float = None):
+        self.name = name
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.context_cache = context_cache and bool(system_instruction)
+        self.timeout = timeout or config.AI_TIMEOUT_SECONDS
+        self.deadline = deadline or config.AI_CALL_DEADLINE_SECONDS
+        self._model = None
+        self._cached_model = None
+        self._cache_expires_at = 0.0
+        self._lock = asyncio.Lock()
+        self._stats = {
+            "calls": 0,
+            "errors": 0,
+            "attempts": 0,
+            "retries": 0,
+            "timeouts": 0,
+            "prompt_tokens": 0,
+            "cached_tokens": 0,
+            "output_tokens": 0,
+            "total_seconds": 0.0,
+            "max_seconds": 0.0,
+        }
+
+    def _plain_model(self, vertex):
+        if self._model is None:
+            self._model = vertex.GenerativeModel(self.model_name, system_instruction=self.system_instruction)
+        return self._model
+
+    async def _get_model(self):
+        vertex = await load_vertex()
+        if not self.context_cache:
+            return self._plain_model(vertex)
+        if self._cached_model is not None and time.monotonic() < self._cache_expires_at:
+            return self._cached_model
+
+        async with self._lock:
+            if self._cached_model is not None and time.monotonic() < self._cache_expires_at:
+                return self._cached_model
+            ttl = timedelta(minutes=config.AI_CONTEXT_CACHE_TTL_MINUTES)
+            try:
+                cached_content = await asyncio.to_thread(
+                    _create_cached_content,
+                    model_name=self.model_name,
+                    system_instruction=self.system_instruction,
+                    ttl=ttl,
+                    display_name=f"snitch-{self.name}"
+                )
+            except Exception as e:
+                logging.warning(f"Context cache for {self.name} unavailable, using plain system instruction: {e}")
+                self.context_cache = False
+                return self._plain_model(vertex)
+            self._cached_model = vertex.GenerativeModel.from_cached_content(cached_content=cached_content)
+            # Recreate a bit early so no call lands on an expired cache
+            self._cache_expires_at = time.monotonic() + ttl.total_seconds() - 300
+            logging.info(f"Created context cache {cached_content.name} for {self.name}.")
+            return self._cached_model
+
+    async def warm_up(self):
+        """Builds the model (and context cache) and opens its channel with a free count_tokens call."""
+        model = await self._get_model()
+        await asyncio.wait_for(model.count_tokens_async("ping"), timeout=self.timeout)
+
+    async def _attempt(self, gate: ModelGate, contents, generation_config, timeout: float):
+        gate.before_call()
+        try:
+            async with gate.semaphore:
+                return await self._call(gate, contents, generation_config, timeout)
+        except asyncio.CancelledError:
+            # A cancelled half-open trial must not keep the breaker blocked
+            gate.release_trial()
+            raise
+
+    async def _call(self, gate: ModelGate, contents, generation_config, timeout: float):
+        model = await self._get_model()
+        self._stats["attempts"] += 1
+        try:
+            response = await asyncio.wait_for(
+                model.generate_content_async(contents=contents, generation_config=generation_config),
+                timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            self._stats["timeouts"] += 1
+            gate.record_failure()
+            raise
+        except RETRYABLE_ERRORS:
+            gate.record_failure()
+            raise
+        except Exception:
+            # Bad requests say nothing about the endpoint's health either way:
+            # the breaker stays as it is, only a half-open trial slot is freed
+            gate.release_trial()
+            if model is self._cached_model:
+                # The cache may have been evicted server-side, rebuild it on the next call
+                self._cached_model = None
+            raise
+        gate.record_success()
+        return response
+
+    async def generate(self, contents, generation_config=None):
+        """Runs generate_content_async with deadline, retries and breaker; records usage."""
+        gate = get_gate(self.model_name)
+        started = time.monotonic()
+        deadline = started + self.deadline
+        self._stats["calls"] += 1
+        try:
+            for attempt in range(config.AI_MAX_RETRIES + 1):
+                try:
+                    timeout = min(self.timeout, deadline - time.monotonic())
+                    response = await self._attempt(gate, contents, generation_config, timeout)
+                    break
+                except RETRYABLE_ERRORS as e:
+                    # Full jitter keeps retries from many chats from arriving in lockstep
+                    delay = random.uniform(0, min(config.AI_RETRY_MAX_DELAY_SECONDS, config.AI_RETRY_BASE_DELAY_SECONDS * 2 ** attempt))
+                    if attempt == config.AI_MAX_RETRIES or deadline - time.monotonic() - delay < self.timeout:
+                        raise
+                    self._stats["retries"] += 1
+                    logging.warning(f"[AI {self.name}] Attempt {attempt + 1} failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+        except Exception:
+            self._stats["errors"] += 1
+            metrics.observe_ai_call(self.name, time.monotonic() - started, failed=True)
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            self._stats["total_seconds"] += elapsed
+            self._stats["max_seconds"] = max(self._stats["max_seconds"], elapsed)
+
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+        cached_tokens = getattr(usage, "cached_content_token_count", 0) or 0
+        output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+        self._stats["prompt_tokens"] += prompt_tokens
+        self._stats["cached_tokens"] += cached_tokens
+        self._stats["output_tokens"] += output_tokens
+        metrics.observe_ai_call(self.name, elapsed, prompt_tokens, cached_tokens, output_tokens)
+        logging.info(
+            f"[AI {self.name}] {elapsed:.2f}s, tokens: "
+            f"prompt={prompt_tokens} (cached {cached_tokens}), output={output_tokens}"
+        )
+        return response
+
+    def stats(self) -> dict:
+        calls = self._stats["calls"]
+        return {
+            **self._stats,
+            "avg_seconds": self._stats["total_seconds"] / calls if calls else 0.0,
+            "error_rate": self._stats["errors"] / calls if calls else 0.0,
+        }
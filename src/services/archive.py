@@ -0,0 +1,163 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timezone, timedelta
+
+from ..utils.config import settings
+from ..utils.game_config import config
+from .db import get_logs_for_time_range, get_all_messages, get_oldest_message_timestamp, delete_messages
+
+# Message archive: one gzipped JSON-lines file per chat and UTC day,
+# {MESSAGE_ARCHIVE_DIR}/{chat_id}/{YYYY-MM-DD}.jsonl.gz, stored in the
+# LORE_BUCKET_NAME bucket or, without a bucket, on the local disk.
+
+_bucket = None
+
+
+def _get_bucket():
+    global _bucket
+    if _bucket is None:
+        # Imported here so the bot does not pay for the storage client unless it archives
+        from google.cloud import storage
+        _bucket = storage.Client().bucket(settings.LORE_BUCKET_NAME)
+    return _bucket
+
+
+def _day_path(chat_id, day: datetime) -> str:
+    return f"{settings.MESSAGE_ARCHIVE_DIR}/{chat_id}/{day.strftime('%Y-%m-%d')}.jsonl.gz"
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"Cannot archive value of type {type(value).__name__}")
+
+
+def _decode(obj: dict):
+    if len(obj) == 1 and "$date" in obj:
+        return datetime.fromisoformat(obj["$date"])
+    return obj
+
+
+def _read_file(path: str) -> bytes | None:
+    if settings.LORE_BUCKET_NAME:
+        from google.api_core.exceptions import NotFound
+        try:
+            return _get_bucket().blob(path).download_as_bytes()
+        except NotFound:
+            return None
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _write_file(path: str, data: bytes):
+    if settings.LORE_BUCKET_NAME:
+        _get_bucket().blob(path).upload_from_string(data, content_type="application/gzip")
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _list_day_paths(chat_id) -> list:
+    prefix = f"{settings.MESSAGE_ARCHIVE_DIR}/{chat_id}/"
+    if settings.LORE_BUCKET_NAME:
+        bucket = _get_bucket()
+        names = [blob.name for blob in bucket.client.list_blobs(bucket, prefix=prefix)]
+    else:
+        try:
+            names = [prefix + name for name in os.listdir(prefix)]
+        except FileNotFoundError:
+            return []
+    return sorted(name for name in names if name.endswith(".jsonl.gz"))
+
+
+def _load_day(path: str) -> list:
+    data = _read_file(path)
+    if not data:
+        return []
+    lines = gzip.decompress(data).decode("utf-8").splitlines()
+    return [json.loads(line, object_hook=_decode) for line in lines if line]
+
+
+def _store_day(path: str, logs: list):
+    """Writes a day file, merging with what an interrupted earlier run already stored."""
+    by_id = {log['message_id']: log for log in _load_day(path)}
+    by_id.update((log['message_id'], log) for log in logs)
+    ordered = sorted(by_id.values(), key=lambda x: x['timestamp'])
+    body = "\n".join(json.dumps(log, ensure_ascii=False, default=_encode) for log in ordered)
+    _write_file(path, gzip.compress(body.encode("utf-8")))
+
+
+def _day_from_path(path: str) -> datetime:
+    day = os.path.basename(path).split(".")[0]
+    return datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+
+
+async def archive_chat(chat_id) -> dict:
+    """
+    Moves messages older than MESSAGE_RETENTION_DAYS to the archive, one UTC day at a time.
+    A day is deleted from Firestore only after its file is written, so an interrupted
+    run just archives that day again on the next run.
+    """
+    chat_id = str(chat_id)
+    now = datetime.now(timezone.utc)
+    cutoff = (now - timedelta(days=config.MESSAGE_RETENTION_DAYS)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    oldest = await get_oldest_message_timestamp(chat_id)
+    if oldest is None or oldest >= cutoff:
+        return {"status": "nothing_to_archive"}
+
+    day = oldest.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    archived = 0
+    days = 0
+    for _ in range(config.MESSAGE_ARCHIVE_MAX_DAYS_PER_RUN):
+        if day >= cutoff:
+            break
+        next_day = day + timedelta(days=1)
+        logs = await get_logs_for_time_range(chat_id, day, next_day)
+        if logs:
+            await asyncio.to_thread(_store_day, _day_path(chat_id, day), logs)
+            await delete_messages(chat_id, logs, day, next_day)
+            archived += len(logs)
+            days += 1
+        day = next_day
+
+    logging.info(f"Archived {archived} messages of chat {chat_id} from {days} days before {cutoff.date()}.")
+    return {"status": "archived", "messages": archived, "days": days}
+
+
+async def get_archived_messages(chat_id, start_dt: datetime = None, end_dt: datetime = None) -> list:
+    """Archived messages of a chat, optionally limited to [start_dt, end_dt)."""
+    paths = await asyncio.to_thread(_list_day_paths, str(chat_id))
+    logs = []
+    for path in paths:
+        day = _day_from_path(path)
+        if (end_dt and day >= end_dt) or (start_dt and day + timedelta(days=1) <= start_dt):
+            continue
+        for log in await asyncio.to_thread(_load_day, path):
+            if (start_dt is None or log['timestamp'] >= start_dt) and (end_dt is None or log['timestamp'] < end_dt):
+                logs.append(log)
+    return logs
+
+
+async def get_message_history(chat_id, start_dt: datetime = None, end_dt: datetime = None) -> list:
+    """
+    Archived and hot messages together, ordered by timestamp.
+    Without a range this is the whole history (lore/feedback scripts).
+    """
+    if start_dt is None:
+        hot = [log for log in await get_all_messages(chat_id) if end_dt is None or log['timestamp'] < end_dt]
+    else:
+        hot = await get_logs_for_time_range(chat_id, start_dt, end_dt or datetime.now(timezone.utc))
+    # A day archived right before its deletion failed is in both, the hot copy wins
+    by_id = {log['message_id']: log for log in await get_archived_messages(chat_id, start_dt, end_dt)}
+    by_id.update((log['message_id'], log) for log in hot)
+    return sorted(by_id.values(), key=lambda x: x['timestamp'])
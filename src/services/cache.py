@@ -0,0 +1,183 @@
+import copy
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+# Distinguishes "not cached" from a cached None (e.g. a document that does not exist)
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Bounded LRU cache with per-entry expiry.
+    Values are copied on the way in and out, so callers can mutate what they get.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=MISSING):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return copy.deepcopy(entry[1])
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, copy.deepcopy(value))
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def merge(self, key, fields: dict):
+        """Applies a partial update to a cached dict. Uncached keys are left alone."""
+        entry = self._data.get(key)
+        if entry is None:
+            return
+        current = entry[1] if isinstance(entry[1], dict) else {}
+        current.update(copy.deepcopy(fields))
+        self._data[key] = (entry[0], current)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+class RecentMessages:
+    """
+    Per-chat ring buffer of the last logged messages, ordered by timestamp.
+
+    For each chat it tracks `covered_from`: every message with a timestamp at or
+    after it is in the buffer. Lookups are only answered when that guarantees the
+    same result as the Firestore range query; otherwise callers fall back.
+    Assumes the chat's updates are handled by this instance (single Cloud Run
+    instance or sticky routing); other instances' messages only show up on fallback.
+    """
+
+    def __init__(self, per_chat: int, max_chats: int):
+        self.per_chat = per_chat
+        self.max_chats = max_chats
+        self._chats = OrderedDict()  # chat_id -> {"messages": [...], "covered_from": datetime | None}
+        self.hits = 0
+        self.misses = 0
+
+    def _chat(self, chat_id):
+        chat_id = str(chat_id)
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = {"messages": [], "covered_from": None}
+            self._chats[chat_id] = chat
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        self._chats.move_to_end(chat_id)
+        return chat
+
+    @staticmethod
+    def _insert(messages, message):
+        # Messages arrive almost always in order, so scan from the end
+        i = len(messages)
+        while i > 0 and messages[i - 1]['timestamp'] > message['timestamp']:
+            i -= 1
+        messages.insert(i, message)
+
+    def _trim(self, chat):
+        messages = chat["messages"]
+        if len(messages) > self.per_chat:
+            last_dropped = messages[len(messages) - self.per_chat - 1]['timestamp']
+            del messages[:len(messages) - self.per_chat]
+            first_kept = messages[0]['timestamp']
+            # A kept message sharing the dropped one's timestamp is not "everything at or after" it
+            chat["covered_from"] = first_kept if first_kept > last_dropped else last_dropped + timedelta(microseconds=1)
+
+    def add(self, chat_id, message: dict):
+        """Records a freshly logged message (must include message_id and timestamp)."""
+        chat = self._chat(chat_id)
+        messages = chat["messages"]
+        for i, existing in enumerate(messages):
+            if existing['message_id'] == message['message_id']:
+                messages[i] = dict(message)
+                return
+        if chat["covered_from"] is None:
+            # Everything from now on passes through log_message
+            chat["covered_from"] = message['timestamp']
+        self._insert(messages, dict(message))
+        self._trim(chat)
+
+    def update(self, chat_id, message_id, fields: dict):
+        """Applies an edit/report to a buffered message in place."""
+        chat = self._chats.get(str(chat_id))
+        if not chat:
+            return
+        for message in chat["messages"]:
+            if message['message_id'] == str(message_id):
+                message.update(fields)
+                return
+
+    def get(self, chat_id, message_id):
+        chat = self._chats.get(str(chat_id))
+        if chat:
+            for message in chat["messages"]:
+                if message['message_id'] == str(message_id):
+                    self.hits += 1
+                    return dict(message)
+        self.misses += 1
+        return None
+
+    def before(self, chat_id, before_timestamp, limit: int):
+        """Last `limit` messages before the timestamp, or None if the buffer can't tell."""
+        chat = self._chats.get(str(chat_id))
+        if chat and chat["covered_from"] is not None:
+            # A late message older than the coverage may have unbuffered neighbours
+            candidates = [m for m in chat["messages"] if chat["covered_from"] <= m['timestamp'] < before_timestamp]
+            if len(candidates) >= limit:
+                self.hits += 1
+                return [dict(m) for m in candidates[len(candidates) - limit:]]
+        self.misses += 1
+        return None
+
+    def after(self, chat_id, after_timestamp, limit: int):
+        """First `limit` messages after the timestamp, or None if the buffer can't tell."""
+        chat = self._chats.get(str(chat_id))
+        if chat and chat["covered_from"] is not None and after_timestamp >= chat["covered_from"]:
+            self.hits += 1
+            return [dict(m) for m in chat["messages"] if m['timestamp'] > after_timestamp][:limit]
+        self.misses += 1
+        return None
+
+    def seed_before(self, chat_id, before_timestamp, messages, limit: int):
+        """
+        Warms the buffer with a Firestore result for `before()`. Only applied when the
+        result ends right where the buffer's coverage starts, so coverage stays contiguous.
+        """
+        chat = self._chats.get(str(chat_id))
+        if not chat or chat["covered_from"] is None or before_timestamp < chat["covered_from"]:
+            return
+        known = {m['message_id'] for m in chat["messages"]}
+        for message in messages:
+            if message['message_id'] not in known:
+                self._insert(chat["messages"], dict(message))
+        if len(messages) < limit:
+            # Firestore has nothing older than what it returned
+            chat["covered_from"] = messages[0]['timestamp'] if messages else chat["covered_from"]
+        elif messages:
+            chat["covered_from"] = min(chat["covered_from"], messages[0]['timestamp'])
+        self._trim(chat)
+
+    def stats(self) -> dict:
+        return {"chats": len(self._chats), "hits": self.hits, "misses": self.misses}
@@ -1,20 +1,242 @@
 from google.cloud import firestore
+from google.api_core.exceptions import FailedPrecondition
 from datetime import datetime, timezone, timedelta
 import logging
+from ..utils.config import settings
 from ..utils.game_config import config
+from .local_store import LocalAsyncClient
+from .write_buffer import WriteBuffer, FIRESTORE_BATCH_LIMIT
+from .cache import TTLCache, RecentMessages, MISSING
+from .metrics import track_db, instrument_firestore
 
 def get_current_season_id():
     """Returns the current season ID (Global)."""
     return "global" # Single season forever, only weekly decay
 
-# Initialize Firestore Async Client
-# Note: Requires GOOGLE_APPLICATION_CREDENTIALS env var or running in GCP
-db = firestore.AsyncClient()
+def create_client():
+    """
+    Builds the document store client selected by settings.STORAGE_BACKEND.
+    The local backends implement the same document API as Firestore, so every
+    function below works unchanged against them.
+    """
+    backend = settings.STORAGE_BACKEND.lower()
+    if backend == "firestore":
+        # Note: Requires GOOGLE_APPLICATION_CREDENTIALS env var or running in GCP
+        return firestore.AsyncClient()
+    if backend == "memory":
+        return LocalAsyncClient()
+    if backend == "sqlite":
+        return LocalAsyncClient(sqlite_path=settings.SQLITE_PATH)
+    raise ValueError(f"Unknown STORAGE_BACKEND: {settings.STORAGE_BACKEND}")
+
+class LazyClient:
+    """
+    Forwards to the client from `factory`, built on first use. Creating a Firestore
+    client resolves credentials (a metadata-server call on Cloud Run), so importing
+    this module stays free of I/O; /warmup builds it ahead of the first update.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._factory()
+        return self._client
 
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+db = LazyClient(create_client)
+instrument_firestore()
+
+# Hot-path message writes are coalesced and committed in batches.
+# main.py starts the flush loop on startup and drains it on shutdown.
+write_buffer = WriteBuffer(
+    db,
+    max_size=config.WRITE_BUFFER_MAX_SIZE,
+    flush_interval=config.WRITE_BUFFER_FLUSH_INTERVAL_SECONDS,
+    max_attempts=config.WRITE_BUFFER_MAX_ATTEMPTS
+)
+
+# user_stats documents keyed by (chat_id, user_id), kept coherent by write-through
+# from every function below that changes them. The TTL bounds staleness from
+# writes made by other instances or by hand in the console, which is why point
+# changes never read it (see _apply_points).
+user_stats_cache = TTLCache(
+    max_size=config.USER_STATS_CACHE_SIZE,
+    ttl=config.USER_STATS_CACHE_TTL_SECONDS
+)
+
+# Last messages of each chat as they pass through log_message/log_reaction,
+# serving context lookups for cynical comments and /report.
+recent_messages = RecentMessages(
+    per_chat=config.RECENT_MESSAGES_PER_CHAT,
+    max_chats=config.RECENT_MESSAGES_MAX_CHATS
+)
+
+# Fields of user_stats mirrored into the per-chat roster document
+ROSTER_FIELDS = ("username", "full_name", "total_points", "current_rank", "season_id", "snitch_count", "achievements", "last_active_date")
+
+def roster_ref(chat_id):
+    """
+    Materialized roster of a chat: chats/{chat_id}/meta/roster = { "users": { user_id: {...} } }.
+    Serves /stats, /all and AFK checks with a single document read.
+    """
+    return db.collection("chats").document(str(chat_id)).collection("meta").document("roster")
+
+def roster_update(user_id, data: dict) -> dict:
+    """Builds a merge payload that mirrors the roster-relevant fields of a user_stats write."""
+    return {"users": {str(user_id): {k: v for k, v in data.items() if k in ROSTER_FIELDS}}}
+
+# --- Message storage ---
+# "documents" layout: chats/{chat_id}/messages/{msg_id}, one document per message.
+# "shards" layout: chats/{chat_id}/message_shards/{YYYYMMDDHH} =
+#   { "start": datetime, "message_ids": [int...], "messages": { msg_id: {...} } }
+# with one shard per MESSAGE_SHARD_HOURS, so a day of logs is one get_all instead of
+# a stream of thousands of documents. "message_ids" lets get_message find a shard
+# with an array_contains query when the message timestamp is unknown.
+# "messages" is never queried and needs the index exemption from setup.md: Firestore
+# indexes every nested field, and a busy shard would hit the index-entry limit.
+
+def shards_enabled() -> bool:
+    return config.MESSAGE_STORAGE_LAYOUT == "shards"
+
+def _as_utc(dt: datetime) -> datetime:
+    return dt.astimezone(timezone.utc) if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+def shard_start(timestamp: datetime) -> datetime:
+    """Start of the shard holding messages sent at `timestamp` (UTC)."""
+    ts = _as_utc(timestamp)
+    return ts.replace(hour=ts.hour - ts.hour % config.MESSAGE_SHARD_HOURS, minute=0, second=0, microsecond=0)
+
+def shards_collection(chat_id):
+    return db.collection("chats").document(str(chat_id)).collection("message_shards")
+
+def shard_ref(chat_id, start: datetime):
+    return shards_collection(chat_id).document(start.strftime("%Y%m%d%H"))
+
+def message_write(chat_id, msg_id: str, data: dict):
+    """Returns (ref, payload, merge) that stores one logged message in the configured layout."""
+    if not shards_enabled():
+        return db.collection("chats").document(str(chat_id)).collection("messages").document(msg_id), data, False
+    start = shard_start(data["timestamp"])
+    payload = {"start": start, "messages": {msg_id: data}}
+    if msg_id.isdigit():
+        payload["message_ids"] = firestore.ArrayUnion([int(msg_id)])
+    return shard_ref(chat_id, start), payload, True
+
+def _shard_messages(data: dict | None) -> list:
+    """Messages of a shard document; entries without a timestamp are edits of messages never logged."""
+    messages = (data or {}).get("messages") or {}
+    return [{**msg, "message_id": msg_id} for msg_id, msg in messages.items() if msg.get("timestamp")]
+
+async def _find_message_shard(chat_id, msg_id: str):
+    """Snapshot of the shard holding a message, looked up by id; None if it is not stored."""
+    if not msg_id.isdigit():
+        return None
+    await write_buffer.flush()
+    query = shards_collection(chat_id).where(filter=firestore.FieldFilter("message_ids", "array_contains", int(msg_id))).limit(1)
+    async for doc in query.stream():
+        return doc
+    return None
+
+async def _patch_message(chat_id: str, msg_id: str, update: dict, timestamp: datetime = None):
+    """Merges fields into a stored message in either layout."""
+    if not shards_enabled():
+        doc_ref = db.collection("chats").document(chat_id).collection("messages").document(msg_id)
+        await write_buffer.set(doc_ref, update, merge=True)
+        return
+
+    if timestamp is None:
+        cached = recent_messages.get(chat_id, msg_id)
+        timestamp = cached.get("timestamp") if cached else None
+    if timestamp is not None:
+        ref = shard_ref(chat_id, shard_start(timestamp))
+    else:
+        doc = await _find_message_shard(chat_id, msg_id)
+        if doc is None:
+            logging.warning(f"Message {msg_id} not found in chat {chat_id} shards, update skipped.")
+            return
+        ref = doc.reference
+    await write_buffer.set(ref, {"messages": {msg_id: update}}, merge=True)
+
+async def warm_up_client():
+    """Builds the client and opens its channel with a single read of a document that does not exist."""
+    await db.collection("chats").document("warmup").get()
+
+@track_db
+async def rebuild_roster(chat_id):
+    """
+    Rebuilds the roster from the user_stats collection.
+    Also picks up fields edited by hand in the console (e.g. achievements).
+    Runs in a transaction that also reads the roster, so a roster_update
+    merge landing during the scan retries the rebuild instead of being lost.
+    """
+    chat_id = str(chat_id)
+    stats_ref = db.collection("chats").document(chat_id).collection("user_stats")
+    ref = roster_ref(chat_id)
+    
+    # Buffered last_active updates must be in user_stats before the scan
+    await write_buffer.flush()
+    
+    @firestore.async_transactional
+    async def _rebuild_in_transaction(transaction):
+        await get_documents([ref], transaction=transaction)
+        users = {}
+        async for doc in stats_ref.stream(transaction=transaction):
+            data = doc.to_dict()
+            users[doc.id] = {k: v for k, v in data.items() if k in ROSTER_FIELDS}
+        transaction.set(ref, {"users": users, "rebuilt_at": firestore.SERVER_TIMESTAMP})
+        return users
+    
+    return await _rebuild_in_transaction(db.transaction())
+
+@track_db
+async def get_roster(chat_id):
+    """
+    Returns { user_id: {...} } for every user of the chat.
+    Builds the roster on first use for chats that predate it.
+    """
+    ref = roster_ref(chat_id)
+    doc = await ref.get()
+    data = write_buffer.overlay(ref, doc.to_dict() if doc.exists else None)
+    if data is None or "rebuilt_at" not in data:
+        return await rebuild_roster(chat_id)
+    return data.get("users", {})
+
+@track_db
+async def get_leaderboard(chat_id, limit: int = 10):
+    """
+    Returns the top users of the current season by points.
+    """
+    current_season = get_current_season_id()
+    roster = await get_roster(chat_id)
+    
+    stats_list = [
+        {**data, "user_id": uid} for uid, data in roster.items()
+        if data.get('season_id') == current_season
+    ]
+    stats_list.sort(key=lambda x: int(x.get('total_points', 0)), reverse=True)
+    return stats_list[:limit]
+
+@track_db
+async def get_active_chat_ids():
+    """Returns IDs of all chats where the bot is active."""
+    chat_ids = []
+    async for chat_doc in db.collection("chats").stream():
+        chat_data = chat_doc.to_dict()
+        if chat_data.get("active"):
+            chat_ids.append(chat_doc.id)
+    return chat_ids
+
+@track_db
 async def log_message(message, override_text=None):
     """
     Logs a telegram message to Firestore.
-    Structure: chats/{chat_id}/messages/{msg_id}
+    Structure: chats/{chat_id}/messages/{msg_id}, or a shard entry (see message_write)
     """
     chat_id = str(message.chat.id)
     user_id = str(message.from_user.id)
@@ -23,8 +245,6 @@ async def log_message(message, override_text=None):
     # Date key for partitioning/querying by day
     date_key = message.date.strftime("%Y-%m-%d")
     
-    doc_ref = db.collection("chats").document(chat_id).collection("messages").document(msg_id)
-    
     text_content = override_text or message.text or message.caption
     if not text_content and message.sticker:
         text_content = f"[STICKER] {message.sticker.emoji or 'Unknown'}"
@@ -54,29 +274,33 @@ async def log_message(message, override_text=None):
         "reply_to": message.reply_to_message.message_id if message.reply_to_message else None
     }
     
-    logging.debug(f"Writing message {msg_id} to Firestore (Chat: {chat_id})...")
-    await doc_ref.set(data)
-    logging.debug(f"Message {msg_id} written successfully.")
+    logging.debug(f"Queueing message {msg_id} for Firestore (Chat: {chat_id})...")
+    doc_ref, payload, merge = message_write(chat_id, msg_id, data)
+    await write_buffer.set(doc_ref, payload, merge=merge)
+    recent_messages.add(chat_id, {**data, "message_id": msg_id})
 
-    # Update user's last active date
+    # Update user's last active date (collapsed per user within a flush window)
     try:
         user_stats_ref = db.collection("chats").document(chat_id).collection("user_stats").document(user_id)
-        await user_stats_ref.set({
+        last_active_data = {
             "username": message.from_user.username or message.from_user.first_name,
             "last_active_date": message.date,
             "full_name": message.from_user.full_name # Ensure name is up to date
-        }, merge=True)
+        }
+        await write_buffer.set(user_stats_ref, last_active_data, merge=True)
+        await write_buffer.set(roster_ref(chat_id), roster_update(user_id, last_active_data), merge=True)
+        user_stats_cache.merge((chat_id, user_id), last_active_data)
     except Exception as e:
         logging.error(f"Failed to update last_active_date for user {user_id}: {e}")
 
-async def save_agreement(chat_id: int, agreement: dict):
+def agreements_ref(chat_id):
+    return db.collection("chats").document(str(chat_id)).collection("agreements")
+
+def new_agreement_data(agreement: dict) -> dict:
     """
-    Saves a new agreement found by AI.
+    Document data for a new agreement found by AI: active, with dispute window and expiry.
     agreement: { "text": "...", "users": [...], "type": "...", "expires_at": "..." }
     """
-    chat_id = str(chat_id)
-    coll_ref = db.collection("chats").document(chat_id).collection("agreements")
-    
     data = agreement.copy()
     data['status'] = 'active'
     # Ensure timestamp is set to SERVER_TIMESTAMP to avoid AI hallucinated dates
@@ -94,9 +318,16 @@ async def save_agreement(chat_id: int, agreement: dict):
             data['expires_at'] = datetime.fromisoformat(data['expires_at'].replace('Z', '+00:00'))
         except Exception:
             data['expires_at'] = datetime.now(timezone.utc) + timedelta(hours=config.AGREEMENT_DEFAULT_LIFESPAN_HOURS)
-        
-    await coll_ref.add(data)
+    return data
 
+@track_db
+async def save_agreement(chat_id: int, agreement: dict):
+    """
+    Saves a new agreement found by AI.
+    """
+    await agreements_ref(chat_id).add(new_agreement_data(agreement))
+
+@track_db
 async def get_agreement_by_id(chat_id: int, agreement_id: str):
     """Fetches a specific agreement."""
     doc = await db.collection("chats").document(str(chat_id)).collection("agreements").document(agreement_id).get()
@@ -106,12 +337,14 @@ async def get_agreement_by_id(chat_id: int, agreement_id: str):
         return data
     return None
 
-async def dispute_agreement(chat_id: int, agreement_id: str):
+@track_db
+async def dispute_agreement(chat_id: int, agreement_id: str, agreement: dict = None):
     """
     Marks an agreement as disputed if within the time window.
+    Pass `agreement` when it is already loaded to skip the read.
     Returns (success, message).
     """
-    ag = await get_agreement_by_id(chat_id, agreement_id)
+    ag = agreement or await get_agreement_by_id(chat_id, agreement_id)
     if not ag or ag.get('status') != 'active':
         return False, "not_found"
     
@@ -127,11 +360,13 @@ async def dispute_agreement(chat_id: int, agreement_id: str):
         return False, "too_late"
         
     # Success: mark as disputed
-    await db.collection("chats").document(str(chat_id)).collection("agreements").document(agreement_id).update({
+    await agreements_ref(chat_id).document(agreement_id).update({
         "status": "disputed"
     })
+    ag['status'] = "disputed"
     return True, "ok"
 
+@track_db
 async def update_agreement_status(chat_id: int, agreement_id: str, status: str, reason: str = None):
     """Updates agreement status (fulfilled/broken)."""
     update_data = {"status": status}
@@ -140,6 +375,7 @@ async def update_agreement_status(chat_id: int, agreement_id: str, status: str,
     
     await db.collection("chats").document(str(chat_id)).collection("agreements").document(agreement_id).update(update_data)
 
+@track_db
 async def update_agreement_text(chat_id: int, agreement_id: str, new_text: str, reason: str = None):
     """Updates agreement text and optionally adds an update reason."""
     update_data = {"text": new_text}
@@ -149,6 +385,7 @@ async def update_agreement_text(chat_id: int, agreement_id: str, new_text: str,
     
     await db.collection("chats").document(str(chat_id)).collection("agreements").document(agreement_id).update(update_data)
 
+@track_db
 async def get_last_agreement_check(chat_id: str) -> datetime:
     """Gets the timestamp of the last agreement check."""
     doc = await db.collection("chats").document(chat_id).get()
@@ -157,52 +394,169 @@ async def get_last_agreement_check(chat_id: str) -> datetime:
         return data.get('last_agreement_check')
     return None
 
+@track_db
 async def set_last_agreement_check(chat_id: str, ts: datetime):
     """Sets the timestamp of the last agreement check."""
     await db.collection("chats").document(chat_id).set({
         'last_agreement_check': ts
     }, merge=True)
 
+@track_db
+async def save_analysis_slice(chat_id: str, start_dt: datetime, end_dt: datetime, verdict: dict, message_count: int):
+    """
+    Persists the partial verdict of one 30-minute pass for incremental daily analysis.
+    Structure: chats/{chat_id}/analysis_slices/{start_ts}
+    """
+    verdict = verdict or {}
+    doc_ref = db.collection("chats").document(str(chat_id)).collection("analysis_slices").document(str(int(start_dt.timestamp())))
+    await doc_ref.set({
+        "start": start_dt,
+        "end": end_dt,
+        "message_count": message_count,
+        "offenders": verdict.get("offenders", []),
+        "new_agreements": verdict.get("new_agreements", []),
+        "resolved_agreements": verdict.get("resolved_agreements", []),
+        "updated_agreements": verdict.get("updated_agreements", []),
+        "created_at": firestore.SERVER_TIMESTAMP
+    })
+
+def awarded_reports_ref(chat_id):
+    """
+    Timestamps of messages whose /report awarded points:
+    chats/{chat_id}/meta/awarded_reports = { "timestamps": [datetime...] }.
+    """
+    return db.collection("chats").document(str(chat_id)).collection("meta").document("awarded_reports")
+
+@track_db
+async def note_awarded_report(chat_id, timestamp: datetime):
+    """Remembers a rewarded report, so the nightly run re-judges the slice holding the message."""
+    await awarded_reports_ref(chat_id).set({"timestamps": firestore.ArrayUnion([_as_utc(timestamp)])}, merge=True)
+
+@track_db
+async def get_awarded_reports(chat_id) -> list:
+    doc = await awarded_reports_ref(chat_id).get()
+    return [_as_utc(ts) for ts in (doc.to_dict() or {}).get("timestamps", [])] if doc.exists else []
+
+@track_db
+async def prune_awarded_reports(chat_id, timestamps: list):
+    """Drops timestamps no analysis window will cover again."""
+    if timestamps:
+        await awarded_reports_ref(chat_id).update({"timestamps": firestore.ArrayRemove(timestamps)})
+
+@track_db
+async def get_analysis_slices(chat_id: str, start_dt: datetime, end_dt: datetime):
+    """
+    Fetches partial verdicts of slices lying entirely within [start_dt, end_dt).
+    """
+    slices_ref = db.collection("chats").document(str(chat_id)).collection("analysis_slices")
+    query = slices_ref.where(filter=firestore.FieldFilter("start", ">=", start_dt))\
+                      .where(filter=firestore.FieldFilter("start", "<", end_dt))
+    
+    slices = []
+    async for doc in query.stream():
+        data = doc.to_dict()
+        slice_end = data.get('end')
+        if slice_end.tzinfo is None:
+            slice_end = slice_end.replace(tzinfo=timezone.utc)
+        if slice_end <= end_dt:
+            slices.append(data)
+    
+    slices.sort(key=lambda x: x['start'])
+    return slices
+
+def active_agreements_query(chat_id, op: str, value):
+    """
+    Active agreements with expires_at `op` value.
+    Needs the composite index agreements(status ASC, expires_at ASC), see setup.md.
+    """
+    return (agreements_ref(chat_id)
+            .where(filter=firestore.FieldFilter("status", "==", "active"))
+            .where(filter=firestore.FieldFilter("expires_at", op, value)))
+
+def is_live_agreement(agreement: dict, now: datetime) -> bool:
+    """Not expired yet; agreements with expires_at null (or missing) never expire."""
+    expires_at = agreement.get('expires_at')
+    return not isinstance(expires_at, datetime) or _as_utc(expires_at) > now
+
+async def _stream_active_agreements(chat_id):
+    """All active agreements, for when the expiry index is not built yet."""
+    query = agreements_ref(chat_id).where(filter=firestore.FieldFilter("status", "==", "active"))
+    return [doc async for doc in query.stream()]
+
+@track_db
 async def get_active_agreements(chat_id: int):
     """
-    Fetches active agreements for the chat.
+    Fetches active agreements for the chat that have not expired yet,
+    including ones the expiry sweep has not reached.
+    Agreements with expires_at null never expire. Firestore cannot query a
+    missing field, so older documents without one need
+    src/scripts/backfill_agreement_expiry.py to show up here.
     """
-    chat_id = str(chat_id)
-    coll_ref = db.collection("chats").document(chat_id).collection("agreements")
-    query = coll_ref.where(filter=firestore.FieldFilter("status", "==", "active"))
+    now = datetime.now(timezone.utc)
+    try:
+        docs = [doc async for doc in active_agreements_query(chat_id, ">", now).stream()]
+        # Null sorts before every timestamp, so the range query skips these
+        docs += [doc async for doc in active_agreements_query(chat_id, "==", None).stream()]
+    except FailedPrecondition as e:
+        # Index not built yet: fall back to the status query and filter here
+        logging.error(f"Agreement expiry index missing, filtering in memory: {e}")
+        docs = await _stream_active_agreements(chat_id)
     
     agreements = []
-    async for doc in query.stream():
+    for doc in docs:
         data = doc.to_dict()
         data['id'] = doc.id
-        agreements.append(data)
+        if is_live_agreement(data, now):
+            agreements.append(data)
     
-    # Sort in memory to avoid needing composite index
+    # Sort in memory, the query is ordered by expires_at
     # Handle cases where created_at might be None or missing
     def get_sort_key(x):
         ts = x.get('created_at')
         if not ts:
             return datetime.min.replace(tzinfo=timezone.utc)
-        return ts
+        return _as_utc(ts)
 
     agreements.sort(key=get_sort_key)
     return agreements
 
+@track_db
+async def expire_agreements(chat_id: int) -> int:
+    """
+    Moves active agreements past their expires_at to status "expired", in batched writes.
+    Returns how many expired.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        refs = [doc.reference async for doc in active_agreements_query(chat_id, "<=", now).stream()]
+    except FailedPrecondition as e:
+        logging.error(f"Agreement expiry index missing, filtering in memory: {e}")
+        refs = [doc.reference for doc in await _stream_active_agreements(chat_id)
+                if not is_live_agreement(doc.to_dict(), now)]
+    
+    for start in range(0, len(refs), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for ref in refs[start:start + FIRESTORE_BATCH_LIMIT]:
+            batch.update(ref, {"status": "expired", "expired_at": firestore.SERVER_TIMESTAMP})
+        await batch.commit()
+    return len(refs)
+
+@track_db
 async def check_afk_users(chat_id: int):
     """
     Checks for users who haven't written for 2+ days.
     Returns list of offenders.
     """
     chat_id = str(chat_id)
-    stats_ref = db.collection("chats").document(chat_id).collection("user_stats")
     
     now = datetime.now(timezone.utc)
     offenders = []
     
     current_season = get_current_season_id()
     
-    async for doc in stats_ref.stream():
-        data = doc.to_dict()
+    roster = await get_roster(chat_id)
+    
+    for user_id, data in roster.items():
         last_active = data.get('last_active_date')
         
         if not last_active:
@@ -232,7 +586,7 @@ async def check_afk_users(chat_id: int):
             username = data.get('username', 'Ghost')
             
             offenders.append({
-                "user_id": doc.id,
+                "user_id": user_id,
                 "username": username,
                 "category": "Snitching", # AFK is a form of betrayal
                 "reason": f"AFK в чате: {days_inactive} дн. молчания",
@@ -242,6 +596,18 @@ async def check_afk_users(chat_id: int):
             
     return offenders
 
+@track_db
+async def get_documents(refs, transaction=None):
+    """
+    Reads several documents in a single round-trip.
+    Returns {document path: snapshot}; Firestore does not keep the request order.
+    """
+    if not refs:
+        return {}
+    # Client-level get_all: AsyncTransaction.get_all awaits an async generator
+    return {doc.reference.path: doc async for doc in db.get_all(refs, transaction=transaction)}
+
+@track_db
 async def apply_weekly_amnesty(chat_id: int):
     """
     Applies weekly amnesty: Points accumulated in the LAST 7 DAYS are halved.
@@ -259,11 +625,11 @@ async def apply_weekly_amnesty(chat_id: int):
         d = today - timedelta(days=i)
         dates_to_check.append(d.strftime("%Y-%m-%d"))
         
-    # 2. Aggregate weekly points per user
+    # 2. Aggregate weekly points per user (all 7 days in one read)
     weekly_points = {} # user_id -> points
     
-    for date_key in dates_to_check:
-        doc = await daily_ref.document(date_key).get()
+    daily_docs = await get_documents([daily_ref.document(date_key) for date_key in dates_to_check])
+    for doc in daily_docs.values():
         if doc.exists:
             data = doc.to_dict()
             offenders = data.get('offenders', [])
@@ -278,38 +644,53 @@ async def apply_weekly_amnesty(chat_id: int):
         
     # 3. Apply reduction
     current_season = get_current_season_id()
-    
-    for user_id, w_points in weekly_points.items():
-        if w_points <= 0:
-            continue
-            
-        reduction = w_points // 2
-        if reduction <= 0:
-            continue
-            
-        # Fetch user stats
-        user_doc_ref = stats_ref.document(user_id)
-        user_doc = await user_doc_ref.get()
-        
-        if user_doc.exists:
+    reductions = {uid: w_points // 2 for uid, w_points in weekly_points.items() if w_points // 2 > 0}
+    if not reductions:
+        return True
+
+    @firestore.async_transactional
+    async def _apply_in_transaction(transaction):
+        user_refs = {uid: stats_ref.document(uid) for uid in reductions}
+        user_docs = await get_documents(list(user_refs.values()), transaction=transaction)
+
+        updates = {}
+        for user_id, reduction in reductions.items():
+            user_doc = user_docs[user_refs[user_id].path]
+            if not user_doc.exists:
+                continue
             data = user_doc.to_dict()
-            if data.get('season_id') == current_season:
-                current_total = data.get('total_points', 0)
-                new_total = max(0, current_total - reduction)
-                new_rank = calculate_rank(new_total)
-                
-                await user_doc_ref.update({
-                    "total_points": new_total,
-                    "current_rank": new_rank
-                })
-                logging.info(f"Amnesty applied for user {user_id}: -{reduction} points (Weekly: {w_points}).")
+            if data.get('season_id') != current_season:
+                continue
+            new_total = max(0, data.get('total_points', 0) - reduction)
+            updates[user_id] = {
+                "total_points": new_total,
+                "current_rank": calculate_rank(new_total)
+            }
+            transaction.update(user_refs[user_id], updates[user_id])
+
+        if updates:
+            roster_users = {}
+            for uid, update_data in updates.items():
+                roster_users.update(roster_update(uid, update_data)["users"])
+            transaction.set(roster_ref(chat_id), {"users": roster_users}, merge=True)
+        return updates
+
+    updates = await _apply_in_transaction(db.transaction())
+
+    for user_id, update_data in updates.items():
+        user_stats_cache.merge((chat_id, user_id), update_data)
+        logging.info(f"Amnesty applied for user {user_id}: -{reductions[user_id]} points (Weekly: {weekly_points[user_id]}).")
                 
     return True
 
+@track_db
 async def get_logs_for_time_range(chat_id: int, start_dt: datetime, end_dt: datetime):
     """
     Fetches messages within a specific time range [start_dt, end_dt).
     """
+    await write_buffer.flush()
+    if shards_enabled():
+        return await _get_shard_logs_for_time_range(chat_id, start_dt, end_dt)
     chat_ref = db.collection("chats").document(str(chat_id))
     messages_ref = chat_ref.collection("messages")
     
@@ -327,10 +708,53 @@ async def get_logs_for_time_range(chat_id: int, start_dt: datetime, end_dt: date
     logs.sort(key=lambda x: x['timestamp'])
     return logs
 
+async def _get_shard_logs_for_time_range(chat_id, start_dt: datetime, end_dt: datetime):
+    # Every shard overlapping the range, fetched in one round-trip
+    start_dt, end_dt = _as_utc(start_dt), _as_utc(end_dt)
+    step = timedelta(hours=config.MESSAGE_SHARD_HOURS)
+    refs = []
+    start = shard_start(start_dt)
+    while start < end_dt:
+        refs.append(shard_ref(chat_id, start))
+        start += step
+    
+    logs = []
+    for doc in (await get_documents(refs)).values():
+        if doc.exists:
+            logs.extend(m for m in _shard_messages(doc.to_dict()) if start_dt <= m['timestamp'] < end_dt)
+    logs.sort(key=lambda x: x['timestamp'])
+    return logs
+
+async def _stream_shard_messages(query, keep, limit: int):
+    """Collects messages accepted by `keep` from shards in query order until `limit` are found."""
+    logs = []
+    async for doc in query.stream():
+        logs.extend(m for m in _shard_messages(doc.to_dict()) if keep(m))
+        if len(logs) >= limit:
+            break
+    return logs
+
+@track_db
 async def get_recent_messages(chat_id: int, before_timestamp: datetime, limit: int = 5):
     """
     Fetches the last N messages before a specific timestamp for context.
+    Served from the in-memory ring buffer when it holds the answer.
     """
+    cached = recent_messages.before(chat_id, before_timestamp, limit)
+    if cached is not None:
+        return cached
+    
+    await write_buffer.flush()
+    if shards_enabled():
+        before_utc = _as_utc(before_timestamp)
+        query = shards_collection(chat_id).where(filter=firestore.FieldFilter("start", "<=", before_utc))\
+                                          .order_by("start", direction=firestore.Query.DESCENDING)
+        logs = await _stream_shard_messages(query, lambda m: m['timestamp'] < before_utc, limit)
+        logs.sort(key=lambda x: x['timestamp'])
+        logs = logs[-limit:]
+        recent_messages.seed_before(chat_id, before_timestamp, logs, limit)
+        return logs
+    
     chat_ref = db.collection("chats").document(str(chat_id))
     messages_ref = chat_ref.collection("messages")
     
@@ -347,12 +771,28 @@ async def get_recent_messages(chat_id: int, before_timestamp: datetime, limit: i
         
     # Reverse to return in chronological order
     logs.reverse()
+    recent_messages.seed_before(chat_id, before_timestamp, logs, limit)
     return logs
 
+@track_db
 async def get_subsequent_messages(chat_id: int, after_timestamp: datetime, limit: int = 5):
     """
     Fetches the next N messages after a specific timestamp.
+    Served from the in-memory ring buffer when it holds the answer.
     """
+    cached = recent_messages.after(chat_id, after_timestamp, limit)
+    if cached is not None:
+        return cached
+    
+    await write_buffer.flush()
+    if shards_enabled():
+        after_utc = _as_utc(after_timestamp)
+        query = shards_collection(chat_id).where(filter=firestore.FieldFilter("start", ">=", shard_start(after_utc)))\
+                                          .order_by("start", direction=firestore.Query.ASCENDING)
+        logs = await _stream_shard_messages(query, lambda m: m['timestamp'] > after_utc, limit)
+        logs.sort(key=lambda x: x['timestamp'])
+        return logs[:limit]
+    
     chat_ref = db.collection("chats").document(str(chat_id))
     messages_ref = chat_ref.collection("messages")
     
@@ -369,6 +809,66 @@ async def get_subsequent_messages(chat_id: int, after_timestamp: datetime, limit
         
     return logs
 
+@track_db
+async def get_all_messages(chat_id):
+    """
+    Fetches the whole message history of a chat ordered by timestamp (lore/feedback scripts).
+    """
+    await write_buffer.flush()
+    logs = []
+    if shards_enabled():
+        async for doc in shards_collection(chat_id).order_by("start").stream():
+            shard = _shard_messages(doc.to_dict())
+            shard.sort(key=lambda x: x['timestamp'])
+            logs.extend(shard)
+        return logs
+    
+    messages_ref = db.collection("chats").document(str(chat_id)).collection("messages")
+    async for doc in messages_ref.order_by("timestamp").stream():
+        data = doc.to_dict()
+        data['message_id'] = doc.id
+        logs.append(data)
+    return logs
+
+@track_db
+async def get_oldest_message_timestamp(chat_id):
+    """Timestamp of the oldest message still in the hot collection, or None."""
+    if shards_enabled():
+        query = shards_collection(chat_id).order_by("start").limit(1)
+        async for doc in query.stream():
+            messages = _shard_messages(doc.to_dict())
+            return min((m['timestamp'] for m in messages), default=doc.get("start"))
+        return None
+    
+    query = db.collection("chats").document(str(chat_id)).collection("messages").order_by("timestamp").limit(1)
+    async for doc in query.stream():
+        return doc.get("timestamp")
+    return None
+
+@track_db
+async def delete_messages(chat_id, logs: list, start_dt: datetime, end_dt: datetime):
+    """
+    Deletes archived messages from the hot collection in batches.
+    In the shard layout the whole shards of [start_dt, end_dt) go, which must be shard-aligned.
+    """
+    if shards_enabled():
+        refs = []
+        start = shard_start(start_dt)
+        while start < _as_utc(end_dt):
+            refs.append(shard_ref(chat_id, start))
+            start += timedelta(hours=config.MESSAGE_SHARD_HOURS)
+    else:
+        messages_ref = db.collection("chats").document(str(chat_id)).collection("messages")
+        refs = [messages_ref.document(log['message_id']) for log in logs]
+    
+    for start in range(0, len(refs), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for ref in refs[start:start + FIRESTORE_BATCH_LIMIT]:
+            batch.delete(ref)
+        await batch.commit()
+    return len(refs)
+
+@track_db
 async def save_daily_results(chat_id: int, analysis_result: dict):
     """
     Saves the result of the daily analysis (list of offenders) atomically.
@@ -383,8 +883,15 @@ async def save_daily_results(chat_id: int, analysis_result: dict):
 
     @firestore.async_transactional
     async def _save_in_transaction(transaction, daily_ref, analysis_result, str_chat_id, date_key, current_season):
-        # 1. Read existing daily record
-        existing_doc = await daily_ref.get(transaction=transaction)
+        # 1. Read the existing daily record together with the new offenders' stats
+        new_offenders = analysis_result.get('offenders', [])
+        new_offenders_map = {str(off.get('user_id')): off for off in new_offenders if off.get('user_id')}
+        user_stats_col = db.collection("chats").document(str_chat_id).collection("user_stats")
+        user_stats_refs = {uid: user_stats_col.document(uid) for uid in new_offenders_map}
+
+        # In Firestore Transactions, we must perform all reads before any writes.
+        docs = await get_documents([daily_ref, *user_stats_refs.values()], transaction=transaction)
+        existing_doc = docs[daily_ref.path]
         old_offenders_map = {}
         if existing_doc.exists:
             old_data = existing_doc.to_dict()
@@ -394,19 +901,17 @@ async def save_daily_results(chat_id: int, analysis_result: dict):
                     old_offenders_map[uid] = off
 
         # 2. Identify all users to update
-        new_offenders = analysis_result.get('offenders', [])
-        new_offenders_map = {str(off.get('user_id')): off for off in new_offenders if off.get('user_id')}
-        
         all_user_ids = set(old_offenders_map.keys()) | set(new_offenders_map.keys())
         
-        # 3. Read all user stats
-        user_stats_refs = {uid: db.collection("chats").document(str_chat_id).collection("user_stats").document(uid) for uid in all_user_ids}
-        # In Firestore Transactions, we must perform all reads before any writes.
-        user_stats_docs = {}
-        for uid, ref in user_stats_refs.items():
-            user_stats_docs[uid] = await ref.get(transaction=transaction)
+        # 3. Read stats of previous offenders that are no longer offenders (re-runs only)
+        missing_refs = {uid: user_stats_col.document(uid) for uid in all_user_ids if uid not in user_stats_refs}
+        if missing_refs:
+            docs.update(await get_documents(list(missing_refs.values()), transaction=transaction))
+            user_stats_refs.update(missing_refs)
+        user_stats_docs = {uid: docs[ref.path] for uid, ref in user_stats_refs.items()}
 
         # 4. Calculate updates
+        updates = {}
         for uid in all_user_ids:
             stats_doc = user_stats_docs[uid]
             ref = user_stats_refs[uid]
@@ -438,21 +943,34 @@ async def save_daily_results(chat_id: int, analysis_result: dict):
             new_rank = calculate_rank(current_points)
             
             # Prepare update
-            transaction.set(ref, {
+            updates[uid] = {
                 "username": username,
                 "season_id": current_season,
                 "snitch_count": current_wins,
                 "total_points": current_points,
                 "current_rank": new_rank,
                 "last_win_date": date_key
-            }, merge=True)
+            }
+            transaction.set(ref, updates[uid], merge=True)
+
+        # Mirror all changes into the roster with a single write
+        if updates:
+            roster_users = {}
+            for uid, update_data in updates.items():
+                roster_users.update(roster_update(uid, update_data)["users"])
+            transaction.set(roster_ref(str_chat_id), {"users": roster_users}, merge=True)
 
         # 5. Save the daily result record
         transaction.set(daily_ref, analysis_result)
+        return updates
         
     # Execute the transaction
     transaction = db.transaction()
-    await _save_in_transaction(transaction, daily_ref, analysis_result, str_chat_id, date_key, current_season)
+    updates = await _save_in_transaction(transaction, daily_ref, analysis_result, str_chat_id, date_key, current_season)
+    
+    # Write-through only after a successful commit
+    for uid, update_data in updates.items():
+        user_stats_cache.merge((str_chat_id, uid), update_data)
 
 def calculate_rank(points):
     """
@@ -470,6 +988,7 @@ def calculate_rank(points):
     else:
         return "Порядочный 😐"
 
+@track_db
 async def get_user_stats(chat_id: int, user_id: int):
     """
     Fetches stats for a specific user.
@@ -477,39 +996,58 @@ async def get_user_stats(chat_id: int, user_id: int):
     chat_id = str(chat_id)
     user_id = str(user_id)
     doc_ref = db.collection("chats").document(chat_id).collection("user_stats").document(user_id)
-    doc = await doc_ref.get()
-    if doc.exists:
-        return doc.to_dict()
-    return None
+    
+    data = user_stats_cache.get((chat_id, user_id))
+    if data is MISSING:
+        doc = await doc_ref.get()
+        data = doc.to_dict() if doc.exists else None
+        user_stats_cache.set((chat_id, user_id), data)
+    return write_buffer.overlay(doc_ref, data)
 
+@track_db
 async def get_message(chat_id: int, message_id: int):
     """
     Fetches a specific message by ID.
     """
     chat_id = str(chat_id)
     message_id = str(message_id)
+    cached = recent_messages.get(chat_id, message_id)
+    if cached is not None:
+        return cached
+    
+    if shards_enabled():
+        doc = await _find_message_shard(chat_id, message_id)
+        if doc is None:
+            return None
+        return (doc.to_dict().get("messages") or {}).get(message_id)
+    
     doc_ref = db.collection("chats").document(chat_id).collection("messages").document(message_id)
     doc = await doc_ref.get()
-    if doc.exists:
-        return doc.to_dict()
-    return None
+    return write_buffer.overlay(doc_ref, doc.to_dict() if doc.exists else None)
 
+@track_db
 async def mark_message_reported(chat_id: int, msg_id: int, reporter_id: int, reason: str, points_awarded: int = 0):
     """
     Flags a message as reported by a user.
     """
     chat_id = str(chat_id)
     msg_id = str(msg_id)
-    doc_ref = db.collection("chats").document(chat_id).collection("messages").document(msg_id)
     
-    await doc_ref.set({
+    await _patch_message(chat_id, msg_id, {
         "is_reported": True,
         "reported_by": reporter_id,
         "report_reason": reason,
         "report_timestamp": firestore.SERVER_TIMESTAMP,
         "points_awarded": points_awarded
-    }, merge=True)
+    })
+    recent_messages.update(chat_id, msg_id, {
+        "is_reported": True,
+        "reported_by": reporter_id,
+        "report_reason": reason,
+        "points_awarded": points_awarded
+    })
 
+@track_db
 async def log_reaction(chat_id: int, user_id: int, username: str, message_id: int, emoji: str, timestamp: datetime):
     """
     Logs a reaction event. Fetches the original message to provide context.
@@ -518,14 +1056,13 @@ async def log_reaction(chat_id: int, user_id: int, username: str, message_id: in
     message_id = str(message_id)
     
     # Fetch original message
-    msg_ref = db.collection("chats").document(chat_id).collection("messages").document(message_id)
-    msg_doc = await msg_ref.get()
+    msg_data = await get_message(chat_id, message_id)
     
     original_text = "Unknown Message"
     target_user = "Unknown"
     
-    if msg_doc.exists:
-        data = msg_doc.to_dict()
+    if msg_data:
+        data = msg_data
         original_text = data.get("text", "")
         target_user = data.get("username", "Unknown")
         
@@ -537,8 +1074,6 @@ async def log_reaction(chat_id: int, user_id: int, username: str, message_id: in
     
     log_text = f"[REACTION] {username} reacted {emoji} to {target_user}'s message: \"{original_text}\""
     
-    doc_ref = db.collection("chats").document(chat_id).collection("messages").document(reaction_id)
-    
     data = {
         "user_id": int(user_id),
         "username": username,
@@ -550,72 +1085,77 @@ async def log_reaction(chat_id: int, user_id: int, username: str, message_id: in
         "target_msg_id": message_id
     }
     
-    logging.debug(f"Writing reaction {reaction_id} to Firestore...")
-    await doc_ref.set(data)
-    logging.debug(f"Reaction {reaction_id} written successfully.")
+    logging.debug(f"Queueing reaction {reaction_id} for Firestore...")
+    doc_ref, payload, merge = message_write(chat_id, reaction_id, data)
+    await write_buffer.set(doc_ref, payload, merge=merge)
+    recent_messages.add(chat_id, {**data, "message_id": reaction_id})
 
-async def record_gamble_result(chat_id: int, user_id: int, new_points: int, date_key: str):
+async def _apply_points(chat_id: str, user_id: str, points: int, floor: int = None, extra: dict = None) -> int:
     """
-    Updates user stats after a gamble.
+    Adds `points` to the user's total_points in a transaction and mirrors it into the roster.
+    Reads user_stats uncached: other instances and scheduled jobs change points too, so a
+    cached total can be minutes old. Returns the new total.
     """
-    chat_id = str(chat_id)
-    user_id = str(user_id)
     user_stats_ref = db.collection("chats").document(chat_id).collection("user_stats").document(user_id)
-    
-    new_rank = calculate_rank(new_points)
-    
-    await user_stats_ref.set({
-        "total_points": new_points,
-        "current_rank": new_rank,
-        "last_gamble_date": date_key
-    }, merge=True)
 
+    @firestore.async_transactional
+    async def _apply_in_transaction(transaction):
+        doc = (await get_documents([user_stats_ref], transaction=transaction))[user_stats_ref.path]
+        current_points = (doc.to_dict() or {}).get("total_points", 0) if doc.exists else 0
+        new_points = current_points + points
+        if floor is not None:
+            new_points = max(floor, new_points)
+        update_data = {
+            **(extra or {}),
+            "total_points": new_points,
+            "current_rank": calculate_rank(new_points)
+        }
+        transaction.set(user_stats_ref, update_data, merge=True)
+        transaction.set(roster_ref(chat_id), roster_update(user_id, update_data), merge=True)
+        return new_points
+
+    new_points = await _apply_in_transaction(db.transaction())
+    # Re-read on next use instead of merging, the cached rest of the document may be stale too
+    user_stats_cache.invalidate((chat_id, user_id))
+    return new_points
+
+@track_db
+async def record_gamble_result(chat_id: int, user_id: int, points: int, date_key: str) -> int:
+    """
+    Applies a gamble result as a points delta (never below zero). Returns the new total.
+    """
+    return await _apply_points(str(chat_id), str(user_id), points, floor=0, extra={"last_gamble_date": date_key})
+
+@track_db
 async def increment_false_report_count(chat_id: int, user_id: int):
     """
     Increments the false report counter and returns the new value.
+    Reads uncached in a transaction, like _apply_points, so concurrent reports never lose a count.
     """
     chat_id = str(chat_id)
     user_id = str(user_id)
     user_stats_ref = db.collection("chats").document(chat_id).collection("user_stats").document(user_id)
     
-    doc = await user_stats_ref.get()
+    @firestore.async_transactional
+    async def _increment_in_transaction(transaction):
+        doc = (await get_documents([user_stats_ref], transaction=transaction))[user_stats_ref.path]
+        new_count = ((doc.to_dict() or {}).get("false_report_count", 0) if doc.exists else 0) + 1
+        transaction.set(user_stats_ref, {"false_report_count": new_count}, merge=True)
+        return new_count
     
-    current_count = 0
-    if doc.exists:
-        data = doc.to_dict()
-        current_count = data.get("false_report_count", 0)
-        
-    new_count = current_count + 1
-    
-    await user_stats_ref.set({
-        "false_report_count": new_count
-    }, merge=True)
+    new_count = await _increment_in_transaction(db.transaction())
+    user_stats_cache.invalidate((chat_id, user_id))
     
     return new_count
 
-async def add_points(chat_id: int, user_id: int, points: int):
+@track_db
+async def add_points(chat_id: int, user_id: int, points: int) -> int:
     """
-    Applies immediate points (penalty or reward).
+    Applies immediate points (penalty or reward). Returns the new total.
     """
-    chat_id = str(chat_id)
-    user_id = str(user_id)
-    user_stats_ref = db.collection("chats").document(chat_id).collection("user_stats").document(user_id)
-    
-    doc = await user_stats_ref.get()
-    current_points = 0
-    
-    if doc.exists:
-        data = doc.to_dict()
-        current_points = data.get("total_points", 0)
-        
-    new_points = current_points + points
-    new_rank = calculate_rank(new_points)
-    
-    await user_stats_ref.set({
-        "total_points": new_points,
-        "current_rank": new_rank
-    }, merge=True)
+    return await _apply_points(str(chat_id), str(user_id), points)
 
+@track_db
 async def update_edited_message(message):
     """
     Updates an existing message in Firestore when it is edited.
@@ -623,8 +1163,6 @@ async def update_edited_message(message):
     chat_id = str(message.chat.id)
     msg_id = str(message.message_id)
     
-    doc_ref = db.collection("chats").document(chat_id).collection("messages").document(msg_id)
-    
     text_content = message.text or message.caption
     if not text_content and message.sticker:
         text_content = f"[STICKER] {message.sticker.emoji or 'Unknown'}"
@@ -638,22 +1176,31 @@ async def update_edited_message(message):
         "last_edit_date": message.edit_date
     }
     
-    logging.debug(f"Updating edited message {msg_id} in Firestore (Chat: {chat_id})...")
-    await doc_ref.set(update_data, merge=True)
-    logging.debug(f"Message {msg_id} updated successfully.")
+    logging.debug(f"Queueing edit of message {msg_id} for Firestore (Chat: {chat_id})...")
+    # message.date is the original send time, so it points at the right shard
+    await _patch_message(chat_id, msg_id, update_data, timestamp=message.date)
+    recent_messages.update(chat_id, msg_id, update_data)
 
+@track_db
+async def update_message_text(chat_id, message_id, text: str):
+    """
+    Replaces the stored text of a logged message (e.g. once a voice note is transcribed).
+    """
+    chat_id = str(chat_id)
+    msg_id = str(message_id)
+    await _patch_message(chat_id, msg_id, {"text": text})
+    recent_messages.update(chat_id, msg_id, {"text": text})
+
+@track_db
 async def get_chat_users(chat_id: int):
     """
     Fetches all users who have stats in the chat.
     Used for the /all command.
     """
-    chat_id = str(chat_id)
-    stats_ref = db.collection("chats").document(chat_id).collection("user_stats")
+    roster = await get_roster(chat_id)
     
     users = []
-    async for doc in stats_ref.stream():
-        data = doc.to_dict()
-        user_id = doc.id
+    for user_id, data in roster.items():
         username = data.get('username')
         full_name = data.get('full_name', username)
         
@@ -0,0 +1,40 @@
+import asyncio
+import logging
+import time
+
+from .metrics import observe_job
+
+
+async def run_for_chats(job_name: str, chat_ids, job, concurrency: int, timeout: float):
+    """
+    Runs `job(chat_id)` for every chat with at most `concurrency` chats in flight.
+    Each chat gets its own timeout and a failure in one chat never affects the others.
+    Returns one report per chat: { "chat_id", "status", "duration" }.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _run(chat_id):
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                result = await asyncio.wait_for(job(chat_id), timeout=timeout)
+                status = "ok"
+                # Jobs may report their own outcome (e.g. "locked", "no logs")
+                if isinstance(result, dict) and result.get("status"):
+                    status = result["status"]
+            except asyncio.TimeoutError:
+                status = "timeout"
+                logging.error(f"[{job_name}] Chat {chat_id} timed out after {timeout}s")
+            except Exception as e:
+                status = "error"
+                logging.error(f"[{job_name}] Chat {chat_id} failed: {e}")
+            duration = time.monotonic() - started
+            observe_job(job_name, status, duration)
+            return {"chat_id": chat_id, "status": status, "duration": duration}
+
+    started = time.monotonic()
+    reports = await asyncio.gather(*(_run(chat_id) for chat_id in chat_ids))
+
+    summary = ", ".join(f"{r['chat_id']}={r['status']} ({r['duration']:.1f}s)" for r in reports)
+    logging.info(f"[{job_name}] Finished {len(reports)} chats in {time.monotonic() - started:.1f}s: {summary or 'no chats'}")
+    return reports
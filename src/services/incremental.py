@@ -0,0 +1,123 @@
+import re
+from datetime import datetime, timezone
+
+from ..utils.game_config import config
+
+
+def _as_utc(ts: datetime) -> datetime:
+    if ts.tzinfo is None:
+        return ts.replace(tzinfo=timezone.utc)
+    return ts
+
+
+def find_uncovered_ranges(start_dt: datetime, end_dt: datetime, slices):
+    """
+    Returns the parts of [start_dt, end_dt) not covered by any analysis slice,
+    as a list of (start, end) tuples in chronological order.
+    """
+    covered = sorted((_as_utc(s['start']), _as_utc(s['end'])) for s in slices)
+    gaps = []
+    cursor = start_dt
+    for slice_start, slice_end in covered:
+        if slice_start > cursor:
+            gaps.append((cursor, min(slice_start, end_dt)))
+        cursor = max(cursor, slice_end)
+        if cursor >= end_dt:
+            break
+    if cursor < end_dt:
+        gaps.append((cursor, end_dt))
+    return [(gap_start, gap_end) for gap_start, gap_end in gaps if gap_start < gap_end]
+
+
+def drop_reported_slices(slices, reported_timestamps):
+    """
+    Slices holding a message whose /report awarded points. The slice may have judged
+    the message before the report (without the "POINTS ALREADY AWARDED" tag), so it
+    is left out and its range is analyzed again.
+    """
+    reported = [_as_utc(ts) for ts in reported_timestamps]
+    return [
+        s for s in slices
+        if not any(_as_utc(s['start']) <= ts < _as_utc(s['end']) for ts in reported)
+    ]
+
+
+def _category_key(category) -> str:
+    # Passes may spell the same category differently ("Нытьё" / "нытье ")
+    return str(category or "").strip().lower().replace("ё", "е")
+
+
+def _agreement_key(agreement) -> tuple:
+    # Overlapping chunks restate the same agreement with different case and punctuation
+    users = sorted(str(u).strip().lower().lstrip("@") for u in agreement.get('users') or [])
+    words = re.findall(r"\w+", str(agreement.get('text') or "").lower().replace("ё", "е"))
+    return tuple(users), " ".join(words)
+
+
+def merge_partial_verdicts(partials):
+    """
+    Reduces partial verdicts (slice passes plus the nightly tail) into one daily verdict.
+
+    Offenders follow the daily deduplication rule: a series of the same category
+    by one user is a single offence, even when it spans several passes, so each
+    (user, category) pair is counted once, keeping the heaviest instance. Points of
+    different categories are summed per user, as in a single daily pass. Every
+    partial judges only its own part of the day, so the result is capped to what one
+    daily verdict gives: DAILY_MAX_OFFENDERS offenders, DAILY_MAX_POINTS_PER_USER each.
+    Agreement resolutions and updates are deduplicated by agreement ID (later
+    partials win), new agreements by their users and normalized text.
+    """
+    offences = {}  # (user_id, category) -> offender
+    resolved = {}
+    updated = {}
+    new_agreements = {}
+    order = []
+
+    for partial in partials:
+        if not partial:
+            continue
+        for off in partial.get('offenders', []):
+            uid = str(off.get('user_id'))
+            if not off.get('user_id'):
+                continue
+            key = (uid, _category_key(off.get('category')))
+            current = offences.get(key)
+            if current is None:
+                order.append(key)
+                offences[key] = off
+            elif off.get('points', 0) > current.get('points', 0):
+                offences[key] = off
+        for res in partial.get('resolved_agreements', []):
+            if res.get('id'):
+                resolved[res['id']] = res
+        for upd in partial.get('updated_agreements', []):
+            if upd.get('id'):
+                updated[upd['id']] = upd
+        for ag in partial.get('new_agreements', []):
+            new_agreements.setdefault(_agreement_key(ag), ag)
+
+    merged = {}  # user_id -> offender
+    for key in order:
+        off = offences[key]
+        uid = key[0]
+        if uid not in merged:
+            merged[uid] = dict(off)
+            continue
+        user_entry = merged[uid]
+        user_entry['points'] = user_entry.get('points', 0) + off.get('points', 0)
+        user_entry['category'] = f"{user_entry.get('category')}, {off.get('category')}"
+        user_entry['reason'] = f"{user_entry.get('reason', '')} {off.get('reason', '')}".strip()
+        if not user_entry.get('quote'):
+            user_entry['quote'] = off.get('quote')
+
+    offenders = sorted(merged.values(), key=lambda off: off.get('points', 0), reverse=True)
+    offenders = offenders[:config.DAILY_MAX_OFFENDERS]
+    for off in offenders:
+        off['points'] = min(off.get('points', 0), config.DAILY_MAX_POINTS_PER_USER)
+
+    return {
+        "offenders": offenders,
+        "new_agreements": list(new_agreements.values()),
+        "resolved_agreements": list(resolved.values()),
+        "updated_agreements": list(updated.values())
+    }
@@ -0,0 +1,154 @@
+import asyncio
+import functools
+import logging
+import uuid
+from datetime import datetime, timezone, timedelta
+
+from google.cloud import firestore
+
+from .db import db
+from ..utils.game_config import config
+
+
+class LeaseNotAcquired(Exception):
+    pass
+
+
+class LeaseLost(Exception):
+    """The lease was taken over while the work under it was still running."""
+
+
+class Lease:
+    """
+    Time-limited lock stored in a Firestore document, shared by all instances.
+
+    Acquire, renew and release are transactions that check the owner token, so
+    two holders can never overlap and only the owner can extend or drop the lease.
+    A holder that dies without releasing blocks others for at most `ttl` seconds.
+    While held through `async with`, the lease is renewed in the background; work
+    started with `run()` is cancelled as soon as a renewal finds the lease taken over.
+    Expiry uses the instance clocks, which is fine as long as skew stays well below `ttl`.
+    """
+
+    def __init__(self, ref, ttl: float):
+        self.ref = ref
+        self.ttl = ttl
+        self.owner = uuid.uuid4().hex
+        self.lost = False
+        self._renewal = None
+        self._work = None
+
+    def _lease_data(self, now: datetime) -> dict:
+        return {"owner": self.owner, "expires_at": now + timedelta(seconds=self.ttl), "renewed_at": now}
+
+    async def acquire(self) -> bool:
+        @firestore.async_transactional
+        async def _acquire(transaction):
+            doc = await self.ref.get(transaction=transaction)
+            now = datetime.now(timezone.utc)
+            if doc.exists:
+                data = doc.to_dict()
+                expires_at = data.get("expires_at")
+                if expires_at and expires_at.tzinfo is None:
+                    expires_at = expires_at.replace(tzinfo=timezone.utc)
+                if data.get("owner") != self.owner and expires_at and expires_at > now:
+                    return False
+            transaction.set(self.ref, {**self._lease_data(now), "acquired_at": now})
+            return True
+
+        return await _acquire(db.transaction())
+
+    async def renew(self) -> bool:
+        """Extends the lease. Returns False if it expired and was taken over."""
+        @firestore.async_transactional
+        async def _renew(transaction):
+            doc = await self.ref.get(transaction=transaction)
+            if not doc.exists or doc.to_dict().get("owner") != self.owner:
+                return False
+            transaction.update(self.ref, self._lease_data(datetime.now(timezone.utc)))
+            return True
+
+        return await _renew(db.transaction())
+
+    async def release(self):
+        @firestore.async_transactional
+        async def _release(transaction):
+            doc = await self.ref.get(transaction=transaction)
+            if doc.exists and doc.to_dict().get("owner") == self.owner:
+                transaction.delete(self.ref)
+
+        await _release(db.transaction())
+
+    async def _keep_alive(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                if not await self.renew():
+                    self.lost = True
+                    logging.error(f"Lease {self.ref.path} was lost before the work finished, cancelling it.")
+                    if self._work:
+                        self._work.cancel()
+                    return
+            except Exception as e:
+                # Transient errors are retried on the next tick, the lease is still valid until expiry
+                logging.error(f"Failed to renew lease {self.ref.path}: {e}")
+
+    async def run(self, coro):
+        """
+        Awaits `coro` as a task the renewal loop cancels if the lease is lost, so a
+        job never keeps writing after another instance took over. Raises LeaseLost then.
+        """
+        self._work = asyncio.ensure_future(coro)
+        try:
+            return await self._work
+        except asyncio.CancelledError:
+            if self.lost and not asyncio.current_task().cancelling():
+                raise LeaseLost(self.ref.path)
+            raise
+        finally:
+            self._work = None
+
+    async def __aenter__(self):
+        if not await self.acquire():
+            raise LeaseNotAcquired(self.ref.path)
+        self._renewal = asyncio.create_task(self._keep_alive())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._renewal.cancel()
+        try:
+            await self._renewal
+        except asyncio.CancelledError:
+            pass
+        try:
+            await self.release()
+        except Exception as e:
+            logging.error(f"Failed to release lease {self.ref.path}: {e}")
+        return False
+
+
+def chat_lease(chat_id, name: str) -> Lease:
+    ref = db.collection("chats").document(str(chat_id)).collection("locks").document(name)
+    return Lease(ref, ttl=config.LEASE_TTL_SECONDS)
+
+
+def with_chat_lease(name: str):
+    """
+    Runs a per-chat job only while holding the chat's `name` lease.
+    If another instance holds it, the job is skipped with {"status": "locked"};
+    if the lease is lost midway, the job is cancelled with {"status": "lease_lost"}.
+    """
+    def decorator(job):
+        @functools.wraps(job)
+        async def wrapper(chat_id, *args, **kwargs):
+            try:
+                async with chat_lease(chat_id, name) as lease:
+                    return await lease.run(job(chat_id, *args, **kwargs))
+            except LeaseNotAcquired:
+                logging.warning(f"{name} for chat {chat_id} is already in progress elsewhere. Skipping.")
+                return {"status": "locked"}
+            except LeaseLost:
+                logging.error(f"{name} for chat {chat_id} was cancelled: another instance took over its lease.")
+                return {"status": "lease_lost"}
+        return wrapper
+    return decorator
@@ -0,0 +1,454 @@
+"""
+Local stand-in for the Firestore AsyncClient.
+
+Implements the subset of the document API that `db.py`, the handlers and the
+scheduler use (collections, documents, queries, batches, transactions), so the
+whole bot can run offline against process memory or a SQLite file for load
+testing and benchmarks.
+"""
+import asyncio
+import copy
+import itertools
+import pickle
+import sqlite3
+import uuid
+from datetime import datetime, timezone
+
+from google.api_core import exceptions as api_exceptions
+from google.cloud.firestore_v1 import transforms
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _get_field(data: dict, field_path: str):
+    """Resolves a dotted field path. Returns (found, value)."""
+    value = data
+    for part in field_path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return False, None
+        value = value[part]
+    return True, value
+
+
+def _apply_value(current, value):
+    """Resolves Firestore sentinels and transforms against the current value."""
+    if value is transforms.SERVER_TIMESTAMP:
+        return _now()
+    if isinstance(value, transforms.Increment):
+        base = current if isinstance(current, (int, float)) else 0
+        return base + value.value
+    if isinstance(value, transforms.ArrayUnion):
+        result = list(current) if isinstance(current, list) else []
+        for item in value.values:
+            if item not in result:
+                result.append(item)
+        return result
+    if isinstance(value, transforms.ArrayRemove):
+        result = list(current) if isinstance(current, list) else []
+        return [item for item in result if item not in value.values]
+    if isinstance(value, dict):
+        # A new nested map: sentinels inside it resolve too, as Firestore does
+        result = {}
+        _merge(result, value)
+        return result
+    return copy.deepcopy(value)
+
+
+def _set_field(data: dict, field_path: str, value):
+    parts = field_path.split(".")
+    target = data
+    for part in parts[:-1]:
+        if not isinstance(target.get(part), dict):
+            target[part] = {}
+        target = target[part]
+    if value is transforms.DELETE_FIELD:
+        target.pop(parts[-1], None)
+    else:
+        target[parts[-1]] = _apply_value(target.get(parts[-1]), value)
+
+
+def _merge(target: dict, source: dict):
+    """Deep merge, mirroring `set(..., merge=True)` semantics for nested maps."""
+    for key, value in source.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        elif value is transforms.DELETE_FIELD:
+            target.pop(key, None)
+        else:
+            target[key] = _apply_value(target.get(key), value)
+
+
+def _resolve(data: dict) -> dict:
+    """Resolves sentinels in a full document payload."""
+    result = {}
+    _merge(result, data)
+    return result
+
+
+def _sort_key(value):
+    # Keep naive and aware datetimes comparable (Firestore stores everything as UTC)
+    if isinstance(value, datetime) and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _compare(left, op: str, right) -> bool:
+    # The SDK turns "== None" / "!= None" into unary IS_NULL / IS_NOT_NULL filters
+    op = getattr(op, "name", op)
+    if op == "IS_NULL":
+        return left is None
+    if op == "IS_NOT_NULL":
+        return left is not None
+    left, right = _sort_key(left), _sort_key(right)
+    try:
+        if op == "==":
+            return left == right
+        if op == "!=":
+            return left != right
+        if op == "<":
+            return left < right
+        if op == "<=":
+            return left <= right
+        if op == ">":
+            return left > right
+        if op == ">=":
+            return left >= right
+        if op == "in":
+            return left in right
+        if op == "not-in":
+            return left not in right
+        # The SDK spells these "array_contains", the REST API "array-contains"
+        if op in ("array_contains", "array-contains"):
+            return isinstance(left, list) and right in left
+        if op in ("array_contains_any", "array-contains-any"):
+            return isinstance(left, list) and any(item in left for item in right)
+    except TypeError:
+        return False
+    raise ValueError(f"Unsupported filter operator: {op}")
+
+
+class LocalDocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self._data = data
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path: str):
+        found, value = _get_field(self._data or {}, field_path)
+        if not found:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class LocalDocumentReference:
+    def __init__(self, client, collection_path: str, doc_id: str):
+        self._client = client
+        self._collection_path = collection_path
+        self.id = doc_id
+
+    @property
+    def path(self):
+        return f"{self._collection_path}/{self.id}"
+
+    @property
+    def parent(self):
+        return LocalCollectionReference(self._client, self._collection_path)
+
+    def collection(self, name: str):
+        return LocalCollectionReference(self._client, f"{self.path}/{name}")
+
+    async def get(self, transaction=None, **kwargs):
+        return LocalDocumentSnapshot(self, self._client._read(self._collection_path, self.id))
+
+    async def set(self, data: dict, merge=False):
+        self._client._apply_writes([("set", self, data, merge)])
+
+    async def update(self, data: dict):
+        self._client._apply_writes([("update", self, data, False)])
+
+    async def create(self, data: dict):
+        self._client._apply_writes([("create", self, data, False)])
+
+    async def delete(self, **kwargs):
+        self._client._apply_writes([("delete", self, None, False)])
+
+
+class LocalQuery:
+    def __init__(self, client, collection_path: str, filters=(), orders=(), limit_to=None):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit_to
+
+    def _copy(self, **overrides):
+        params = {
+            "filters": self._filters,
+            "orders": self._orders,
+            "limit_to": self._limit,
+        }
+        params.update(overrides)
+        return LocalQuery(self._client, self._collection_path, **params)
+
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None):
+        if filter is None:
+            filter = FieldFilter(field_path, op_string, value)
+        return self._copy(filters=self._filters + (filter,))
+
+    def order_by(self, field_path: str, direction="ASCENDING"):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count: int):
+        return self._copy(limit_to=count)
+
+    def _matches(self, data: dict) -> bool:
+        for flt in self._filters:
+            found, value = _get_field(data, flt.field_path)
+            if not found or not _compare(value, flt.op_string, flt.value):
+                return False
+        return True
+
+    def _run(self):
+        docs = self._client._docs.get(self._collection_path, {})
+        rows = [(doc_id, data) for doc_id, data in docs.items() if self._matches(data)]
+
+        # Like Firestore, ordering by a field excludes documents that lack it
+        for field_path, _ in self._orders:
+            rows = [row for row in rows if _get_field(row[1], field_path)[0]]
+        for field_path, direction in reversed(self._orders):
+            rows.sort(
+                key=lambda row: _sort_key(_get_field(row[1], field_path)[1]),
+                reverse=direction == "DESCENDING",
+            )
+        if not self._orders:
+            rows.sort(key=lambda row: row[0])
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        return [
+            LocalDocumentSnapshot(LocalDocumentReference(self._client, self._collection_path, doc_id), copy.deepcopy(data))
+            for doc_id, data in rows
+        ]
+
+    async def stream(self, transaction=None):
+        for snapshot in self._run():
+            yield snapshot
+
+    async def get(self, transaction=None):
+        return self._run()
+
+
+class LocalCollectionReference(LocalQuery):
+    def __init__(self, client, path: str):
+        super().__init__(client, path)
+
+    @property
+    def id(self):
+        return self._collection_path.rsplit("/", 1)[-1]
+
+    def document(self, doc_id: str = None):
+        return LocalDocumentReference(self._client, self._collection_path, doc_id or uuid.uuid4().hex[:20])
+
+    async def add(self, data: dict, document_id: str = None):
+        doc_ref = self.document(document_id)
+        await doc_ref.create(data)
+        return _now(), doc_ref
+
+    async def list_documents(self):
+        return [self.document(doc_id) for doc_id in self._client._docs.get(self._collection_path, {})]
+
+
+class LocalWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def set(self, reference, document_data: dict, merge=False):
+        self._writes.append(("set", reference, document_data, merge))
+
+    def update(self, reference, field_updates: dict, **kwargs):
+        self._writes.append(("update", reference, field_updates, False))
+
+    def create(self, reference, document_data: dict):
+        self._writes.append(("create", reference, document_data, False))
+
+    def delete(self, reference, **kwargs):
+        self._writes.append(("delete", reference, None, False))
+
+    async def commit(self, **kwargs):
+        self._client._apply_writes(self._writes)
+        self._writes = []
+        return []
+
+
+class LocalTransaction(LocalWriteBatch):
+    """
+    Transaction compatible with `firestore.async_transactional`.
+    The client-wide lock is held between `_begin` and `_commit`/`_rollback`, so
+    transactions are serialized against each other. Plain writes and batches do
+    not take the lock and reads are not tracked for conflicts, so unlike Firestore
+    a transaction can commit over a concurrent non-transactional write.
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, client, max_attempts=5, read_only=False):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    def _clean_up(self):
+        self._writes = []
+        self._id = None
+
+    async def _begin(self, retry_id=None):
+        await self._client._tx_lock.acquire()
+        self._id = str(next(self._ids)).encode()
+
+    async def _rollback(self):
+        if self._id is None:
+            return
+        self._clean_up()
+        self._client._tx_lock.release()
+
+    async def _commit(self):
+        try:
+            self._client._apply_writes(self._writes)
+        finally:
+            self._clean_up()
+            self._client._tx_lock.release()
+        return []
+
+    async def get_all(self, references, **kwargs):
+        async for snapshot in self._client.get_all(references, transaction=self):
+            yield snapshot
+
+    async def get(self, ref_or_query, **kwargs):
+        if isinstance(ref_or_query, LocalDocumentReference):
+            return self._client.get_all([ref_or_query], transaction=self)
+        return ref_or_query.stream(transaction=self)
+
+
+class LocalAsyncClient:
+    """
+    In-process document store. Pass a SQLite path to persist documents across
+    restarts; without it everything lives in memory.
+    """
+
+    def __init__(self, sqlite_path: str = None):
+        self._docs = {}  # collection path -> {doc_id: data}
+        self._tx_lock = asyncio.Lock()
+        self._conn = None
+        if sqlite_path:
+            self._conn = sqlite3.connect(sqlite_path)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "collection TEXT NOT NULL, doc_id TEXT NOT NULL, data BLOB NOT NULL, "
+                "PRIMARY KEY (collection, doc_id))"
+            )
+            for collection, doc_id, blob in self._conn.execute("SELECT collection, doc_id, data FROM documents"):
+                self._docs.setdefault(collection, {})[doc_id] = pickle.loads(blob)
+
+    def collection(self, name: str):
+        return LocalCollectionReference(self, name)
+
+    def document(self, path: str):
+        collection_path, doc_id = path.rsplit("/", 1)
+        return LocalDocumentReference(self, collection_path, doc_id)
+
+    def batch(self):
+        return LocalWriteBatch(self)
+
+    def transaction(self, **kwargs):
+        return LocalTransaction(self, **kwargs)
+
+    async def get_all(self, references, field_paths=None, transaction=None, **kwargs):
+        for ref in references:
+            yield LocalDocumentSnapshot(ref, self._read(ref._collection_path, ref.id))
+
+    def close(self):
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    # --- Internal storage primitives ---
+
+    def _read(self, collection_path: str, doc_id: str):
+        data = self._docs.get(collection_path, {}).get(doc_id)
+        return copy.deepcopy(data) if data is not None else None
+
+    def _store(self, collection_path: str, doc_id: str, data):
+        if data is None:
+            self._docs.get(collection_path, {}).pop(doc_id, None)
+        else:
+            self._docs.setdefault(collection_path, {})[doc_id] = data
+        if self._conn:
+            if data is None:
+                self._conn.execute("DELETE FROM documents WHERE collection = ? AND doc_id = ?", (collection_path, doc_id))
+            else:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO documents (collection, doc_id, data) VALUES (?, ?, ?)",
+                    (collection_path, doc_id, pickle.dumps(data)),
+                )
+
+    def _set_data(self, current, data, merge):
+        if merge and current is not None:
+            updated = copy.deepcopy(current)
+            _merge(updated, data)
+            return updated
+        return _resolve(data)
+
+    def _update_data(self, path, current, data):
+        if current is None:
+            raise api_exceptions.NotFound(f"No document to update: {path}")
+        updated = copy.deepcopy(current)
+        for field_path, value in data.items():
+            _set_field(updated, field_path, value)
+        return updated
+
+    def _create_data(self, path, current, data):
+        if current is not None:
+            raise api_exceptions.AlreadyExists(f"Document already exists: {path}")
+        return _resolve(data)
+
+    def _apply_writes(self, writes):
+        """
+        Applies writes all-or-nothing, like a Firestore commit: every write is
+        computed against the staged result of the previous ones, and nothing is
+        stored unless all of them succeed.
+        """
+        staged = {}  # (collection path, doc_id) -> new data, None for deleted
+        for kind, ref, data, merge in writes:
+            key = (ref._collection_path, ref.id)
+            current = staged[key] if key in staged else self._docs.get(ref._collection_path, {}).get(ref.id)
+            if kind == "set":
+                staged[key] = self._set_data(current, data, merge)
+            elif kind == "update":
+                staged[key] = self._update_data(ref.path, current, data)
+            elif kind == "create":
+                staged[key] = self._create_data(ref.path, current, data)
+            elif kind == "delete":
+                staged[key] = None
+        for (collection_path, doc_id), data in staged.items():
+            self._store(collection_path, doc_id, data)
+        if self._conn:
+            self._conn.commit()
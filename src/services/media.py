@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import tempfile
+
+from .ai import transcribe_media
+from .cache import TTLCache, MISSING
+from .db import update_message_text
+from ..utils.game_config import config
+
+# Stored as the message text until the transcript arrives
+TRANSCRIPTION_PENDING = "(Transcription pending)"
+TRANSCRIPTION_FAILED = "(Transcription Failed)"
+
+# Transcripts by Telegram file_unique_id, so re-sent/forwarded media is transcribed once
+transcription_cache = TTLCache(
+    max_size=config.MEDIA_TRANSCRIPTION_CACHE_SIZE,
+    ttl=config.MEDIA_TRANSCRIPTION_CACHE_TTL_SECONDS
+)
+
+_semaphore = asyncio.Semaphore(config.MEDIA_TRANSCRIPTION_CONCURRENCY)
+_in_flight = {}  # file_unique_id -> Task, joins concurrent requests for the same file
+_tasks = set()  # Keeps background jobs referenced until they finish
+
+
+def get_cached_transcript(file_unique_id: str):
+    transcript = transcription_cache.get(file_unique_id)
+    return None if transcript is MISSING else transcript
+
+
+async def _download_and_transcribe(bot, file_id: str, file_size: int | None, mime_type: str) -> str:
+    if file_size and file_size > config.MEDIA_MAX_BYTES:
+        logging.warning(f"Skipping transcription of {file_size} byte media (limit {config.MEDIA_MAX_BYTES}).")
+        return TRANSCRIPTION_FAILED
+
+    async with _semaphore:
+        file_info = await bot.get_file(file_id)
+        # Streamed to a spool that stays in memory for short notes and moves to disk for long ones
+        with tempfile.SpooledTemporaryFile(max_size=config.MEDIA_SPOOL_MEMORY_BYTES) as spool:
+            await bot.download_file(file_info.file_path, spool)
+            spool.seek(0)
+            # Vertex needs the payload inline, this is the only full copy we make
+            file_bytes = spool.read()
+        return await transcribe_media(file_bytes, mime_type)
+
+
+async def get_transcript(bot, file_id: str, file_unique_id: str, file_size: int | None, mime_type: str) -> str:
+    """
+    Returns the transcript of a voice/video note, transcribing it at most once
+    per file_unique_id even when several messages ask for it concurrently.
+    """
+    cached = get_cached_transcript(file_unique_id)
+    if cached is not None:
+        return cached
+
+    task = _in_flight.get(file_unique_id)
+    if task is None:
+        task = asyncio.create_task(_download_and_transcribe(bot, file_id, file_size, mime_type))
+        _in_flight[file_unique_id] = task
+        task.add_done_callback(lambda _: _in_flight.pop(file_unique_id, None))
+
+    transcript = await asyncio.shield(task)
+    if transcript and "Transcription Failed" not in transcript:
+        transcription_cache.set(file_unique_id, transcript)
+    return transcript
+
+
+async def _transcribe_and_patch(bot, chat_id, message_id, file_id, file_unique_id, file_size, mime_type, prefix):
+    try:
+        transcript = await get_transcript(bot, file_id, file_unique_id, file_size, mime_type)
+    except Exception as e:
+        logging.error(f"Failed to transcribe media: {e}")
+        transcript = TRANSCRIPTION_FAILED
+    await update_message_text(chat_id, message_id, f"{prefix} {transcript}")
+
+
+def schedule_transcription(bot, chat_id, message_id, file_id, file_unique_id, file_size, mime_type, prefix):
+    """
+    Transcribes in the background and patches the stored message text when done,
+    so the update worker (and the chat's queue) is not held by the AI call.
+    """
+    task = asyncio.create_task(
+        _transcribe_and_patch(bot, chat_id, message_id, file_id, file_unique_id, file_size, mime_type, prefix)
+    )
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def drain(timeout: float):
+    """Waits for scheduled transcriptions to finish (used on shutdown)."""
+    if _tasks:
+        await asyncio.wait(list(_tasks), timeout=timeout)
+
+
+def stats() -> dict:
+    return {**transcription_cache.stats(), "in_flight": len(_in_flight), "scheduled": len(_tasks)}
@@ -0,0 +1,290 @@
+import contextlib
+import contextvars
+import functools
+import inspect
+import logging
+import time
+
+from ..utils.game_config import config
+
+# Latency buckets in seconds, from cache hits to long AI calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _label_key(labels: dict):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=None) -> str:
+    pairs = list(key) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+
+    def inc(self, value: float = 1, **labels):
+        key = _label_key(labels)
+        self._values[key] = self._values.get(key, 0) + value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(key)} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}  # label key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        for key, series in self._series.items():
+            for bound, count in zip(self.buckets, series):
+                yield f"{self.name}_bucket{_format_labels(key, {'le': bound})} {count}"
+            yield f"{self.name}_bucket{_format_labels(key, {'le': '+Inf'})} {series[-1]}"
+            yield f"{self.name}_sum{_format_labels(key)} {series[-2]}"
+            yield f"{self.name}_count{_format_labels(key)} {series[-1]}"
+
+
+class Gauge:
+    """Read at scrape time from a callback, so there is nothing to keep in sync."""
+
+    def __init__(self, name: str, help_text: str, read):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def render(self):
+        try:
+            value = self.read()
+        except Exception as e:
+            logging.error(f"Failed to read gauge {self.name}: {e}")
+            return
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {value}"
+
+
+_registry = []
+
+
+def _register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def gauge(name: str, help_text: str, read):
+    return _register(Gauge(name, help_text, read))
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+webhook_seconds = _register(Histogram("snitch_webhook_seconds", "Time to answer a Telegram webhook call"))
+update_seconds = _register(Histogram("snitch_update_seconds", "Time to process one Telegram update"))
+db_call_seconds = _register(Histogram("snitch_db_call_seconds", "Latency of db.py functions"))
+db_call_round_trips = _register(Histogram("snitch_db_call_round_trips", "Firestore round-trips per db.py call", COUNT_BUCKETS))
+firestore_round_trips = _register(Counter("snitch_firestore_round_trips_total", "Firestore round-trips by operation"))
+ai_call_seconds = _register(Histogram("snitch_ai_call_seconds", "AI call latency by prompt type, retries included"))
+ai_tokens = _register(Counter("snitch_ai_tokens_total", "AI tokens by prompt type and kind"))
+ai_errors = _register(Counter("snitch_ai_errors_total", "Failed AI calls by prompt type"))
+job_seconds = _register(Histogram("snitch_job_seconds", "Scheduled job duration per chat"))
+telegram_sends = _register(Counter("snitch_telegram_sends_total", "Outbound Telegram messages by kind and outcome"))
+telegram_retry_after = _register(Counter("snitch_telegram_retry_after_total", "Flood-control answers (RetryAfter) from Telegram"))
+telegram_send_wait_seconds = _register(Histogram("snitch_telegram_send_wait_seconds", "Time an outbound message waited for rate limits"))
+write_buffer_dropped = _register(Counter("snitch_write_buffer_dropped_total", "Buffered writes dropped after WRITE_BUFFER_MAX_ATTEMPTS failed flushes"))
+agreement_prefilter = _register(Counter("snitch_agreement_prefilter_total", "Agreement check slices skipped or sent to AI by the keyword pre-filter"))
+
+
+# --- Tracing ---
+
+class UpdateTrace:
+    def __init__(self, update_id, chat_id, kind: str):
+        self.update_id = update_id
+        self.chat_id = chat_id
+        self.kind = kind
+        self.started = time.perf_counter()
+        self.db_calls = 0
+        self.db_seconds = 0.0
+        self.round_trips = 0
+        self.ai_calls = 0
+        self.ai_seconds = 0.0
+
+    def summary(self, elapsed: float) -> str:
+        return (
+            f"[trace update={self.update_id} chat={self.chat_id} {self.kind}] {elapsed:.2f}s, "
+            f"db {self.db_calls} calls/{self.round_trips} round-trips/{self.db_seconds:.2f}s, "
+            f"ai {self.ai_calls} calls/{self.ai_seconds:.2f}s"
+        )
+
+
+_trace = contextvars.ContextVar("snitch_trace", default=None)
+_db_call = contextvars.ContextVar("snitch_db_call", default=None)
+_in_firestore_op = contextvars.ContextVar("snitch_in_firestore_op", default=False)
+
+
+def current_trace():
+    return _trace.get()
+
+
+@contextlib.contextmanager
+def trace_update(update_id, chat_id, kind: str):
+    """
+    Collects db and AI time for one update and records its duration.
+    Updates slower than TRACE_SLOW_UPDATE_SECONDS are logged with the breakdown.
+    """
+    trace = UpdateTrace(update_id, chat_id, kind)
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+        elapsed = time.perf_counter() - trace.started
+        update_seconds.observe(elapsed, kind=kind)
+        if elapsed >= config.TRACE_SLOW_UPDATE_SECONDS:
+            logging.info(trace.summary(elapsed))
+
+
+# --- db.py and Firestore instrumentation ---
+
+def track_db(func):
+    """Records latency and Firestore round-trips of a db.py function (nested calls included)."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        parent = _db_call.get()
+        counter = [0]
+        token = _db_call.set(counter)
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _db_call.reset(token)
+            elapsed = time.perf_counter() - started
+            db_call_seconds.observe(elapsed, function=name)
+            db_call_round_trips.observe(counter[0], function=name)
+            if parent is not None:
+                parent[0] += counter[0]
+            else:
+                trace = _trace.get()
+                if trace:
+                    trace.db_calls += 1
+                    trace.db_seconds += elapsed
+    return wrapper
+
+
+def _record_round_trip(op: str):
+    firestore_round_trips.inc(op=op)
+    counter = _db_call.get()
+    if counter is not None:
+        counter[0] += 1
+    trace = _trace.get()
+    if trace:
+        trace.round_trips += 1
+
+
+def _wrap_round_trip(cls, method: str, op: str):
+    original = getattr(cls, method)
+    if getattr(original, "_snitch_round_trip", False):
+        return
+
+    if inspect.isasyncgenfunction(original):
+        @functools.wraps(original)
+        async def wrapper(*args, **kwargs):
+            if not _in_firestore_op.get():
+                _record_round_trip(op)
+            async for item in original(*args, **kwargs):
+                yield item
+    elif inspect.iscoroutinefunction(original):
+        @functools.wraps(original)
+        async def wrapper(*args, **kwargs):
+            if _in_firestore_op.get():
+                return await original(*args, **kwargs)
+            _record_round_trip(op)
+            token = _in_firestore_op.set(True)
+            try:
+                return await original(*args, **kwargs)
+            finally:
+                _in_firestore_op.reset(token)
+    else:
+        # Returns a lazy stream; the request goes out once it is iterated
+        @functools.wraps(original)
+        def wrapper(*args, **kwargs):
+            if not _in_firestore_op.get():
+                _record_round_trip(op)
+            return original(*args, **kwargs)
+
+    wrapper._snitch_round_trip = True
+    setattr(cls, method, wrapper)
+
+
+def instrument_firestore():
+    """Counts round-trips of the Firestore async client and the local stand-in."""
+    from google.cloud.firestore_v1 import async_batch, async_client, async_document, async_query, async_transaction
+    from . import local_store
+
+    targets = [
+        (async_document.AsyncDocumentReference, local_store.LocalDocumentReference, {
+            "get": "get", "set": "set", "update": "update", "create": "create", "delete": "delete",
+        }),
+        (async_query.AsyncQuery, local_store.LocalQuery, {"stream": "query", "get": "query"}),
+        (async_client.AsyncClient, local_store.LocalAsyncClient, {"get_all": "get_all"}),
+        (async_batch.AsyncWriteBatch, local_store.LocalWriteBatch, {"commit": "commit"}),
+        (async_transaction.AsyncTransaction, local_store.LocalTransaction, {
+            "_begin": "transaction_begin", "_commit": "transaction_commit", "_rollback": "transaction_rollback",
+        }),
+    ]
+    for remote_cls, local_cls, methods in targets:
+        for method, op in methods.items():
+            for cls in (remote_cls, local_cls):
+                if method in cls.__dict__:
+                    _wrap_round_trip(cls, method, op)
+
+
+# --- AI and scheduler ---
+
+def observe_ai_call(session: str, elapsed: float, prompt_tokens: int = 0, cached_tokens: int = 0, output_tokens: int = 0, failed: bool = False):
+    ai_call_seconds.observe(elapsed, session=session)
+    if failed:
+        ai_errors.inc(session=session)
+    else:
+        ai_tokens.inc(prompt_tokens, session=session, kind="prompt")
+        ai_tokens.inc(cached_tokens, session=session, kind="cached")
+        ai_tokens.inc(output_tokens, session=session, kind="output")
+    trace = _trace.get()
+    if trace:
+        trace.ai_calls += 1
+        trace.ai_seconds += elapsed
+
+
+def observe_job(job_name: str, status: str, elapsed: float):
+    job_seconds.observe(elapsed, job=job_name, status=status)
@@ -0,0 +1,222 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from google.cloud.firestore_v1 import transforms
+
+from . import metrics
+
+# Firestore rejects batches with more than 500 writes
+FIRESTORE_BATCH_LIMIT = 500
+
+
+def merge_fields(base: dict, update: dict) -> dict:
+    """Returns `base` with `update` merged in, recursing into nested maps like `set(merge=True)`."""
+    result = dict(base)
+    for key, value in update.items():
+        current = result.get(key)
+        if isinstance(value, dict) and isinstance(current, dict):
+            result[key] = merge_fields(current, value)
+        elif isinstance(value, transforms.ArrayUnion) and isinstance(current, (transforms.ArrayUnion, list)):
+            # Two pending unions fold into one; a stored list gets the new elements appended
+            existing = current.values if isinstance(current, transforms.ArrayUnion) else current
+            seen = set(existing)
+            union = existing + [item for item in value.values if item not in seen]
+            result[key] = transforms.ArrayUnion(union) if isinstance(current, transforms.ArrayUnion) else union
+        elif isinstance(value, transforms.Increment) and isinstance(current, transforms.Increment):
+            result[key] = transforms.Increment(current.value + value.value)
+        else:
+            result[key] = value
+    return result
+
+
+def resolve_fields(base: dict | None, update: dict) -> dict:
+    """
+    `base` with `update` applied the way Firestore stores it: sentinels and
+    transforms (server timestamps, array unions, increments...) become values.
+    """
+    result = dict(base or {})
+    for key, value in update.items():
+        current = result.get(key)
+        if isinstance(value, dict):
+            result[key] = resolve_fields(current if isinstance(current, dict) else None, value)
+        elif value is transforms.DELETE_FIELD:
+            result.pop(key, None)
+        elif value is transforms.SERVER_TIMESTAMP:
+            result[key] = datetime.now(timezone.utc)
+        elif isinstance(value, transforms.ArrayUnion):
+            existing = list(current) if isinstance(current, list) else []
+            result[key] = existing + [item for item in value.values if item not in existing]
+        elif isinstance(value, transforms.ArrayRemove):
+            existing = list(current) if isinstance(current, list) else []
+            result[key] = [item for item in existing if item not in value.values]
+        elif isinstance(value, transforms.Increment):
+            result[key] = (current if isinstance(current, (int, float)) else 0) + value.value
+        else:
+            result[key] = value
+    return result
+
+
+class WriteBuffer:
+    """
+    Write-behind buffer for hot-path document writes.
+
+    Writes are coalesced per document path: a later `set` replaces the pending
+    one, a later merge is folded into it. Pending writes are committed with
+    batched writes when `max_size` documents are queued or every
+    `flush_interval` seconds, and always on `stop()`. A write whose batch keeps
+    failing is retried for `max_attempts` flushes, then written on its own
+    once more and dropped if that fails too.
+
+    While the background loop is not running (scripts, one-off jobs), `set`
+    writes straight through so nothing is left behind.
+    """
+
+    def __init__(self, client, max_size: int, flush_interval: float, max_attempts: int = 5):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self._client = client
+        self._pending = {}  # doc path -> (ref, data, merge)
+        self._inflight = {}  # writes taken by a flush that is still committing
+        self._attempts = {}  # doc path -> failed flushes of its pending write
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self._size_flush = None  # flush started by set() when the buffer is full
+        self._stats = {"enqueued": 0, "coalesced": 0, "flushed_docs": 0, "batches": 0, "errors": 0, "dropped": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def set(self, ref, data: dict, merge: bool = False):
+        if not self.running:
+            await ref.set(data, merge=merge)
+            return
+
+        self._stats["enqueued"] += 1
+        existing = self._pending.get(ref.path)
+        if existing and merge:
+            _, old_data, old_merge = existing
+            self._pending[ref.path] = (ref, merge_fields(old_data, data), old_merge)
+            self._stats["coalesced"] += 1
+        else:
+            if existing:
+                self._stats["coalesced"] += 1
+            self._pending[ref.path] = (ref, dict(data), merge)
+
+        if len(self._pending) >= self.max_size and (self._size_flush is None or self._size_flush.done()):
+            # One tracked flush at a time; writes queued meanwhile go out with the next one
+            self._size_flush = asyncio.create_task(self._flush_logged())
+
+    async def _flush_logged(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            logging.error(f"Write buffer flush error: {e}")
+
+    def overlay(self, ref, data: dict | None) -> dict | None:
+        """
+        Applies a pending write for `ref` on top of the stored document data,
+        so readers see their own buffered writes, with transforms resolved.
+        """
+        for layer in (self._inflight, self._pending):
+            entry = layer.get(ref.path)
+            if not entry:
+                continue
+            _, pending_data, merge = entry
+            data = resolve_fields(data if merge else None, pending_data)
+        return data
+
+    async def flush(self):
+        """Commits every pending write in as few batches as possible."""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            self._inflight = self._pending
+            self._pending = {}
+            entries = list(self._inflight.values())
+
+            for start in range(0, len(entries), FIRESTORE_BATCH_LIMIT):
+                chunk = entries[start:start + FIRESTORE_BATCH_LIMIT]
+                batch = self._client.batch()
+                for ref, data, merge in chunk:
+                    batch.set(ref, data, merge=merge)
+                try:
+                    await batch.commit()
+                    self._stats["batches"] += 1
+                    self._stats["flushed_docs"] += len(chunk)
+                    for ref, _, _ in chunk:
+                        self._attempts.pop(ref.path, None)
+                except Exception as e:
+                    self._stats["errors"] += 1
+                    logging.error(f"Write buffer flush failed for {len(chunk)} documents: {e}")
+                    await self._retry_later(chunk)
+
+            self._inflight = {}
+            logging.debug(f"Write buffer flushed {len(entries)} documents.")
+
+    async def _retry_later(self, entries):
+        """
+        Requeues the writes of a failed batch. One that has used up its attempts is
+        written on its own, so a single bad document (invalid path, value too large)
+        cannot keep failing the rest of its batch, and dropped if it fails again.
+        """
+        retry = []
+        for ref, data, merge in entries:
+            attempts = self._attempts.get(ref.path, 0) + 1
+            if attempts < self.max_attempts:
+                self._attempts[ref.path] = attempts
+                retry.append((ref, data, merge))
+                continue
+            self._attempts.pop(ref.path, None)
+            try:
+                await ref.set(data, merge=merge)
+                self._stats["flushed_docs"] += 1
+            except Exception as e:
+                self._stats["dropped"] += 1
+                metrics.write_buffer_dropped.inc()
+                logging.error(f"Write buffer dropped the write to {ref.path} after {attempts} attempts: {e}")
+        self._requeue(retry)
+
+    def _requeue(self, entries):
+        # Put failed writes back without clobbering anything queued since
+        for ref, data, merge in entries:
+            newer = self._pending.get(ref.path)
+            if not newer:
+                self._pending[ref.path] = (ref, data, merge)
+            elif newer[2]:
+                self._pending[ref.path] = (ref, merge_fields(data, newer[1]), merge)
+            else:
+                # A full set queued since replaces the failed write, and starts over
+                self._attempts.pop(ref.path, None)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Write buffer loop error: {e}")
+
+    def start(self):
+        if self.running:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the background loop and flushes whatever is still pending."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._size_flush:
+            await self._size_flush
+            self._size_flush = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {**self._stats, "pending": len(self._pending)}
@@ -0,0 +1,37 @@
+from .game_config import config
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap local token estimate. Gemini averages roughly 3 characters per token
+    on mixed Russian/English chat text, which errs on the side of smaller chunks.
+    """
+    return len(text) // config.AI_CHARS_PER_TOKEN + 1
+
+
+def chunk_lines(lines, token_budget: int, overlap: int = 0):
+    """
+    Splits lines into consecutive windows that each fit into `token_budget`.
+    Each window repeats the last `overlap` lines of the previous one so
+    conversations crossing a boundary keep their context.
+    A single line larger than the budget becomes its own window.
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+
+    for line in lines:
+        line_tokens = estimate_tokens(line)
+        if current and current_tokens + line_tokens > token_budget:
+            chunks.append(current)
+            current = current[-overlap:] if overlap else []
+            current_tokens = sum(estimate_tokens(l) for l in current)
+            # Drop overlap that would not leave room for the new line
+            while current and current_tokens + line_tokens > token_budget:
+                current_tokens -= estimate_tokens(current.pop(0))
+        current.append(line)
+        current_tokens += line_tokens
+
+    if current:
+        chunks.append(current)
+    return chunks
@@ -7,7 +7,32 @@ class Settings(BaseSettings):
     GCP_LOCATION: str = "us-central1"
     SECRET_TOKEN: str
     LORE_BUCKET_NAME: str | None = None
+    # Archived messages: objects under this prefix in LORE_BUCKET_NAME, or a local directory without a bucket
+    MESSAGE_ARCHIVE_DIR: str = "message_archive"
+    # Storage backend: "firestore" (production), "memory" or "sqlite" (offline load testing)
+    STORAGE_BACKEND: str = "firestore"
+    SQLITE_PATH: str = "snitch_local.db"
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", extra="ignore")
 
-settings = Settings()
+class LazySettings:
+    """
+    Reads the environment on first attribute access rather than at import,
+    so modules (and scripts) can be imported before the env is complete.
+    """
+
+    def __init__(self):
+        object.__setattr__(self, "_settings", None)
+
+    def _load(self) -> Settings:
+        if self._settings is None:
+            object.__setattr__(self, "_settings", Settings())
+        return self._settings
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+settings = LazySettings()
@@ -42,13 +42,104 @@ class GameConfig:
     ENABLE_AGREEMENTS = False
     AGREEMENT_DISPUTE_WINDOW_MINUTES = 15
     AGREEMENT_DEFAULT_LIFESPAN_HOURS = 24
+    AGREEMENT_PREFILTER_ENABLED = True # 30-minute check calls AI only for slices with agreement markers or talk about active agreements
+    AGREEMENT_EXPIRY_SWEEP_MINUTES = 60 # Expired agreements are hidden on read right away, the sweep only updates their status
 
     # Time & Analysis
     TIMEZONE_OFFSET = 3 # Moscow Time (UTC+3)
     ANALYSIS_CUTOFF_HOUR = 4 # Hour to decide if analyzing yesterday or today
+    INCREMENTAL_ANALYSIS = False # Nightly run merges the 30-minute partial verdicts instead of re-reading the whole day
+    ANALYSIS_CONTEXT_MESSAGES = 20 # Earlier messages shown (not scored) before a 30-minute slice or the nightly tail
+    DAILY_MAX_OFFENDERS = 3 # Merged partial verdicts keep at most this many offenders, heaviest first
+    DAILY_MAX_POINTS_PER_USER = POINTS_SNITCHING # and at most this many points per offender
+
+    # Write-behind buffer for message logging
+    WRITE_BUFFER_ENABLED = True
+    WRITE_BUFFER_MAX_SIZE = 200 # Flush once this many documents are pending
+    WRITE_BUFFER_FLUSH_INTERVAL_SECONDS = 2.0
+    WRITE_BUFFER_MAX_ATTEMPTS = 5 # Flushes a failing write gets before it is dropped
+
+    # Message storage layout: "documents" (one document per message) or "shards"
+    # (messages appended to one document per MESSAGE_SHARD_HOURS, read with a single get_all per day).
+    # Switch to "shards" first, then run src/scripts/migrate_message_shards.py for the history.
+    MESSAGE_STORAGE_LAYOUT = "documents"
+    MESSAGE_SHARD_HOURS = 1 # Must divide 24; keeps busy chats well under the 1 MiB document limit
+
+    # Retention: messages older than this move to gzipped day files (see services/archive.py)
+    MESSAGE_ARCHIVE_ENABLED = False
+    MESSAGE_RETENTION_DAYS = 30 # Keep above 7, amnesty and analysis read the last week
+    MESSAGE_ARCHIVE_MAX_DAYS_PER_RUN = 31 # Bounds the first runs over a long history
+
+    # In-memory user_stats cache
+    USER_STATS_CACHE_SIZE = 5000
+    USER_STATS_CACHE_TTL_SECONDS = 300
+
+    # In-memory ring buffer of recent messages (context for comments and /report)
+    RECENT_MESSAGES_PER_CHAT = 60 # Must exceed REPORT_CONTEXT_LIMIT to serve /report
+    RECENT_MESSAGES_MAX_CHATS = 1000
+
+    # /report verdicts, so repeated reports of one message cost a single AI call
+    REPORT_VERDICT_CACHE_SIZE = 1000
+    REPORT_VERDICT_CACHE_TTL_SECONDS = 86400
+
+    # Cold start: open Firestore/Vertex AI/Telegram connections in the background on startup
+    # (GET /warmup waits for the same warmup, e.g. as the Cloud Run startup probe)
+    WARMUP_ON_STARTUP = True
+
+    # Outbound message pacing (bot-initiated sends, see bot/outbox.py), below Telegram's limits
+    OUTBOX_GLOBAL_RATE = 25 # Messages per second across all chats (Telegram: ~30)
+    OUTBOX_GROUP_MESSAGES_PER_MINUTE = 18 # Per group (Telegram: 20)
+    OUTBOX_PRIVATE_RATE = 1 # Messages per second per private chat
+    OUTBOX_CHAT_BURST = 3 # Messages a quiet chat may receive back to back
+    OUTBOX_MAX_RETRIES = 3 # RetryAfter retries before a send fails
+
+    # Webhook update queue
+    # Updates are processed after the webhook returns, so on Cloud Run the
+    # service needs "CPU always allocated" for the workers to keep running.
+    UPDATE_QUEUE_ENABLED = True
+    UPDATE_WORKERS = 8 # Global concurrency limit across chats
+    UPDATE_QUEUE_MAX_PENDING = 1000 # Beyond this the webhook answers 503
+    UPDATE_QUEUE_DRAIN_SECONDS = 10
+    TRACE_SLOW_UPDATE_SECONDS = 2.0 # Updates slower than this log their db/AI breakdown
+
+    # Voice / video note transcription (runs in the background)
+    MEDIA_MAX_BYTES = 20 * 1024 * 1024 # Bot API download limit, larger files are skipped
+    MEDIA_SPOOL_MEMORY_BYTES = 1024 * 1024 # Downloads above this spill to a temp file
+    MEDIA_TRANSCRIPTION_CONCURRENCY = 3
+    MEDIA_TRANSCRIPTION_CACHE_SIZE = 1000 # Keyed by file_unique_id
+    MEDIA_TRANSCRIPTION_CACHE_TTL_SECONDS = 86400
+
+    # Scheduled jobs (per-chat fan-out)
+    SCHEDULER_CONCURRENCY = 5 # Chats processed in parallel
+    SCHEDULER_CHAT_TIMEOUT_SECONDS = 300
+    LEASE_TTL_SECONDS = 120 # Per-chat job lock, renewed every TTL/3 while held; a crashed holder blocks at most this long
+
+    # Prompt size limits
+    AI_PROMPT_TOKEN_BUDGET = 200000 # Larger logs are analyzed in parts and merged
+    AI_CHUNK_OVERLAP_LINES = 20 # Messages repeated between neighbouring parts for context
+    AI_CHUNK_CONCURRENCY = 4
+    AI_CHARS_PER_TOKEN = 3 # Used for local token estimates
 
     # AI Models
     AI_MODEL_ANALYSIS = "gemini-3-flash-preview"
     AI_MODEL_MULTIMODAL = "gemini-3-pro-preview"
+    # Explicit Vertex context cache for the static prompts (billed per hour of storage).
+    # Off by default: the prompts are sent as system instructions, which implicit caching already reuses.
+    AI_CONTEXT_CACHE_ENABLED = False
+    # JSON mode with a response schema; the THOUGHT PROCESS goes into a "reasoning" field
+    AI_STRUCTURED_OUTPUT = True
+    AI_CONTEXT_CACHE_TTL_MINUTES = 60
+
+    # AI call resilience
+    AI_TIMEOUT_SECONDS = 120 # Per attempt; daily analysis prompts can be large
+    AI_INTERACTIVE_TIMEOUT_SECONDS = 30 # /report and cynical comments, users are waiting
+    AI_MAX_RETRIES = 2 # Only throttling, overload and timeouts are retried
+    AI_CALL_DEADLINE_SECONDS = SCHEDULER_CHAT_TIMEOUT_SECONDS - 30 # All attempts of one call; no retry starts unless a full attempt still fits
+    AI_RETRY_BASE_DELAY_SECONDS = 1.0
+    AI_RETRY_MAX_DELAY_SECONDS = 10.0
+    AI_BREAKER_FAILURE_THRESHOLD = 5 # Consecutive failures before calls fail fast
+    AI_BREAKER_COOLDOWN_SECONDS = 60
+    AI_ANALYSIS_CONCURRENCY = 8 # Concurrent calls per process to AI_MODEL_ANALYSIS
+    AI_MULTIMODAL_CONCURRENCY = 3 # Concurrent calls per process to AI_MODEL_MULTIMODAL
 
 config = GameConfig()
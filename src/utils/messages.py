@@ -76,6 +76,12 @@ REPORT_ACCEPTED = (
     "📝 <b>Вердикт:</b> {reason}\n"
     "⚖️ <i>Очки начислены моментально.</i>"
 )
+REPORT_ALREADY_ACCEPTED = (
+    "✅ <b>На это уже донесли.</b>\n\n"
+    "📂 <b>Категория:</b> {category} (+{points} pts)\n"
+    "📝 <b>Вердикт:</b> {reason}\n"
+    "⚖️ <i>Очки уже начислены, второй раз не считается.</i>"
+)
 REPORT_REJECTED = (
     "❌ <b>Отклонено.</b>\n\n"
     "Это не масть. Хватит спамить, ты уже ходишь под вопросом, клоун 🤡🤡🤡\n"
@@ -4,12 +4,29 @@ from .lore import LORE
 # Conditional sections for agreements
 AGREEMENTS_CATEGORY_PROMPT = f"\n    - Нарушение Договоренностей (Active Agreements)." if config.ENABLE_AGREEMENTS else ""
 
+# Words that mark a new agreement, as listed in the prompt
+AGREEMENT_MARKERS = ["обещаю", "клянусь", "буду", "сделаю", "договорились", "забьемся", "отвечаю", "зуб даю", "по рукам"]
+
+# Exact forms the agreement check's local pre-filter looks for (lowercase, "ё" as "е").
+# Whole words only: stems would also catch "будет", "будто" and "будильник".
+AGREEMENT_MARKER_FORMS = [
+    "обещаю", "обещаем", "обещал", "обещала", "обещали", "пообещал", "пообещала", "пообещали",
+    "клянусь", "клянемся", "клялся", "клялась", "поклялся", "поклялась",
+    "буду",
+    "сделаю",
+    "договорились", "договоримся",
+    "забьемся", "забились", "забиваемся",
+    "отвечаю",
+    "зуб даю",
+    "по рукам",
+]
+
 AGREEMENTS_THOUGHT_PROMPT = f"""
 2. Для активных договоренностей (Active Agreements):
    - Проверь лог на предмет их нарушения. Нарушение договоренности — это Snitching ({config.POINTS_SNITCHING} очков).
    - Если новая информация дополняет или изменяет существующую активную договоренность, используй блок `updated_agreements`.
 3. Для поиска новых договоренностей (Слово Пацана):
-   - Ищи маркеры: «обещаю», «клянусь», «буду», «сделаю», «договорились», «забьемся», «отвечаю», «зуб даю», «по рукам».
+   - Ищи маркеры: {', '.join(f'«{marker}»' for marker in AGREEMENT_MARKERS)}.
    - ВАЖНО: Договоренность должна быть четкой и взаимной (или публичным обязательством).
    - ОТЛИЧИЕ ОТ ПЛАНОВ: Если участник просто делится планами (например, "я сегодня пойду в кино"), это НЕ является договоренностью. Договоренность — это когда человек берет на себя обязательство перед кем-то или перед группой, либо когда двое договариваются о совместном действии.
    - Если это просто "наверное сделаю" или "я собираюсь", это не считается.
@@ -40,6 +57,22 @@ AGREEMENTS_JSON_PROMPT = f"""
      }}
   ],""" if config.ENABLE_AGREEMENTS else ""
 
+# With structured output the reasoning travels inside the JSON, in a field the schema puts first
+if config.AI_STRUCTURED_OUTPUT:
+    OUTPUT_PARTS_PROMPT = """Твой ответ — один JSON-объект.
+1. Поле "reasoning" (первое): THOUGHT PROCESS — подробный разбор полетов свободным текстом.
+2. Остальные поля: итоговый вердикт."""
+    REPORT_OUTPUT_PARTS_PROMPT = 'Выведи один JSON-объект: THOUGHT PROCESS запиши в поле "reasoning", затем вердикт.'
+    REASONING_JSON_PROMPT = '\n  "reasoning": "THOUGHT PROCESS",'
+    RESPONSE_FORMAT_NOTE = 'Верни JSON: THOUGHT PROCESS в поле "reasoning", затем итог.'
+else:
+    OUTPUT_PARTS_PROMPT = """Твой ответ должен состоять из двух частей:
+1. Блок THOUGHT PROCESS: Подробный разбор полетов свободным текстом.
+2. Блок FINAL JSON: Строгий JSON."""
+    REPORT_OUTPUT_PARTS_PROMPT = "Выведи THOUGHT PROCESS, затем FINAL JSON."
+    REASONING_JSON_PROMPT = ""
+    RESPONSE_FORMAT_NOTE = "Верни THOUGHT PROCESS и FINAL JSON."
+
 SYSTEM_PROMPT = f"""
 <role>
 Ты — циничный, саркастичный и наблюдательный судья в чате друзей. Твоя задача — прочитать историю переписки за день, выбрать "Снитча дня" (Snitch of the Day) и классифицировать его проступок для начисления очков.
@@ -96,12 +129,10 @@ SYSTEM_PROMPT = f"""
 </thought_process_instructions>
 
 <output_format>
-Твой ответ должен состоять из двух частей:
-1. Блок THOUGHT PROCESS: Подробный разбор полетов свободным текстом.
-2. Блок FINAL JSON: Строгий JSON.
+{OUTPUT_PARTS_PROMPT}
 
 Формат JSON:
-{{
+{{{REASONING_JSON_PROMPT}
 {AGREEMENTS_JSON_PROMPT}
   "offenders": [
     {{
@@ -143,9 +174,9 @@ REPORT_VALIDATION_PROMPT = f"""
 </thought_process_instructions>
 
 <output_format>
-Выведи THOUGHT PROCESS, затем FINAL JSON.
+{REPORT_OUTPUT_PARTS_PROMPT}
 Формат JSON:
-{{
+{{{REASONING_JSON_PROMPT}
   "valid": true/false,
   "category": "Whining" (или null),
   "points": 10 (или 0),
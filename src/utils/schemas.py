@@ -0,0 +1,177 @@
+import logging
+
+from .game_config import config
+
+# Response schemas for Gemini's JSON mode. "reasoning" comes first so the model
+# thinks before it commits to the verdict. Vertex orders properties alphabetically
+# unless "propertyOrdering" says otherwise, so every object schema sets it.
+OFFENDER_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "user_id": {"type": "integer"},
+        "username": {"type": "string"},
+        "category": {"type": "string"},
+        "points": {"type": "integer"},
+        "reason": {"type": "string"},
+        "quote": {"type": "string", "nullable": True},
+    },
+    "propertyOrdering": ["user_id", "username", "category", "points", "reason", "quote"],
+    "required": ["user_id", "username", "category", "points", "reason"],
+}
+
+AGREEMENT_SCHEMAS = {
+    "new_agreements": {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "text": {"type": "string"},
+                "users": {"type": "array", "items": {"type": "string"}},
+                "type": {"type": "string", "enum": ["vow", "pact", "public"]},
+                "expires_at": {"type": "string", "nullable": True},
+                "reasoning": {"type": "string"},
+            },
+            "propertyOrdering": ["reasoning", "text", "users", "type", "expires_at"],
+            "required": ["text", "users", "type"],
+        },
+    },
+    "resolved_agreements": {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "id": {"type": "string"},
+                "status": {"type": "string", "enum": ["fulfilled", "broken"]},
+                "reason": {"type": "string"},
+            },
+            "propertyOrdering": ["id", "reason", "status"],
+            "required": ["id", "status"],
+        },
+    },
+    "updated_agreements": {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "id": {"type": "string"},
+                "text": {"type": "string"},
+                "reason": {"type": "string"},
+            },
+            "propertyOrdering": ["id", "reason", "text"],
+            "required": ["id", "text"],
+        },
+    },
+}
+
+DAILY_VERDICT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "reasoning": {"type": "string"},
+        **(AGREEMENT_SCHEMAS if config.ENABLE_AGREEMENTS else {}),
+        "offenders": {"type": "array", "items": OFFENDER_SCHEMA},
+    },
+    "propertyOrdering": ["reasoning", *(AGREEMENT_SCHEMAS if config.ENABLE_AGREEMENTS else {}), "offenders"],
+    "required": ["reasoning", "offenders"],
+}
+
+REPORT_VERDICT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "reasoning": {"type": "string"},
+        "valid": {"type": "boolean"},
+        "category": {"type": "string", "nullable": True},
+        "points": {"type": "integer"},
+        "reason": {"type": "string"},
+    },
+    "propertyOrdering": ["reasoning", "valid", "category", "points", "reason"],
+    "required": ["reasoning", "valid", "points", "reason"],
+}
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _clean_offender(off):
+    if not isinstance(off, dict):
+        return None
+    user_id = _as_int(off.get("user_id"))
+    points = _as_int(off.get("points"))
+    if not user_id or points is None or points < 0:
+        return None
+    return {
+        **off,
+        "user_id": user_id,
+        "username": str(off.get("username") or "Unknown"),
+        "category": str(off.get("category") or "Unspecified"),
+        "points": points,
+        "reason": str(off.get("reason") or "-"),
+    }
+
+
+def _clean_new_agreement(ag):
+    if not isinstance(ag, dict) or not isinstance(ag.get("text"), str) or not ag["text"].strip():
+        return None
+    users = ag.get("users")
+    if not isinstance(users, list):
+        return None
+    ag_type = ag.get("type") if ag.get("type") in ("vow", "pact", "public") else "vow"
+    return {**ag, "users": [str(u) for u in users if u], "type": ag_type}
+
+
+def _clean_resolved_agreement(res):
+    if not isinstance(res, dict) or not res.get("id") or res.get("status") not in ("fulfilled", "broken"):
+        return None
+    return {**res, "id": str(res["id"])}
+
+
+def _clean_updated_agreement(upd):
+    if not isinstance(upd, dict) or not upd.get("id") or not isinstance(upd.get("text"), str) or not upd["text"].strip():
+        return None
+    return {**upd, "id": str(upd["id"])}
+
+
+_CLEANERS = {
+    "offenders": _clean_offender,
+    "new_agreements": _clean_new_agreement,
+    "resolved_agreements": _clean_resolved_agreement,
+    "updated_agreements": _clean_updated_agreement,
+}
+
+
+def validate_daily_verdict(result):
+    """
+    Normalizes an AI daily verdict and drops entries that would corrupt stats or
+    agreements (missing/non-numeric user IDs, negative points, unknown statuses...).
+    Returns None if the result is not a verdict at all.
+    """
+    if not isinstance(result, dict):
+        return None
+    verdict = {}
+    for field, clean in _CLEANERS.items():
+        entries = result.get(field) or []
+        if not isinstance(entries, list):
+            logging.warning(f"AI verdict field '{field}' is not a list, ignoring it.")
+            entries = []
+        cleaned = [clean(entry) for entry in entries]
+        dropped = sum(1 for entry in cleaned if entry is None)
+        if dropped:
+            logging.warning(f"Dropped {dropped} malformed entries from AI verdict field '{field}'.")
+        verdict[field] = [entry for entry in cleaned if entry is not None]
+    return verdict
+
+
+def validate_report_verdict(result):
+    """Normalizes a /report verdict; returns None if it is unusable."""
+    if not isinstance(result, dict) or not isinstance(result.get("valid"), bool):
+        return None
+    points = _as_int(result.get("points")) or 0
+    return {
+        "valid": result["valid"],
+        "category": result.get("category"),
+        "points": max(points, 0) if result["valid"] else 0,
+        "reason": str(result.get("reason") or ""),
+    }
@@ -1,6 +1,84 @@
 import html
+import re
 
 def escape(text: str) -> str:
     if text is None:
         return ""
     return html.escape(str(text))
+
+# Telegram rejects messages longer than this (counted after entity parsing,
+# so splitting the HTML source is on the safe side)
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Pieces a long line may be cut between: HTML tags and entities stay whole, words keep their trailing space
+_HTML_ATOM_RE = re.compile(r"<[^>]*>|&#?\w+;|[^<&\s]+\s*|\s+|[<&]")
+_TEXT_ATOM_RE = re.compile(r"\S+\s*|\s+")
+_TAG_RE = re.compile(r"<(/?)([a-zA-Z][\w-]*)[^>]*?(/?)>")
+
+def _split_line(line: str, limit: int, parse_html: bool) -> list:
+    """
+    Cuts one line longer than `limit` between words. With HTML, tags and entities
+    are never cut and tags open at a cut are closed there and reopened in the next part.
+    Only a single word longer than the limit is cut inside.
+    """
+    atoms = (_HTML_ATOM_RE if parse_html else _TEXT_ATOM_RE).findall(line)
+    open_tags = []  # (name, opening tag) of the tags open at the current position
+    parts = []
+    current = ""
+    has_text = False
+
+    def closing() -> str:
+        return "".join(f"</{name}>" for name, _ in reversed(open_tags))
+
+    def reopening() -> str:
+        return "".join(tag for _, tag in open_tags)
+
+    for atom in atoms:
+        tag = _TAG_RE.fullmatch(atom) if parse_html else None
+        # An opening tag needs room for its own closing tag too
+        extra = len(f"</{tag.group(2)}>") if tag and not tag.group(1) and not tag.group(3) else 0
+        if has_text and len(current) + len(atom) + extra + len(closing()) > limit:
+            parts.append(current + closing())
+            current, has_text = reopening(), False
+        while not tag and len(current) + len(atom) + len(closing()) > limit:
+            room = max(limit - len(current) - len(closing()), 1)
+            parts.append(current + atom[:room] + closing())
+            atom = atom[room:]
+            current = reopening()
+        current += atom
+        if tag and tag.group(1):
+            for i in range(len(open_tags) - 1, -1, -1):
+                if open_tags[i][0] == tag.group(2):
+                    del open_tags[i]
+                    break
+        elif tag and not tag.group(3):
+            open_tags.append((tag.group(2), atom))
+        elif not tag:
+            has_text = True
+    parts.append(current)
+    return parts
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT, parse_html: bool = False) -> list:
+    """
+    Splits text into parts of at most `limit` characters at line breaks.
+    Every line of our HTML messages closes its own tags, so parts stay valid;
+    a single line longer than the limit is cut between words (see _split_line).
+    """
+    if len(text) <= limit:
+        return [text]
+    parts = []
+    current = ""
+    for line in text.splitlines(keepends=True):
+        if len(line) > limit:
+            if current:
+                parts.append(current)
+            *pieces, current = _split_line(line, limit, parse_html)
+            parts.extend(pieces)
+            continue
+        if len(current) + len(line) > limit:
+            parts.append(current)
+            current = ""
+        current += line
+    if current.strip():
+        parts.append(current)
+    return [part for part in parts if part.strip()]
@@ -0,0 +1,48 @@
+import pytest
+
+from src.services.agreements import agreement_prefilter
+
+
+def logs(*texts):
+    return [{"text": text} for text in texts]
+
+
+def test_plain_chat_skips_the_ai_call():
+    slice_logs = logs(
+        "Кто будет на встрече завтра?",
+        "Будто ты не знаешь, будильник опять не сработал",
+        "Поставил руки на стол и уснул",
+        "Отвечает всегда с опозданием, сделай скидку",
+        "Пообедаем в час?",
+    )
+    assert agreement_prefilter(slice_logs, []) is None
+
+
+@pytest.mark.parametrize("text", [
+    "Обещаю, что завтра приду",
+    "Ладно, я буду в восемь",
+    "Клянусь, больше не опоздаю",
+    "Он же пообещал вернуть долг",
+    "Договорились, в пятницу",
+    "Ну всё, по рукам!",
+    "Зуб даю — сделаю к обеду",
+    "Забьёмся на пиво?",
+])
+def test_markers_escalate(text):
+    assert agreement_prefilter(logs("привет", text), []) == "marker"
+
+
+def test_phrase_markers_need_both_words():
+    assert agreement_prefilter(logs("Подними руками коробку"), []) is None
+    assert agreement_prefilter(logs("Зубы болят, даю отдых"), []) is None
+
+
+def test_talk_about_an_active_agreement_escalates():
+    active = [{"text": "Петя бросает курить до конца месяца"}]
+    assert agreement_prefilter(logs("Петя опять курить пошёл, бросает он"), active) == "agreement"
+    assert agreement_prefilter(logs("Кто идёт обедать?"), active) is None
+
+
+def test_single_word_agreement_needs_only_that_word():
+    active = [{"text": "Спортзал"}]
+    assert agreement_prefilter(logs("сегодня спортзал отменяется"), active) == "agreement"
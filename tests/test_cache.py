@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta, timezone
+
+from src.services.cache import RecentMessages
+
+T0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def msg(i, seconds=None):
+    return {"message_id": str(i), "timestamp": T0 + timedelta(seconds=i if seconds is None else seconds), "text": f"m{i}"}
+
+
+def ids(messages):
+    return [m["message_id"] for m in messages] if messages is not None else None
+
+
+def buffer_with(*messages, per_chat=10):
+    buffer = RecentMessages(per_chat=per_chat, max_chats=10)
+    for message in messages:
+        buffer.add(1, message)
+    return buffer
+
+
+def test_before_answers_only_with_enough_covered_messages():
+    buffer = buffer_with(*(msg(i) for i in range(5)))
+
+    assert ids(buffer.before(1, T0 + timedelta(seconds=4), limit=3)) == ["1", "2", "3"]
+    # Only four messages before it are buffered; older ones may exist in Firestore
+    assert buffer.before(1, T0 + timedelta(seconds=4), limit=5) is None
+    assert buffer.before(2, T0, limit=1) is None
+
+
+def test_before_excludes_the_timestamp_itself():
+    buffer = buffer_with(*(msg(i) for i in range(5)))
+    assert ids(buffer.before(1, T0 + timedelta(seconds=2), limit=2)) == ["0", "1"]
+
+
+def test_a_late_message_older_than_the_coverage_is_not_used_by_before():
+    buffer = buffer_with(msg(10), msg(11))
+    buffer.add(1, msg(5))  # arrived late; messages 6..9 were never buffered
+
+    assert buffer.get(1, "5")["text"] == "m5"
+    assert buffer.before(1, T0 + timedelta(seconds=12), limit=3) is None
+    assert ids(buffer.before(1, T0 + timedelta(seconds=12), limit=2)) == ["10", "11"]
+
+
+def test_trimming_moves_covered_from_and_after_falls_back_before_it():
+    buffer = buffer_with(*(msg(i) for i in range(8)), per_chat=5)
+
+    assert ids(buffer.after(1, T0 + timedelta(seconds=3), limit=10)) == ["4", "5", "6", "7"]
+    assert ids(buffer.after(1, T0 + timedelta(seconds=5), limit=1)) == ["6"]
+    # Message 2 was trimmed, so whatever follows second 2 is unknown
+    assert buffer.after(1, T0 + timedelta(seconds=2), limit=10) is None
+    assert buffer.before(1, T0 + timedelta(seconds=8), limit=6) is None
+    assert ids(buffer.before(1, T0 + timedelta(seconds=8), limit=5)) == ["3", "4", "5", "6", "7"]
+
+
+def test_trim_boundary_inside_a_shared_timestamp_is_not_covered():
+    buffer = buffer_with(msg(1, 0), msg(2, 5), msg(3, 5), msg(4, 6), per_chat=2)
+
+    # Messages 2 and 3 share second 5 and only 3 was kept
+    assert buffer.after(1, T0 + timedelta(seconds=4), limit=10) is None
+    assert buffer.before(1, T0 + timedelta(seconds=7), limit=2) is None
+    assert ids(buffer.before(1, T0 + timedelta(seconds=7), limit=1)) == ["4"]
+
+
+def test_seed_before_extends_contiguous_coverage_only():
+    buffer = buffer_with(msg(10), msg(11))
+
+    # Not contiguous: ends before the buffer's coverage starts
+    buffer.seed_before(1, T0 + timedelta(seconds=5), [msg(3), msg(4)], limit=2)
+    assert buffer.get(1, "3") is None
+
+    buffer.seed_before(1, T0 + timedelta(seconds=10), [msg(8), msg(9)], limit=2)
+    assert ids(buffer.before(1, T0 + timedelta(seconds=11), limit=3)) == ["8", "9", "10"]
+    # Firestore returned a full page, so nothing is known before message 8
+    assert buffer.before(1, T0 + timedelta(seconds=11), limit=4) is None
+
+
+def test_edits_replace_the_buffered_message():
+    buffer = buffer_with(msg(1), msg(2))
+    buffer.add(1, {**msg(2), "text": "edited"})
+    buffer.update(1, "1", {"is_reported": True})
+
+    assert ids(buffer.after(1, T0 + timedelta(seconds=1), limit=10)) == ["2"]
+    assert buffer.get(1, "2")["text"] == "edited"
+    assert buffer.get(1, "1")["is_reported"] is True
+
+
+def test_least_recently_used_chats_are_evicted():
+    buffer = RecentMessages(per_chat=5, max_chats=2)
+    buffer.add(1, msg(1))
+    buffer.add(2, msg(1))
+    buffer.add(1, msg(2))
+    buffer.add(3, msg(1))
+
+    assert buffer.stats()["chats"] == 2
+    assert buffer.get(2, "1") is None
+    assert buffer.get(1, "2") is not None
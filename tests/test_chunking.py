@@ -0,0 +1,68 @@
+import pytest
+
+from src.utils.chunking import chunk_lines, estimate_tokens
+from src.utils.game_config import config
+
+
+def line(i, width=30):
+    return f"{i:04d} " + "x" * (width - 6) + "\n"
+
+
+def tokens(lines):
+    return sum(estimate_tokens(l) for l in lines)
+
+
+def test_everything_fits_in_one_chunk():
+    lines = [line(i) for i in range(5)]
+    assert chunk_lines(lines, token_budget=10_000, overlap=3) == [lines]
+
+
+def test_no_lines_give_no_chunks():
+    assert chunk_lines([], token_budget=100) == []
+
+
+@pytest.mark.parametrize("overlap", [0, 2, 5])
+def test_chunks_stay_within_the_budget_and_cover_every_line(overlap):
+    lines = [line(i) for i in range(100)]
+    budget = estimate_tokens(lines[0]) * 10
+
+    chunks = chunk_lines(lines, token_budget=budget, overlap=overlap)
+
+    assert len(chunks) > 1
+    assert all(tokens(chunk) <= budget for chunk in chunks)
+    # Concatenated without the repeated lines, the chunks are the input
+    seen = []
+    for chunk in chunks:
+        seen.extend(l for l in chunk if l not in seen)
+    assert seen == lines
+
+
+def test_neighbouring_chunks_repeat_the_overlap():
+    lines = [line(i) for i in range(50)]
+    budget = estimate_tokens(lines[0]) * 10
+
+    chunks = chunk_lines(lines, token_budget=budget, overlap=3)
+
+    for previous, current in zip(chunks, chunks[1:]):
+        assert current[:3] == previous[-3:]
+
+
+def test_overlap_shrinks_when_it_leaves_no_room_for_the_next_line():
+    small = [line(i) for i in range(4)]
+    budget = tokens(small)
+    # Leaves room for exactly one overlap line next to it
+    big = "y" * ((budget - estimate_tokens(small[0]) - 1) * config.AI_CHARS_PER_TOKEN - 1) + "\n"
+
+    chunks = chunk_lines(small + [big], token_budget=budget, overlap=4)
+
+    assert chunks == [small, [small[-1], big]]
+    assert all(tokens(chunk) <= budget for chunk in chunks)
+
+
+def test_a_line_over_the_budget_is_its_own_chunk():
+    huge = "z" * 1000 + "\n"
+    lines = [line(0), huge, line(1)]
+
+    chunks = chunk_lines(lines, token_budget=estimate_tokens(line(0)) * 2, overlap=0)
+
+    assert chunks == [[line(0)], [huge], [line(1)]]
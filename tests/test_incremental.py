@@ -0,0 +1,43 @@
+from src.services.incremental import merge_partial_verdicts
+from src.utils.game_config import config
+
+
+def offender(user_id, category, points, username="user"):
+    return {"user_id": user_id, "username": username, "category": category, "points": points,
+            "reason": f"{category} {points}", "quote": "..."}
+
+
+def test_slices_nominating_the_same_user_give_one_capped_entry():
+    slices = [
+        {"offenders": [offender(1, "Whining", config.POINTS_WHINING)]},
+        {"offenders": [offender(1, "нытьё ", config.POINTS_WHINING)]},
+        {"offenders": [offender(1, "Toxicity", config.POINTS_TOXICITY)]},
+        {"offenders": [offender(1, "Snitching", config.POINTS_SNITCHING)]},
+        {"offenders": [offender(1, "Stiffness", config.POINTS_STIFFNESS)]},
+    ]
+    result = merge_partial_verdicts(slices)
+
+    assert len(result["offenders"]) == 1
+    assert result["offenders"][0]["user_id"] == 1
+    assert result["offenders"][0]["points"] == config.DAILY_MAX_POINTS_PER_USER
+
+
+def test_a_series_across_slices_counts_once():
+    slices = [{"offenders": [offender(1, "Whining", config.POINTS_WHINING)]} for _ in range(6)]
+    result = merge_partial_verdicts(slices)
+
+    assert [off["points"] for off in result["offenders"]] == [config.POINTS_WHINING]
+
+
+def test_merged_offenders_are_limited_to_the_heaviest():
+    slices = [{"offenders": [offender(uid, "Whining", config.POINTS_WHINING)]} for uid in range(1, 6)]
+    slices.append({"offenders": [offender(9, "Toxicity", config.POINTS_TOXICITY)]})
+    result = merge_partial_verdicts(slices)
+
+    assert len(result["offenders"]) == config.DAILY_MAX_OFFENDERS
+    assert result["offenders"][0]["user_id"] == 9
+
+
+def test_empty_partials_are_skipped():
+    result = merge_partial_verdicts([None, {}, {"offenders": []}])
+    assert result == {"offenders": [], "new_agreements": [], "resolved_agreements": [], "updated_agreements": []}
@@ -0,0 +1,96 @@
+import asyncio
+import copy
+from datetime import datetime
+
+from google.cloud.firestore_v1 import _helpers, transforms
+
+from src.services.local_store import LocalAsyncClient
+
+
+def _field(data, path):
+    for part in path.parts:
+        data = data[part]
+    return data
+
+
+def _set_path(data, path, value):
+    for part in path.parts[:-1]:
+        data = data.setdefault(part, {})
+    data[path.parts[-1]] = value
+
+
+def sdk_merge_result(existing: dict, payload: dict) -> dict:
+    """
+    What Firestore stores for set(payload, merge=True), built from the write the SDK
+    sends: the plain fields under the update mask, then the field transforms.
+    """
+    extractor = _helpers.DocumentExtractorForMerge(payload)
+    extractor.apply_merge(True)
+    result = copy.deepcopy(existing)
+    for path in extractor.data_merge:
+        if path in extractor.deleted_fields:
+            continue
+        _set_path(result, path, copy.deepcopy(_field(extractor.set_fields, path)))
+    for path in extractor.deleted_fields:
+        parent = result
+        for part in path.parts[:-1]:
+            parent = parent.get(part, {})
+        parent.pop(path.parts[-1], None)
+    for path in extractor.server_timestamps:
+        _set_path(result, path, datetime)
+    for path, value in extractor.increments.items():
+        try:
+            current = _field(result, path)
+        except (KeyError, TypeError):
+            current = 0
+        _set_path(result, path, (current if isinstance(current, (int, float)) else 0) + value)
+    for path, values in extractor.array_unions.items():
+        _set_path(result, path, list(values))
+    return result
+
+
+def stored_after_merge(existing: dict, payload: dict) -> dict:
+    client = LocalAsyncClient()
+    ref = client.collection("chats").document("1")
+
+    async def run():
+        await ref.set(existing)
+        await ref.set(payload, merge=True)
+        return (await ref.get()).to_dict()
+
+    return asyncio.run(run())
+
+
+def _timestamps_as_type(data):
+    if isinstance(data, dict):
+        return {key: _timestamps_as_type(value) for key, value in data.items()}
+    return datetime if isinstance(data, datetime) else data
+
+
+def test_nested_set_merge_resolves_sentinels_in_new_maps_like_the_sdk():
+    existing = {"users": {"1": {"points": 3, "name": "old"}}}
+    payload = {
+        "users": {
+            "1": {"points": transforms.Increment(2)},
+            "2": {
+                "points": transforms.Increment(5),
+                "seen": transforms.SERVER_TIMESTAMP,
+                "tags": transforms.ArrayUnion(["a"]),
+                "profile": {"visits": transforms.Increment(1), "name": "new"},
+            },
+        },
+        "updated_at": transforms.SERVER_TIMESTAMP,
+    }
+
+    stored = stored_after_merge(existing, payload)
+
+    assert _timestamps_as_type(stored) == sdk_merge_result(existing, payload)
+    assert stored["users"]["2"]["points"] == 5
+    assert stored["users"]["1"] == {"points": 5, "name": "old"}
+
+
+def test_delete_field_inside_a_merge_removes_the_field():
+    existing = {"users": {"1": {"points": 3, "name": "old"}}}
+    payload = {"users": {"1": {"name": transforms.DELETE_FIELD}}}
+
+    assert stored_after_merge(existing, payload) == sdk_merge_result(existing, payload)
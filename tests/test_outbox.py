@@ -0,0 +1,64 @@
+import pytest
+
+from src.bot import outbox
+from src.bot.outbox import TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(outbox.time, "monotonic", clock)
+    return clock
+
+
+def test_burst_is_free_then_reservations_queue_at_the_rate(clock):
+    bucket = TokenBucket(rate=2.0, capacity=3)
+
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    # Each further token is half a second after the previous one
+    assert [bucket.reserve() for _ in range(3)] == pytest.approx([0.5, 1.0, 1.5])
+
+
+def test_tokens_refill_over_time_up_to_capacity(clock):
+    bucket = TokenBucket(rate=2.0, capacity=3)
+    for _ in range(3):
+        bucket.reserve()
+
+    clock.now += 1.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(0.5)
+
+    clock.now += 60
+    assert [bucket.reserve() for _ in range(4)] == pytest.approx([0.0, 0.0, 0.0, 0.5])
+
+
+def test_block_delays_everything_and_drops_the_saved_burst(clock):
+    bucket = TokenBucket(rate=1.0, capacity=5)
+
+    bucket.block(2)
+    assert bucket.reserve() == pytest.approx(2.0)
+    assert not bucket.idle
+
+    clock.now += 2
+    # Only the two seconds of refill are there, minus the token reserved during the block
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(1.0)
+
+
+def test_idle_once_full_and_unblocked(clock):
+    bucket = TokenBucket(rate=1.0, capacity=2)
+    assert bucket.idle
+
+    bucket.reserve()
+    assert not bucket.idle
+    clock.now += 1
+    assert bucket.idle
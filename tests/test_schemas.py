@@ -0,0 +1,40 @@
+import importlib
+
+import pytest
+
+from src.utils import schemas
+from src.utils.game_config import config
+
+
+def object_schemas(schema):
+    """Every object schema with properties, nested ones included."""
+    if isinstance(schema, dict):
+        if "properties" in schema:
+            yield schema
+        for value in schema.values():
+            yield from object_schemas(value)
+    elif isinstance(schema, list):
+        for value in schema:
+            yield from object_schemas(value)
+
+
+@pytest.fixture(params=[False, True], ids=["agreements_off", "agreements_on"])
+def verdict_schemas(request, monkeypatch):
+    monkeypatch.setattr(config, "ENABLE_AGREEMENTS", request.param)
+    yield importlib.reload(schemas)
+    monkeypatch.undo()
+    importlib.reload(schemas)
+
+
+def test_every_object_schema_sets_property_ordering(verdict_schemas):
+    for schema in (verdict_schemas.DAILY_VERDICT_SCHEMA, verdict_schemas.REPORT_VERDICT_SCHEMA):
+        found = list(object_schemas(schema))
+        assert found
+        for obj in found:
+            assert "propertyOrdering" in obj
+            assert sorted(obj["propertyOrdering"]) == sorted(obj["properties"])
+
+
+def test_reasoning_is_generated_first(verdict_schemas):
+    assert verdict_schemas.DAILY_VERDICT_SCHEMA["propertyOrdering"][0] == "reasoning"
+    assert verdict_schemas.REPORT_VERDICT_SCHEMA["propertyOrdering"][0] == "reasoning"
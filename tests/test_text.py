@@ -0,0 +1,68 @@
+import re
+
+from src.utils.text import TELEGRAM_MESSAGE_LIMIT, split_message
+
+
+def words_of(parts):
+    return "".join(parts).split()
+
+
+def test_short_text_is_one_part():
+    assert split_message("hello") == ["hello"]
+
+
+def test_lines_are_packed_up_to_the_limit():
+    lines = [f"line {i:04d} " + "x" * 90 + "\n" for i in range(200)]
+    text = "".join(lines)
+
+    parts = split_message(text)
+
+    assert len(parts) > 1
+    assert all(len(part) <= TELEGRAM_MESSAGE_LIMIT for part in parts)
+    assert "".join(parts) == text
+    assert all(part.endswith("\n") for part in parts)
+
+
+def test_a_long_line_is_cut_between_words():
+    words = [f"word{i}" for i in range(2000)]
+    text = " ".join(words)
+
+    parts = split_message(text)
+
+    assert len(parts) > 1
+    assert all(len(part) <= TELEGRAM_MESSAGE_LIMIT for part in parts)
+    assert words_of(parts) == words
+
+
+def test_html_entities_and_tags_are_not_cut():
+    text = "<b>" + " ".join(["a&amp;b"] * 1500) + "</b> <a href='tg://user?id=1'>" + "name " * 300 + "</a>"
+
+    parts = split_message(text, parse_html=True)
+
+    assert len(parts) > 1
+    for part in parts:
+        assert len(part) <= TELEGRAM_MESSAGE_LIMIT
+        # No tag or entity is cut in half
+        assert not re.search(r"<[^>]*$|&\w*$", part)
+        assert not re.match(r"^[^<]*>|^\w*;", part)
+        # Every part closes what it opens
+        opened = re.findall(r"<([a-z]+)[^>]*>", part)
+        closed = re.findall(r"</([a-z]+)>", part)
+        assert sorted(opened) == sorted(closed)
+
+
+def test_a_tag_open_at_a_cut_is_reopened_in_the_next_part():
+    text = "<i>" + "word " * 1000 + "</i>"
+
+    first, second = split_message(text, parse_html=True)
+
+    assert first.startswith("<i>") and first.endswith("</i>")
+    assert second.startswith("<i>") and second.endswith("</i>")
+
+
+def test_a_word_longer_than_the_limit_is_cut_inside():
+    text = "x" * (TELEGRAM_MESSAGE_LIMIT * 2 + 10)
+
+    parts = split_message(text)
+
+    assert [len(part) for part in parts] == [TELEGRAM_MESSAGE_LIMIT, TELEGRAM_MESSAGE_LIMIT, 10]
@@ -0,0 +1,84 @@
+import asyncio
+
+from src.services import metrics
+from src.services.write_buffer import WriteBuffer
+
+
+class FakeRef:
+    def __init__(self, store, path):
+        self.store = store
+        self.path = path
+
+    async def set(self, data, merge=False):
+        self.store.commit([(self, data)])
+
+
+class FakeBatch:
+    def __init__(self, store):
+        self.store = store
+        self.writes = []
+
+    def set(self, ref, data, merge=False):
+        self.writes.append((ref, data))
+
+    async def commit(self):
+        self.store.commit(self.writes)
+
+
+class FakeClient:
+    """Commits all or nothing; writes to a path in `bad` always fail."""
+
+    def __init__(self, bad=()):
+        self.bad = set(bad)
+        self.docs = {}
+        self.commits = 0
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def ref(self, path):
+        return FakeRef(self, path)
+
+    def commit(self, writes):
+        self.commits += 1
+        if any(ref.path in self.bad for ref, _ in writes):
+            raise ValueError("invalid document")
+        for ref, data in writes:
+            self.docs[ref.path] = data
+
+
+def test_a_bad_write_is_dropped_after_max_attempts():
+    client = FakeClient(bad={"chats/1/bad"})
+    buffer = WriteBuffer(client, max_size=100, flush_interval=60, max_attempts=3)
+    buffer._task = object()  # buffer writes without starting the loop
+    dropped_before = sum(metrics.write_buffer_dropped._values.values())
+
+    async def run():
+        await buffer.set(client.ref("chats/1/bad"), {"a": 1})
+        await buffer.set(client.ref("chats/1/good"), {"b": 2})
+        for _ in range(3):
+            await buffer.flush()
+
+    asyncio.run(run())
+
+    assert client.docs == {"chats/1/good": {"b": 2}}
+    assert buffer.stats()["pending"] == 0
+    assert buffer.stats()["dropped"] == 1
+    assert sum(metrics.write_buffer_dropped._values.values()) == dropped_before + 1
+
+
+def test_a_failed_write_is_kept_while_attempts_remain():
+    client = FakeClient(bad={"chats/1/doc"})
+    buffer = WriteBuffer(client, max_size=100, flush_interval=60, max_attempts=3)
+    buffer._task = object()
+
+    async def run():
+        await buffer.set(client.ref("chats/1/doc"), {"a": 1})
+        await buffer.flush()
+        client.bad.clear()
+        await buffer.flush()
+
+    asyncio.run(run())
+
+    assert client.docs == {"chats/1/doc": {"a": 1}}
+    assert buffer.stats()["dropped"] == 0